@@ -0,0 +1,120 @@
+import numpy as np
+
+from AlphaZero.env import dihedral
+
+
+class BoardHistory(object):
+    """The boards before the last moves of a game, kept in one preallocated int8 ring buffer.
+
+    Indexing and iterating goes from the oldest board to the newest one like the list of boards it replaces.
+    Every board is written twice, at its slot and at its slot + length, so that the boards in order are
+    always a contiguous slice of the buffer and ordered() does not copy. A copy of the history is a single
+    copy of the buffer.
+    """
+
+    def __init__(self, length, height, width):
+        """
+        Args:
+            length: the number of boards kept
+            height: the height of the boards
+            width: the width of the boards
+        """
+        self.length = length
+        self._boards = np.zeros((2 * length, height, width), dtype=np.int8)
+        # The slot of the oldest board
+        self._start = 0
+
+    def copy(self):
+        """
+        Returns:
+            AlphaZero.env.board_history.BoardHistory: a copy of this history
+        """
+        other = BoardHistory.__new__(BoardHistory)
+        other.length = self.length
+        other._boards = self._boards.copy()
+        other._start = self._start
+        return other
+
+    def ordered(self):
+        """
+        Returns:
+            numpy.ndarray: a read-only view of the boards of shape (length, height, width), the oldest first
+        """
+        view = self._boards[self._start:self._start + self.length]
+        view.flags.writeable = False
+        return view
+
+    def push(self, board):
+        """Saves a board as the newest one, the oldest board is dropped.
+
+        Args:
+            board: the board to save, it is copied
+
+        Returns:
+            None
+        """
+        if self.length == 0:
+            return
+        self._boards[self._start] = board
+        self._boards[self._start + self.length] = board
+        self._start = (self._start + 1) % self.length
+
+    def next_dropped(self, board):
+        """Gets the board that push(board) will drop, to be given back to pop when the push is taken back.
+
+        Args:
+            board: the board to push next
+
+        Returns:
+            numpy.ndarray: a copy of the oldest board, or of board itself if no board is kept
+        """
+        if self.length == 0:
+            return np.array(board, dtype=np.int8)
+        return self._boards[self._start].copy()
+
+    def pop(self, oldest_board):
+        """Takes back the last push, the inverse of push.
+
+        Args:
+            oldest_board: the board dropped by the last push, it becomes the oldest board again
+
+        Returns:
+            numpy.ndarray: a new int array with the newest board
+        """
+        if self.length == 0:
+            # The pushed board was the one dropped
+            return oldest_board.astype(int)
+        self._start = (self._start - 1) % self.length
+        newest = self._boards[self._start].astype(int)
+        self._boards[self._start] = oldest_board
+        self._boards[self._start + self.length] = oldest_board
+        return newest
+
+    def clear(self):
+        """Fills every board with zeros, as at the start of a game.
+
+        Returns:
+            None
+        """
+        self._boards.fill(0)
+        self._start = 0
+
+    def transform(self, transform_id):
+        """Transforms every board according to D(4) like the transform of the game states.
+
+        Args:
+            transform_id: integer in range [0, 7]
+
+        Returns:
+            None
+        """
+        self._boards = dihedral.transform(self._boards, transform_id)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        return self.ordered()[index]
+
+    def __iter__(self):
+        return iter(self.ordered())
@@ -0,0 +1,52 @@
+import numpy as np
+
+# The permutations are the same for every board of the same shape, hence this shared
+# lookup table {(height, width): [(permutation, transformed shape) for each transform_id]}
+_PERMUTATION_CACHE = {}
+
+
+def permutations(height, width):
+    """Gets the flat index permutations of the 8 transforms of D(4) of the boards of a shape.
+    Transform transform_id reflects the board with np.fliplr if transform_id // 4 == 1, then rotates it with
+    np.rot90 transform_id % 4 times, as the transform of the game states.
+
+    Args:
+        height: the height of the board
+        width: the width of the board
+
+    Returns:
+        list: (permutation, shape) for each transform_id, where the transformed board of that shape is
+        board.ravel()[permutation]: the position at flat index j of the transformed board comes from flat
+        index permutation[j] of the board
+    """
+    tables = _PERMUTATION_CACHE.get((height, width))
+    if tables is None:
+        index = np.arange(height * width).reshape((height, width))
+        tables = []
+        for transform_id in range(8):
+            b = index
+            # Performs reflection
+            if transform_id // 4 == 1:
+                b = np.fliplr(b)
+            # Performs rotation
+            b = np.rot90(b, transform_id % 4)
+            permutation = b.flatten()
+            permutation.setflags(write=False)
+            tables.append((permutation, b.shape))
+        _PERMUTATION_CACHE[(height, width)] = tables
+    return tables
+
+
+def transform(planes, transform_id):
+    """Transforms the boards in the last two axes of an array with one gather.
+
+    Args:
+        planes: an array of shape (..., height, width)
+        transform_id: integer in range [0, 7]
+
+    Returns:
+        numpy.ndarray: a new array with the transformed boards
+    """
+    permutation, shape = permutations(planes.shape[-2], planes.shape[-1])[transform_id]
+    lead = planes.shape[:-2]
+    return planes.reshape(lead + (-1,))[..., permutation].reshape(lead + shape)
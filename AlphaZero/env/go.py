@@ -1,11 +1,9 @@
-from copy import deepcopy
-
 import numpy as np
 
-WHITE = -1
-BLACK = +1
-EMPTY = 0
-PASS_MOVE = None
+from AlphaZero.env import dihedral
+from AlphaZero.env.board_history import BoardHistory
+from AlphaZero.env.go_constants import WHITE, BLACK, EMPTY, PASS_MOVE
+from AlphaZero.env.go_scoring import area_score
 
 
 class GameState(object):
@@ -15,6 +13,9 @@ class GameState(object):
     # Looking up positions adjacent to a given position takes a surprising
     # amount of time, hence this shared lookup table {boardsize: {position: [neighbors]}}
     __NEIGHBORS_CACHE = {}
+    __DIAGONALS_CACHE = {}
+    # Zobrist keys are drawn once per board size and shared {boardsize: {color: keys}}
+    __HASH_CACHE = {}
 
     def __init__(self, size=19, komi=7.5, enforce_superko=False, history_length=8):
         self.board = np.zeros((size, size), dtype=int)
@@ -31,7 +32,7 @@ class GameState(object):
         # Fill zeros for non-existing histories
         # board_history does not include the current board while the feature does,
         self.history_length = history_length
-        self.board_history = [np.zeros((size, size), dtype=int) for _ in range(history_length - 1)]
+        self.board_history = BoardHistory(history_length - 1, size, size)
         self.num_black_prisoners = 0
         self.num_white_prisoners = 0
         self.is_end_of_game = False
@@ -44,10 +45,8 @@ class GameState(object):
         # optimize update functions (e.g. do_move) and in doing so indirectly
         # speed up any function that queries liberties
         self._create_neighbors_cache()
-        self.liberty_sets = [[set() for _ in range(size)] for _ in range(size)]
-        for x in range(size):
-            for y in range(size):
-                self.liberty_sets[x][y] = set(self._neighbors((x, y)))
+        neighbors = GameState.__NEIGHBORS_CACHE[size]
+        self.liberty_sets = [[set(neighbors[(x, y)]) for y in range(size)] for x in range(size)]
         # separately cache the 2D numpy array of the _size_ of liberty sets
         # at each board position
         self.liberty_counts = np.zeros((size, size), dtype=int)
@@ -60,18 +59,18 @@ class GameState(object):
         # separate list for eye-moves on request)
         self.__legal_move_cache = None
         self.__legal_eyes_cache = None
-        # on-the-fly record of 'age' of each stone
-        self.stone_ages = np.zeros((size, size), dtype=np.int) - 1
 
         # setup Zobrist hash to keep track of board state
         self.enforce_superko = enforce_superko
-        rng = np.random.RandomState(0)
-        self.hash_lookup = {
-            WHITE: rng.randint(np.iinfo(np.uint64).max, size=(size, size), dtype='uint64'),
-            BLACK: rng.randint(np.iinfo(np.uint64).max, size=(size, size), dtype='uint64')}
+        self._create_hash_cache()
+        self.hash_lookup = GameState.__HASH_CACHE[size]
         self.current_hash = np.uint64(0)
         self.previous_hashes = set()
         self.turns = 0
+        # Records of the moves that can be taken back, None until enable_undo is called
+        self._undo_stack = None
+        # Optional per-point bookkeeping for the features, see add_tracker
+        self.trackers = {}
 
     def get_group(self, position):
         """
@@ -137,6 +136,24 @@ class GameState(object):
                     neighbors = [xy for xy in [(x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)]
                                  if self._on_board(xy)]
                     GameState.__NEIGHBORS_CACHE[self.size][(x, y)] = neighbors
+        if self.size not in GameState.__DIAGONALS_CACHE:
+            GameState.__DIAGONALS_CACHE[self.size] = {}
+            for x in range(self.size):
+                for y in range(self.size):
+                    diagonals = [xy for xy in [(x - 1, y - 1), (x + 1, y + 1), (x + 1, y - 1), (x - 1, y + 1)]
+                                 if self._on_board(xy)]
+                    GameState.__DIAGONALS_CACHE[self.size][(x, y)] = diagonals
+
+    def _create_hash_cache(self):
+        if self.size not in GameState.__HASH_CACHE:
+            rng = np.random.RandomState(0)
+            hash_lookup = {
+                WHITE: rng.randint(np.iinfo(np.uint64).max, size=(self.size, self.size), dtype='uint64'),
+                BLACK: rng.randint(np.iinfo(np.uint64).max, size=(self.size, self.size), dtype='uint64')}
+            # the keys are shared by all the states of this size
+            for keys in hash_lookup.values():
+                keys.setflags(write=False)
+            GameState.__HASH_CACHE[self.size] = hash_lookup
 
     def _neighbors(self, position):
         """
@@ -162,9 +179,7 @@ class GameState(object):
             list: a list of tuples.
         """
 
-        (x, y) = position
-        return filter(self._on_board, [(x - 1, y - 1), (x + 1, y + 1),
-                                       (x + 1, y - 1), (x - 1, y + 1)])
+        return GameState.__DIAGONALS_CACHE[self.size][position]
 
     def _update_neighbors(self, position):
         """
@@ -222,7 +237,6 @@ class GameState(object):
             self.group_sets[x][y] = set()
             self.liberty_sets[x][y] = set()
             self.liberty_counts[x][y] = -1
-            self.stone_ages[x][y] = -1
             for (nx, ny) in self._neighbors((x, y)):
                 if self.board[nx, ny] == EMPTY:
                     # add empty neighbors of (x,y) to its liberties
@@ -234,24 +248,24 @@ class GameState(object):
                         self.liberty_counts[gx][gy] = len(self.liberty_sets[nx][ny])
 
     def copy(self):
-        """Gets a copy of this Game state
+        """Gets a copy of this Game state. The per-size tables are shared, only the board and the
+        group and liberty sets are copied.
 
         Returns:
             AlphaZero.env.go.GameState: a copy of this Game state
         """
-        other = GameState(self.size, self.komi)
+        other = GameState.__new__(GameState)
+        other.__dict__.update(self.__dict__)
         other.board = self.board.copy()
-        other.current_player = self.current_player
-        other.ko = self.ko
         other.handicaps = list(self.handicaps)
         other.history = list(self.history)
-        other.board_history = deepcopy(self.board_history)
-        other.num_black_prisoners = self.num_black_prisoners
-        other.num_white_prisoners = self.num_white_prisoners
-        other.enforce_superko = self.enforce_superko
-        other.current_hash = self.current_hash.copy()
+        other.board_history = self.board_history.copy()
         other.previous_hashes = self.previous_hashes.copy()
-        other.turns = self.turns
+        other.liberty_counts = self.liberty_counts.copy()
+        other.__legal_move_cache = None
+        other.__legal_eyes_cache = None
+        other._undo_stack = None
+        other.trackers = {name: tracker.copy() for name, tracker in self.trackers.items()}
 
         # update liberty and group sets.
         #
@@ -259,16 +273,15 @@ class GameState(object):
         # group.  We need to make sure this is the case in the copy, as well.
         #
         # we store set copies indexed by original id() in set_copies
-        def get_copy(s, set_copies={}):
+        set_copies = {}
+
+        def get_copy(s):
             if id(s) not in set_copies:
                 set_copies[id(s)] = set(s)  # makes a copy of s
             return set_copies[id(s)]
 
-        for x in range(self.size):
-            for y in range(self.size):
-                other.group_sets[x][y] = get_copy(self.group_sets[x][y])
-                other.liberty_sets[x][y] = get_copy(self.liberty_sets[x][y])
-        other.liberty_counts = self.liberty_counts.copy()
+        other.group_sets = [[get_copy(s) for s in row] for row in self.group_sets]
+        other.liberty_sets = [[get_copy(s) for s in row] for row in self.liberty_sets]
         return other
 
     def is_suicide(self, action):
@@ -301,33 +314,41 @@ class GameState(object):
         return False
 
     def is_positional_superko(self, action):
-        """Find all actions that the current_player has done in the past, taking into
-        account the fact that history starts with BLACK when there are no
-        handicaps or with WHITE when there are.
+        """Checks if playing action repeats a previous board position. The hash of the board after the move
+        is worked out without playing it, so the state is neither copied nor modified.
+
         Args:
-            action: a tuple of (x, y)
+            action: a tuple of (x, y), an empty position where the move is not suicide
 
         Returns:
             bool: if the move is positional superko.
         """
-        if len(self.handicaps) == 0 and self.current_player == BLACK:
-            player_history = self.history[0::2]
-        elif len(self.handicaps) > 0 and self.current_player == WHITE:
-            player_history = self.history[0::2]
-        else:
-            player_history = self.history[1::2]
+        return self._hash_after_move(action) in self.previous_hashes
 
-        if action not in self.handicaps and action not in player_history:
-            return False
+    def _hash_after_move(self, action):
+        """
+        A private helper function to work out the hash of the board after current_player plays at action,
+        from the stone placed and the groups it captures, without playing the move.
 
-        state_copy = self.copy()
-        state_copy.enforce_superko = False
-        state_copy.do_move(action)
+        Args:
+            action: a tuple of (x, y), an empty position where the move is not suicide
 
-        if state_copy.current_hash in self.previous_hashes:
-            return True
-        else:
-            return False
+        Returns:
+            numpy.uint64: the hash of the board after the move
+        """
+        color = self.current_player
+        new_hash = self.current_hash ^ self.hash_lookup[color][action]
+        captured = []
+        for (nx, ny) in self._neighbors(action):
+            # an opponent group whose only liberty is action is captured
+            if self.board[nx, ny] == -color and len(self.liberty_sets[nx][ny]) == 1:
+                group = self.group_sets[nx][ny]
+                if any(group is other for other in captured):
+                    continue
+                captured.append(group)
+                for position in group:
+                    new_hash ^= self.hash_lookup[-color][position]
+        return new_hash
 
     def is_legal(self, action):
         """
@@ -403,6 +424,33 @@ class GameState(object):
                 return False
         return True
 
+    def legal_mask(self):
+        """
+        Computes the legal moves of current_player with array operations on the board and the liberty counts.
+        A move on an empty position is not suicide if a neighbor is empty, is a friendly group with another
+        liberty, or is an opponent group in atari.
+
+        Returns:
+            numpy.ndarray: a flat boolean array of size * size + 1 entries, True for the legal moves.
+            Position (x, y) is at index x * size + y and the pass move is the last entry.
+        """
+        color = self.current_player
+        empty = self.board == EMPTY
+        saved_by = empty | ((self.board == color) & (self.liberty_counts > 1)) | \
+            ((self.board == -color) & (self.liberty_counts == 1))
+        padded = np.zeros((self.size + 2, self.size + 2), dtype=bool)
+        padded[1:-1, 1:-1] = saved_by
+        legal = empty & (padded[:-2, 1:-1] | padded[2:, 1:-1] | padded[1:-1, :-2] | padded[1:-1, 2:])
+        if self.ko is not None:
+            legal[self.ko] = False
+        if self.enforce_superko:
+            for (x, y) in zip(*np.nonzero(legal)):
+                if self.is_positional_superko((x, y)):
+                    legal[x, y] = False
+        mask = np.ones(self.size * self.size + 1, dtype=bool)
+        mask[:-1] = legal.ravel()
+        return mask
+
     def get_legal_moves(self, include_eyes=True):
         """
 
@@ -428,6 +476,16 @@ class GameState(object):
                         self.__legal_eyes_cache.append((x, y))
         return self.get_legal_moves(include_eyes)
 
+    def get_score(self):
+        """Calculate the Tromp-Taylor area score of the board state: the stones of each player plus the empty
+        regions reaching the stones of that player only. Komi is added to WHITE, passes do not count.
+
+        Returns:
+            tuple: (winner, margin), the color of the winner (0 for a tie) and the score of BLACK minus the
+            score of WHITE
+        """
+        return area_score(self.board, self.komi)
+
     def get_winner(self):
         """Calculate score of board state and return player ID (1, -1, or 0 for tie)
         corresponding to winner. Uses 'Area scoring'.
@@ -435,28 +493,7 @@ class GameState(object):
         Returns:
             int: the color of the winner.
         """
-
-        # Count number of positions filled by each player, plus 1 for each eye-ish space owned
-        score_white = np.sum(self.board == WHITE)
-        score_black = np.sum(self.board == BLACK)
-        empties = zip(*np.where(self.board == EMPTY))
-        for empty in empties:
-            # Check that all surrounding points are of one color
-            if self.is_eyeish(empty, BLACK):
-                score_black += 1
-            elif self.is_eyeish(empty, WHITE):
-                score_white += 1
-        score_white += self.komi
-        score_white -= self.passes_white
-        score_black -= self.passes_black
-        if score_black > score_white:
-            winner = BLACK
-        elif score_white > score_black:
-            winner = WHITE
-        else:
-            # Tie
-            winner = 0
-        return winner
+        return self.get_score()[0]
 
     def place_handicaps(self, actions):
         """
@@ -473,7 +510,9 @@ class GameState(object):
         for action in actions:
             self.do_move(action, BLACK)
         self.history = []
-        self.board_history = [np.zeros((self.size, self.size), dtype=int) for _ in range(self.history_length - 1)]
+        self.board_history.clear()
+        for tracker in self.trackers.values():
+            tracker.on_reset(self)
 
     def place_handicap_stone(self, action, color=BLACK):
         """
@@ -512,22 +551,21 @@ class GameState(object):
         reset_player = self.current_player
         self.current_player = color
         if self.is_legal(action):
+            if self._undo_stack is not None:
+                self._undo_stack.append(self._undo_record(action, color, reset_player))
             # reset ko
             self.ko = None
-            # increment age of stones by 1
-            self.stone_ages[self.stone_ages >= 0] += 1
             # save current board to history before it is modified
-            self.board_history.append(self.board.copy())
-            self.board_history.pop(0)
+            self.board_history.push(self.board)
 
             if action is not PASS_MOVE:
                 (x, y) = action
                 self.board[x][y] = color
                 self._update_hash(action, color)
                 self._update_neighbors(action)
-                self.stone_ages[x][y] = 0
 
                 # check neighboring groups' liberties for captures
+                total_captured = 0
                 for (nx, ny) in self._neighbors(action):
                     if self.board[nx, ny] == -color and len(self.liberty_sets[nx][ny]) == 0:
                         # capture occurred!
@@ -538,16 +576,18 @@ class GameState(object):
                             self.num_white_prisoners += num_captured
                         else:
                             self.num_black_prisoners += num_captured
-                        # check for ko
-                        if num_captured == 1:
-                            # it is a ko iff, were the opponent to play at the captured position,
-                            # it would recapture (x,y) only
-                            # (a bigger group containing xy may be captured - this is 'snapback')
-                            would_recapture = len(self.liberty_sets[x][y]) == 1
-                            recapture_size_is_1 = len(self.group_sets[x][y]) == 1
-                            if would_recapture and recapture_size_is_1:
-                                # note: (nx,ny) is the stone that was captured
-                                self.ko = (nx, ny)
+                        total_captured += num_captured
+                        captured = (nx, ny)
+                # check for ko, capturing two single stones is not a ko
+                if total_captured == 1:
+                    # it is a ko iff, were the opponent to play at the captured position,
+                    # it would recapture (x,y) only
+                    # (a bigger group containing xy may be captured - this is 'snapback')
+                    would_recapture = len(self.liberty_sets[x][y]) == 1
+                    recapture_size_is_1 = len(self.group_sets[x][y]) == 1
+                    if would_recapture and recapture_size_is_1:
+                        # note: captured is the stone that was captured
+                        self.ko = captured
                 # _remove_group has finished updating the hash
                 self.previous_hashes.add(self.current_hash)
             else:
@@ -559,6 +599,8 @@ class GameState(object):
             self.current_player = -color
             self.history.append(action)
             self.turns += 1
+            for tracker in self.trackers.values():
+                tracker.on_move(self, action, color)
             self.__legal_move_cache = None
         else:
             self.current_player = reset_player
@@ -570,6 +612,102 @@ class GameState(object):
                 self.is_end_of_game = True
         return self.is_end_of_game
 
+    def _undo_record(self, action, color, reset_player):
+        """
+        A private helper function to save what do_move changes before the move is played.
+        The group and liberty sets changed by a move are the sets of action and its neighbors,
+        of the friendly groups it merges, of the captured groups and of the neighbors of the captured stones.
+        The sets are saved together with their contents, so that undo_move keeps them shared within the groups.
+
+        Args:
+            action: a tuple of (x, y) or PASS_MOVE
+            color: the color of the move
+            reset_player: the current player before the move
+
+        Returns:
+            tuple: the record used by undo_move
+        """
+        set_refs = []
+        set_contents = {}
+        if action is not PASS_MOVE:
+            positions = {action}
+            for (nx, ny) in self._neighbors(action):
+                positions.add((nx, ny))
+                if self.board[nx][ny] == color:
+                    positions |= self.group_sets[nx][ny]
+                elif self.board[nx][ny] == -color and self.liberty_sets[nx][ny] == {action}:
+                    # the group will be captured
+                    for (gx, gy) in self.group_sets[nx][ny]:
+                        positions.add((gx, gy))
+                        positions.update(self._neighbors((gx, gy)))
+            for (x, y) in positions:
+                group_set, liberty_set = self.group_sets[x][y], self.liberty_sets[x][y]
+                set_refs.append(((x, y), group_set, liberty_set))
+                for s in (group_set, liberty_set):
+                    if id(s) not in set_contents:
+                        set_contents[id(s)] = (s, list(s))
+        return (reset_player, self.ko, self.board_history.next_dropped(self.board), self.current_hash,
+                len(self.previous_hashes), self.num_black_prisoners, self.num_white_prisoners, self.passes_black,
+                self.passes_white,
+                self.is_end_of_game, self.liberty_counts.copy(),
+                set_refs, list(set_contents.values()))
+
+    def enable_undo(self):
+        """Starts recording the moves played with do_move, so that they can be taken back with undo_move.
+        Copies of this state do not record their moves.
+
+        Returns:
+            None
+        """
+        self._undo_stack = []
+
+    def add_tracker(self, name, tracker):
+        """Registers a tracker of per-point bookkeeping, available as self.trackers[name]. Trackers are
+        added before the first move and follow the state through do_move, undo_move, transform and copy.
+
+        Args:
+            name: the name of the tracker
+            tracker: an object with on_move(state, action, color) and on_undo(state, action) methods,
+                called after the move is played or taken back, an on_reset(state) method called when
+                place_handicaps resets the history, a transform(transform_id) method called by transform
+                and a copy() method
+
+        Returns:
+            None
+        """
+        self.trackers[name] = tracker
+
+    def undo_move(self):
+        """Takes back the last move played since enable_undo was called, restoring the state before it.
+        An IllegalMove exception is raised if there is no such move.
+
+        Returns:
+            None
+        """
+        if not self._undo_stack:
+            raise IllegalMove("No move to undo")
+        (player, self.ko, oldest_board, current_hash, num_hashes, self.num_black_prisoners,
+         self.num_white_prisoners, self.passes_black, self.passes_white, self.is_end_of_game,
+         self.liberty_counts, set_refs, set_contents) = self._undo_stack.pop()
+        # the position after the move is forgotten unless it was reached before
+        if len(self.previous_hashes) > num_hashes:
+            self.previous_hashes.discard(self.current_hash)
+        self.current_hash = current_hash
+        # The last history board is the board before the move
+        self.board = self.board_history.pop(oldest_board)
+        for ((x, y), group_set, liberty_set) in set_refs:
+            self.group_sets[x][y] = group_set
+            self.liberty_sets[x][y] = liberty_set
+        for (s, contents) in set_contents:
+            s.clear()
+            s.update(contents)
+        action = self.history.pop()
+        self.turns -= 1
+        self.current_player = player
+        self.__legal_move_cache = None
+        for tracker in self.trackers.values():
+            tracker.on_undo(self, action)
+
     def transform(self, transform_id):
         """Transform the current board and the history boards according to D(4).
             Caution: self.history (action history) is not modified, thus this function
@@ -582,16 +720,13 @@ class GameState(object):
             None
 
         """
-        def _transform(b):
-            # Performs reflection
-            if transform_id // 4 == 1:
-                b = np.fliplr(b)
-            # Performs rotation
-            b = np.rot90(b, transform_id % 4)
-            return b
         # List of boards to transform
-        self.board = _transform(self.board)
-        self.board_history = [_transform(b) for b in self.board_history]
+        self.board = dihedral.transform(self.board, transform_id)
+        self.board_history.transform(transform_id)
+        for tracker in self.trackers.values():
+            tracker.transform(transform_id)
+        # Transformed states are told apart by the evaluation cache
+        self.transform_id = transform_id
 
 
 class IllegalMove(Exception):
@@ -0,0 +1,697 @@
+import numpy as np
+
+from AlphaZero.env import dihedral
+from AlphaZero.env.board_history import BoardHistory
+from AlphaZero.env.go import BLACK, WHITE, EMPTY, PASS_MOVE, IllegalMove
+from AlphaZero.env.go_scoring import area_score
+
+
+class GameState(object):
+    """State of a game of Go with the same interface as AlphaZero.env.go.GameState, stored in flat arrays.
+
+    A point (x, y) is the flat index x * size + y. Groups are kept with union-find: every stone points to the
+    root of its group, and the stones of a group form a circular list, so merging relabels the smaller group
+    and capturing walks the list. Instead of liberty sets, the root keeps the number of pseudo-liberties
+    (an empty point adjacent to n stones of the group counts n times) with their sum and sum of squares.
+    A group has no liberty iff the count is 0, and exactly one liberty iff count * sum_sq == sum * sum.
+    Copying a state only copies a few lists, which makes it cheap enough to copy once per playout.
+    """
+
+    # Looking up positions adjacent to a given position takes a surprising
+    # amount of time, hence this shared lookup table {boardsize: (flat neighbors of every point)}
+    __NEIGHBORS_CACHE = {}
+    __DIAGONALS_CACHE = {}
+    # Zobrist keys of every point {boardsize: {color: [key]}}, the same as AlphaZero.env.go
+    __HASH_CACHE = {}
+
+    def __init__(self, size=19, komi=7.5, enforce_superko=False, history_length=8):
+        self.board = np.zeros((size, size), dtype=int)
+        self.size = size
+        self.height = size
+        self.width = size
+        self.current_player = BLACK
+        self.ko = None
+        self.komi = komi  # Komi is number of extra points WHITE gets for going 2nd
+        self.handicaps = []
+        self.history = []
+        # Keeps 8 history board for fast feature extraction
+        # Fill zeros for non-existing histories
+        # board_history does not include the current board while the feature does,
+        self.history_length = history_length
+        self.board_history = BoardHistory(history_length - 1, size, size)
+        self.num_black_prisoners = 0
+        self.num_white_prisoners = 0
+        self.is_end_of_game = False
+        # Each pass move by a player subtracts a point
+        self.passes_white = 0
+        self.passes_black = 0
+
+        self._create_caches()
+        self._neighbors_flat = GameState.__NEIGHBORS_CACHE[size]
+        self._diagonals_flat = GameState.__DIAGONALS_CACHE[size]
+        self._hash_keys = GameState.__HASH_CACHE[size]
+        num_points = size * size
+        # The color of every point
+        self._stones = [EMPTY] * num_points
+        # The root of the group of every stone
+        self._parent = list(range(num_points))
+        # The next stone in the circular list of the group
+        self._next = list(range(num_points))
+        # Statistics of the groups, valid at the roots only
+        self._group_size = [0] * num_points
+        self._libs = [0] * num_points
+        self._lib_sum = [0] * num_points
+        self._lib_sum_sq = [0] * num_points
+        # cache of list of legal moves (actually 'sensible' moves, with a
+        # separate list for eye-moves on request)
+        self.__legal_move_cache = None
+        self.__legal_eyes_cache = None
+
+        # Zobrist hash to keep track of board state
+        self.enforce_superko = enforce_superko
+        self.current_hash = 0
+        self.previous_hashes = set()
+        self.turns = 0
+        # Records of the moves that can be taken back, None until enable_undo is called
+        self._undo_stack = None
+        # Optional per-point bookkeeping for the features, see add_tracker
+        self.trackers = {}
+
+    def _create_caches(self):
+        size = self.size
+        if size in GameState.__NEIGHBORS_CACHE:
+            return
+        neighbors = []
+        diagonals = []
+        for x in range(size):
+            for y in range(size):
+                neighbors.append(tuple(nx * size + ny for nx, ny in [(x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)]
+                                       if self._on_board((nx, ny))))
+                diagonals.append(tuple(nx * size + ny for nx, ny in
+                                       [(x - 1, y - 1), (x + 1, y + 1), (x + 1, y - 1), (x - 1, y + 1)]
+                                       if self._on_board((nx, ny))))
+        # The same random keys as AlphaZero.env.go, so that both backends have the same hashes
+        rng = np.random.RandomState(0)
+        hash_lookup = {
+            WHITE: rng.randint(np.iinfo(np.uint64).max, size=(size, size), dtype='uint64'),
+            BLACK: rng.randint(np.iinfo(np.uint64).max, size=(size, size), dtype='uint64')}
+        GameState.__HASH_CACHE[size] = {color: [int(key) for key in keys.reshape(-1)]
+                                        for color, keys in hash_lookup.items()}
+        GameState.__DIAGONALS_CACHE[size] = tuple(diagonals)
+        GameState.__NEIGHBORS_CACHE[size] = tuple(neighbors)
+
+    def _on_board(self, position):
+        """
+
+        Args:
+            position: a tuple of (x, y)
+
+        Returns:
+            bool: returns True iff position is within the bounds of [0, self.size)
+        """
+
+        (x, y) = position
+        return x >= 0 and y >= 0 and x < self.size and y < self.size
+
+    def _to_point(self, position):
+        (x, y) = position
+        return x * self.size + y
+
+    def _to_position(self, point):
+        return divmod(point, self.size)
+
+    def _group_points(self, root):
+        """Lists the stones of the group of root by walking its circular list"""
+        points = [root]
+        p = self._next[root]
+        while p != root:
+            points.append(p)
+            p = self._next[p]
+        return points
+
+    def _in_atari(self, root):
+        """Checks if the group of root has exactly one liberty"""
+        lib_sum = self._lib_sum[root]
+        return self._libs[root] * self._lib_sum_sq[root] == lib_sum * lib_sum
+
+    def _only_liberty(self, root):
+        """The liberty of a group in atari"""
+        return self._lib_sum[root] // self._libs[root]
+
+    def get_group(self, position):
+        """
+        Get the group of connected same-color stones to the given position.
+
+        Args:
+            position: a tuple of (x, y)
+
+        Returns:
+            set: a set of tuples consist of (x, y)s which are the same-color cluster,
+            which contains the input single position. Empty if there is no stone at position.
+        """
+        p = self._to_point(position)
+        if self._stones[p] == EMPTY:
+            return set()
+        return set(self._to_position(q) for q in self._group_points(self._parent[p]))
+
+    def get_groups_around(self, position):
+        """
+        returns a list of the unique groups adjacent to position
+
+        Args:
+            position: a tuple of (x, y)
+
+        Returns:
+            list: a list of the unique groups adjacent to position.
+        """
+        roots = []
+        for q in self._neighbors_flat[self._to_point(position)]:
+            if self._stones[q] != EMPTY and self._parent[q] not in roots:
+                roots.append(self._parent[q])
+        return [self.get_group(self._to_position(root)) for root in roots]
+
+    @property
+    def liberty_counts(self):
+        """
+        numpy.ndarray: the number of liberties of the group of every stone, -1 for the empty points
+        """
+        counts = np.full((self.size, self.size), -1, dtype=int)
+        roots = set(self._parent[p] for p, color in enumerate(self._stones) if color != EMPTY)
+        for root in roots:
+            points = self._group_points(root)
+            libs = set(q for p in points for q in self._neighbors_flat[p] if self._stones[q] == EMPTY)
+            for p in points:
+                counts[self._to_position(p)] = len(libs)
+        return counts
+
+    def copy(self):
+        """Gets a copy of this Game state
+
+        Returns:
+            AlphaZero.env.go_array.GameState: a copy of this Game state
+        """
+        other = GameState.__new__(GameState)
+        other.__dict__.update(self.__dict__)
+        other.board = self.board.copy()
+        other.handicaps = list(self.handicaps)
+        other.history = list(self.history)
+        other.board_history = self.board_history.copy()
+        other._stones = self._stones[:]
+        other._parent = self._parent[:]
+        other._next = self._next[:]
+        other._group_size = self._group_size[:]
+        other._libs = self._libs[:]
+        other._lib_sum = self._lib_sum[:]
+        other._lib_sum_sq = self._lib_sum_sq[:]
+        other.previous_hashes = self.previous_hashes.copy()
+        other._undo_stack = None
+        other.trackers = {name: tracker.copy() for name, tracker in self.trackers.items()}
+        other.__legal_move_cache = None
+        other.__legal_eyes_cache = None
+        return other
+
+    def _is_suicide_point(self, p, color):
+        for q in self._neighbors_flat[p]:
+            stone = self._stones[q]
+            if stone == EMPTY:
+                return False
+            root = self._parent[q]
+            # The only liberty of a group in atari adjacent to p is p
+            in_atari = self._in_atari(root)
+            # saved by attaching to a friendly group that has liberties elsewhere
+            if stone == color and not in_atari:
+                return False
+            # killing an unfriendly group
+            if stone == -color and in_atari:
+                return False
+        return True
+
+    def is_suicide(self, action):
+        """
+
+        Args:
+            action: a tuple of (x, y)
+
+        Returns:
+            bool: return true if having current_player play at <action> would be suicide
+        """
+        return self._is_suicide_point(self._to_point(action), self.current_player)
+
+    def is_positional_superko(self, action):
+        """Checks if playing action repeats a previous board position, without copying or modifying the state.
+
+        Args:
+            action: a tuple of (x, y), an empty point where the move is not suicide
+
+        Returns:
+            bool: if the move is positional superko.
+        """
+        return self._hash_after_move(self._to_point(action), self.current_player) in self.previous_hashes
+
+    def _hash_after_move(self, p, color):
+        """Works out the hash of the board after color plays at p, from the stone placed and the groups it
+        captures, without playing the move. p must be empty and the move must not be suicide.
+        """
+        new_hash = self.current_hash ^ self._hash_keys[color][p]
+        keys = self._hash_keys[-color]
+        captured = []
+        for q in self._neighbors_flat[p]:
+            if self._stones[q] != -color:
+                continue
+            root = self._parent[q]
+            # the only liberty of a group in atari adjacent to p is p
+            if root not in captured and self._in_atari(root):
+                captured.append(root)
+                for r in self._group_points(root):
+                    new_hash ^= keys[r]
+        return new_hash
+
+    def is_legal(self, action):
+        """
+        Determines if the given action (x,y) is a legal move
+        Args:
+            action: a tuple of (x, y)
+
+        Returns:
+            bool: if the move is legal.
+        """
+        # passing is always legal
+        if action is PASS_MOVE:
+            return True
+        if not self._on_board(action):
+            return False
+        p = self._to_point(action)
+        if self._stones[p] != EMPTY:
+            return False
+        if self._is_suicide_point(p, self.current_player):
+            return False
+        if action == self.ko:
+            return False
+        if self.enforce_superko and self.is_positional_superko(action):
+            return False
+        return True
+
+    def is_eyeish(self, position, owner):
+        """
+
+        Args:
+            position: a tuple of (x, y)
+            owner: the color
+
+        Returns:
+            bool: whether the position is empty and is surrounded by all stones of 'owner'
+        """
+        p = self._to_point(position)
+        if self._stones[p] != EMPTY:
+            return False
+        for q in self._neighbors_flat[p]:
+            if self._stones[q] != owner:
+                return False
+        return True
+
+    def is_eye(self, position, owner, stack=None):
+        """returns whether the position is a true eye of 'owner'
+        Requires a recursive call; empty spaces diagonal to 'position' are fine
+        as long as they themselves are eyes
+        """
+        if not self.is_eyeish(position, owner):
+            return False
+        if stack is None:
+            stack = []
+        p = self._to_point(position)
+        # (as in Fuego/Michi/etc) ensure that num "bad" diagonals is 0 (edges) or 1
+        # where a bad diagonal is an opponent stone or an empty non-eye space
+        num_bad_diagonal = 0
+        # if in middle of board, 1 bad neighbor is allowable; zero for edges and corners
+        allowable_bad_diagonal = 1 if len(self._neighbors_flat[p]) == 4 else 0
+
+        for q in self._diagonals_flat[p]:
+            d = self._to_position(q)
+            # opponent stones count against this being eye
+            if self._stones[q] == -owner:
+                num_bad_diagonal += 1
+            # empty spaces (that aren't themselves eyes) count against it too
+            # the 'stack' keeps track of where we've already been to prevent
+            # infinite loops of recursion
+            elif self._stones[q] == EMPTY and d not in stack:
+                stack.append(position)
+                if not self.is_eye(d, owner, stack):
+                    num_bad_diagonal += 1
+                stack.pop()
+            # at any point, if we've surpassed # allowable, we can stop
+            if num_bad_diagonal > allowable_bad_diagonal:
+                return False
+        return True
+
+    def legal_mask(self):
+        """
+        Computes the legal moves of current_player on all the points. The lists are scanned directly,
+        converting them to NumPy arrays would take longer.
+
+        Returns:
+            numpy.ndarray: a flat boolean array of size * size + 1 entries, True for the legal moves.
+            Point (x, y) is at index x * size + y and the pass move is the last entry.
+        """
+        color = self.current_player
+        stones = self._stones
+        legal = [stones[p] == EMPTY and not self._is_suicide_point(p, color) for p in range(len(stones))]
+        # passing is always legal
+        legal.append(True)
+        mask = np.array(legal, dtype=bool)
+        if self.ko is not None:
+            mask[self._to_point(self.ko)] = False
+        if self.enforce_superko:
+            for p in np.flatnonzero(mask[:-1]).tolist():
+                if self._hash_after_move(p, color) in self.previous_hashes:
+                    mask[p] = False
+        return mask
+
+    def get_legal_moves(self, include_eyes=True):
+        """
+
+        Args:
+            include_eyes: whether to include eyes in legal moves
+
+        Returns:
+            list: a list of tuples.
+        """
+        if self.__legal_move_cache is not None:
+            if include_eyes:
+                return self.__legal_move_cache + self.__legal_eyes_cache
+            else:
+                return self.__legal_move_cache
+        self.__legal_move_cache = []
+        self.__legal_eyes_cache = []
+        for x in range(self.size):
+            for y in range(self.size):
+                if self.is_legal((x, y)):
+                    if not self.is_eye((x, y), self.current_player):
+                        self.__legal_move_cache.append((x, y))
+                    else:
+                        self.__legal_eyes_cache.append((x, y))
+        return self.get_legal_moves(include_eyes)
+
+    def get_score(self):
+        """Calculate the Tromp-Taylor area score of the board state, see AlphaZero.env.go.GameState.get_score
+
+        Returns:
+            tuple: (winner, margin), the color of the winner (0 for a tie) and the score of BLACK minus the
+            score of WHITE
+        """
+        return area_score(self.board, self.komi)
+
+    def get_winner(self):
+        """Calculate score of board state and return player ID (1, -1, or 0 for tie)
+        corresponding to winner. Uses 'Area scoring'.
+
+        Returns:
+            int: the color of the winner.
+        """
+        return self.get_score()[0]
+
+    def place_handicaps(self, actions):
+        """
+        Place handicap stones of black.
+        Args:
+            actions: a list of tuples of (x, y)
+
+        Returns:
+            None
+        """
+        if len(self.history) > 0:
+            raise IllegalMove("Cannot place handicap on a started game")
+        self.handicaps.extend(actions)
+        for action in actions:
+            self.do_move(action, BLACK)
+        self.history = []
+        self.board_history.clear()
+        for tracker in self.trackers.values():
+            tracker.on_reset(self)
+
+    def place_handicap_stone(self, action, color=BLACK):
+        """
+        Place a handicap stone of the specified color.
+        Args:
+            action: a tuple of (x, y)
+            color: the color of the move
+
+        Returns:
+            None
+        """
+        self.handicaps.append(action)
+        self.do_move(action, color)
+
+    def get_current_player(self):
+        """
+
+        Returns:
+            int: the color of the player who will make the next move.
+        """
+        return self.current_player
+
+    def _add_liberty(self, root, p):
+        self._libs[root] += 1
+        self._lib_sum[root] += p
+        self._lib_sum_sq[root] += p * p
+
+    def _remove_liberty(self, root, p):
+        self._libs[root] -= 1
+        self._lib_sum[root] -= p
+        self._lib_sum_sq[root] -= p * p
+
+    def _merge(self, root_a, root_b):
+        """Merges two groups, the stones of the smaller one are relabeled.
+
+        Returns:
+            int: the root of the merged group
+        """
+        if self._group_size[root_a] < self._group_size[root_b]:
+            root_a, root_b = root_b, root_a
+        self._group_size[root_a] += self._group_size[root_b]
+        self._libs[root_a] += self._libs[root_b]
+        self._lib_sum[root_a] += self._lib_sum[root_b]
+        self._lib_sum_sq[root_a] += self._lib_sum_sq[root_b]
+        for p in self._group_points(root_b):
+            self._parent[p] = root_a
+        # Splice the circular lists
+        self._next[root_a], self._next[root_b] = self._next[root_b], self._next[root_a]
+        return root_a
+
+    def _place_stone(self, p, color):
+        """Puts a stone on an empty point and merges it with the friendly groups around.
+        """
+        self._stones[p] = color
+        self.board[self._to_position(p)] = color
+        self.current_hash ^= self._hash_keys[color][p]
+        self._parent[p] = p
+        self._next[p] = p
+        self._group_size[p] = 1
+        self._libs[p] = self._lib_sum[p] = self._lib_sum_sq[p] = 0
+        root = p
+        for q in self._neighbors_flat[p]:
+            stone = self._stones[q]
+            if stone == EMPTY:
+                self._add_liberty(p, q)
+            else:
+                self._remove_liberty(self._parent[q], p)
+        for q in self._neighbors_flat[p]:
+            if self._stones[q] == color and self._parent[q] != root:
+                root = self._merge(root, self._parent[q])
+        return root
+
+    def _remove_group(self, root):
+        """Takes a group off the board (due to capture), giving the liberties back to the groups around.
+
+        Returns:
+            int: the number of stones removed
+        """
+        points = self._group_points(root)
+        color = self._stones[root]
+        keys = self._hash_keys[color]
+        for p in points:
+            self._stones[p] = EMPTY
+            self.board[self._to_position(p)] = EMPTY
+            self.current_hash ^= keys[p]
+        for p in points:
+            for q in self._neighbors_flat[p]:
+                if self._stones[q] != EMPTY:
+                    self._add_liberty(self._parent[q], p)
+        return len(points)
+
+    def do_move(self, action, color=None):
+        """Play stone at action=(x,y). If color is not specified, current_player is used
+        If it is a legal move, current_player switches to the opposite color
+        If not, an IllegalMove exception is raised
+
+        Args:
+            action: a tuple of (x, y)
+            color: the color of the move
+
+        Returns:
+            bool: if it is the end of game.
+        """
+        color = color or self.current_player
+        reset_player = self.current_player
+        self.current_player = color
+        if self.is_legal(action):
+            if self._undo_stack is not None:
+                self._undo_stack.append(self._undo_record(action, color, reset_player))
+            # reset ko
+            self.ko = None
+            # save current board to history before it is modified
+            self.board_history.push(self.board)
+
+            if action is not PASS_MOVE:
+                p = self._to_point(action)
+                root = self._place_stone(p, color)
+
+                # check neighboring groups' liberties for captures
+                num_captured = 0
+                captured = None
+                for q in self._neighbors_flat[p]:
+                    if self._stones[q] == -color and self._libs[self._parent[q]] == 0:
+                        # capture occurred!
+                        num_captured += self._remove_group(self._parent[q])
+                        captured = q
+                if color == BLACK:
+                    self.num_white_prisoners += num_captured
+                else:
+                    self.num_black_prisoners += num_captured
+                # it is a ko iff, were the opponent to play at the captured position,
+                # it would recapture (x,y) only
+                # (a bigger group containing xy may be captured - this is 'snapback')
+                if num_captured == 1 and self._group_size[root] == 1 and self._in_atari(root):
+                    self.ko = self._to_position(captured)
+                self.previous_hashes.add(self.current_hash)
+            else:
+                if color == BLACK:
+                    self.passes_black += 1
+                if color == WHITE:
+                    self.passes_white += 1
+            # next turn
+            self.current_player = -color
+            self.history.append(action)
+            self.turns += 1
+            for tracker in self.trackers.values():
+                tracker.on_move(self, action, color)
+            self.__legal_move_cache = None
+        else:
+            self.current_player = reset_player
+            raise IllegalMove(str(action))
+        # Check for end of game
+        if len(self.history) > 1:
+            if self.history[-1] is PASS_MOVE and self.history[-2] is PASS_MOVE \
+                    and self.current_player == WHITE:
+                self.is_end_of_game = True
+        return self.is_end_of_game
+
+    def _undo_record(self, action, color, reset_player):
+        """Saves what do_move changes before the move is played. The arrays change at the played point,
+        at the roots of the groups around it, at the stones of the merged and captured groups,
+        and at the roots of the groups around the captured stones.
+
+        Returns:
+            tuple: the record used by undo_move
+        """
+        points = []
+        if action is not PASS_MOVE:
+            p = self._to_point(action)
+            affected = {p}
+            for q in self._neighbors_flat[p]:
+                stone = self._stones[q]
+                if stone == EMPTY:
+                    continue
+                root = self._parent[q]
+                affected.add(root)
+                # the only liberty of a group in atari adjacent to p is p
+                if stone == color or self._in_atari(root):
+                    for r in self._group_points(root):
+                        affected.add(r)
+                        if stone == -color:
+                            affected.update(self._parent[s] for s in self._neighbors_flat[r]
+                                            if self._stones[s] != EMPTY)
+            points = [(q, self._stones[q], self._parent[q], self._next[q], self._group_size[q], self._libs[q],
+                       self._lib_sum[q], self._lib_sum_sq[q]) for q in affected]
+        return (reset_player, self.ko, self.board_history.next_dropped(self.board), self.current_hash,
+                len(self.previous_hashes), self.num_black_prisoners, self.num_white_prisoners, self.passes_black,
+                self.passes_white,
+                self.is_end_of_game, points)
+
+    def enable_undo(self):
+        """Starts recording the moves played with do_move, so that they can be taken back with undo_move.
+        Copies of this state do not record their moves.
+
+        Returns:
+            None
+        """
+        self._undo_stack = []
+
+    def add_tracker(self, name, tracker):
+        """Registers a tracker of per-point bookkeeping, available as self.trackers[name]. Trackers are
+        added before the first move and follow the state through do_move, undo_move, transform and copy.
+
+        Args:
+            name: the name of the tracker
+            tracker: an object with on_move(state, action, color) and on_undo(state, action) methods,
+                called after the move is played or taken back, an on_reset(state) method called when
+                place_handicaps resets the history, a transform(transform_id) method called by transform
+                and a copy() method
+
+        Returns:
+            None
+        """
+        self.trackers[name] = tracker
+
+    def undo_move(self):
+        """Takes back the last move played since enable_undo was called, restoring the state before it.
+        An IllegalMove exception is raised if there is no such move.
+
+        Returns:
+            None
+        """
+        if not self._undo_stack:
+            raise IllegalMove("No move to undo")
+        (player, self.ko, oldest_board, current_hash, num_hashes, self.num_black_prisoners,
+         self.num_white_prisoners, self.passes_black, self.passes_white, self.is_end_of_game,
+         points) = self._undo_stack.pop()
+        # the position after the move is forgotten unless it was reached before
+        if len(self.previous_hashes) > num_hashes:
+            self.previous_hashes.discard(self.current_hash)
+        self.current_hash = current_hash
+        # The board is restored point by point with the other arrays
+        self.board_history.pop(oldest_board)
+        for (q, stone, parent, next_stone, group_size, libs, lib_sum, lib_sum_sq) in points:
+            self._stones[q] = stone
+            self.board[self._to_position(q)] = stone
+            self._parent[q] = parent
+            self._next[q] = next_stone
+            self._group_size[q] = group_size
+            self._libs[q] = libs
+            self._lib_sum[q] = lib_sum
+            self._lib_sum_sq[q] = lib_sum_sq
+        action = self.history.pop()
+        self.turns -= 1
+        self.current_player = player
+        self.__legal_move_cache = None
+        for tracker in self.trackers.values():
+            tracker.on_undo(self, action)
+
+    def transform(self, transform_id):
+        """Transform the current board and the history boards according to D(4).
+            Caution: self.history (action history) is not modified, thus this function
+            should ONLY be used for state evaluation.
+
+        Args:
+            transform_id: integer in range [0, 7]
+
+        Returns:
+            None
+
+        """
+        # List of boards to transform
+        self.board = dihedral.transform(self.board, transform_id)
+        self.board_history.transform(transform_id)
+        for tracker in self.trackers.values():
+            tracker.transform(transform_id)
+        # Transformed states are told apart by the evaluation cache
+        self.transform_id = transform_id
@@ -0,0 +1,6 @@
+# The values of the points of a Go board, shared by the game states and the scoring without importing them
+
+WHITE = -1
+BLACK = +1
+EMPTY = 0
+PASS_MOVE = None
@@ -0,0 +1,66 @@
+import numpy as np
+
+from AlphaZero.env.go_constants import BLACK, WHITE, EMPTY
+
+
+def _neighbors_of(masks):
+    """
+    Args:
+        masks: a boolean array of shape (n, height, width)
+
+    Returns:
+        numpy.ndarray: the positions next to a True position of the same mask
+    """
+    grown = np.zeros_like(masks)
+    grown[:, 1:, :] |= masks[:, :-1, :]
+    grown[:, :-1, :] |= masks[:, 1:, :]
+    grown[:, :, 1:] |= masks[:, :, :-1]
+    grown[:, :, :-1] |= masks[:, :, 1:]
+    return grown
+
+
+def territory(board):
+    """Finds the empty positions owned by each color under Tromp-Taylor rules: an empty position
+    belongs to a color if the empty region around it touches stones of that color only.
+
+    The empty regions are flood-filled from the stones of both colors at once, one step per iteration.
+
+    Args:
+        board: a numpy array of the board with BLACK, WHITE and EMPTY
+
+    Returns:
+        tuple: two boolean arrays with the territory of BLACK and of WHITE
+    """
+    empty = board == EMPTY
+    stones = np.stack([board == BLACK, board == WHITE])
+    # reached[i] is the set of empty positions connected to a stone of color i by empty positions
+    reached = _neighbors_of(stones) & empty
+    while True:
+        grown = reached | (_neighbors_of(reached) & empty)
+        if np.array_equal(grown, reached):
+            break
+        reached = grown
+    return reached[0] & ~reached[1], reached[1] & ~reached[0]
+
+
+def area_score(board, komi=0):
+    """Counts the Tromp-Taylor area score: the stones of each color plus its territory.
+
+    Args:
+        board: a numpy array of the board with BLACK, WHITE and EMPTY
+        komi: the points added to the score of WHITE
+
+    Returns:
+        tuple: (winner, margin), the color of the winner (0 for a tie) and the score of BLACK minus the score of WHITE
+    """
+    black_territory, white_territory = territory(board)
+    score_black = np.count_nonzero(board == BLACK) + np.count_nonzero(black_territory)
+    score_white = np.count_nonzero(board == WHITE) + np.count_nonzero(white_territory) + komi
+    margin = score_black - score_white
+    if margin > 0:
+        winner = BLACK
+    elif margin < 0:
+        winner = WHITE
+    else:
+        winner = 0
+    return winner, margin
@@ -1,16 +1,28 @@
-from copy import deepcopy
-
 import numpy as np
 import yaml
 import os
 
+from AlphaZero.env import dihedral
+from AlphaZero.env.board_history import BoardHistory
+
 WHITE = -1
 BLACK = +1
 PASS_MOVE = None
 EMPTY = 0
 
-with open(os.path.join(os.path.dirname(__file__), '..', 'config', 'mnk.yaml')) as f:
-    game_config = yaml.load(f)
+# The four lines through a position as (dx, dy): vertical, horizontal, diagonal \ and diagonal /
+_AXES = [(1, 0), (0, 1), (1, 1), (1, -1)]
+
+# mnk.yaml, read on the first GameState created without a game config
+_default_config = None
+
+
+def _load_default_config():
+    global _default_config
+    if _default_config is None:
+        with open(os.path.join(os.path.dirname(__file__), '..', 'config', 'mnk.yaml')) as f:
+            _default_config = yaml.load(f)
+    return _default_config
 
 
 class GameState(object):
@@ -18,7 +30,22 @@ class GameState(object):
 
     """
 
-    def __init__(self, history_length=8):
+    # Zobrist hash tables are the same for every game of the same shape, hence this shared
+    # lookup table {(height, width): {color: table}}
+    __HASH_CACHE = {}
+    # The positions to look at for a winning line are the same for every game of the same shape and k,
+    # hence this shared lookup table {(height, width, k): rays}
+    __RAY_CACHE = {}
+
+    def __init__(self, history_length=8, game_config=None):
+        """
+        Args:
+            history_length: the number of boards kept for feature extraction, the current board included
+            game_config: a dict with the board_height (m), board_width (n) and k of the game,
+                the config file mnk.yaml is used if it is None
+        """
+        if game_config is None:
+            game_config = _load_default_config()
         self.width = game_config['board_width']
         self.height = game_config['board_height']
         self.k = game_config['k']
@@ -30,11 +57,81 @@ class GameState(object):
         # Fill zeros for non-existing histories
         # board_history does not include the current board while the feature does,
         self.history_length = history_length
-        self.board_history = [np.zeros((self.height, self.width), dtype=int) for _ in range(history_length - 1)]
+        self.board_history = BoardHistory(history_length - 1, self.height, self.width)
         self.is_end_of_game = False
         self.winner = None
         self.turns = 0
 
+        # setup Zobrist hash to keep track of board state
+        self._create_hash_cache()
+        self.hash_lookup = GameState.__HASH_CACHE[(self.height, self.width)]
+        self.current_hash = np.uint64(0)
+        # Flat copy of the board, position (x, y) is at index x * width + y
+        self._cells = [EMPTY] * (self.height * self.width)
+        self._create_ray_cache()
+        self._rays = GameState.__RAY_CACHE[(self.height, self.width, self.k)]
+        # Records of the moves that can be taken back, None until enable_undo is called
+        self._undo_stack = None
+        # Optional per-point bookkeeping for the features, see add_tracker
+        self.trackers = {}
+
+    def _create_ray_cache(self):
+        key = (self.height, self.width, self.k)
+        if key in GameState.__RAY_CACHE:
+            return
+        # For every position and every axis, the flat indices of the positions on the board in both directions,
+        # nearest first. A line of k stones through the position never reaches further than k - 1 steps.
+        rays = []
+        for x in range(self.height):
+            for y in range(self.width):
+                axes = []
+                for dx, dy in _AXES:
+                    directions = []
+                    for sign in (1, -1):
+                        ray = []
+                        for step in range(1, self.k):
+                            xp, yp = x + sign * step * dx, y + sign * step * dy
+                            if not self._on_board((xp, yp)):
+                                break
+                            ray.append(xp * self.width + yp)
+                        directions.append(tuple(ray))
+                    axes.append(tuple(directions))
+                rays.append(tuple(axes))
+        GameState.__RAY_CACHE[key] = tuple(rays)
+
+    def _line_length(self, p, color):
+        """
+        Args:
+            p: the flat index of a position with a stone of color
+            color: the color of the stone
+
+        Returns:
+            int: the number of stones of the longest line through p, at most k - 1 are counted on each side
+        """
+        cells = self._cells
+        longest = 1
+        for axis in self._rays[p]:
+            count = 1
+            for ray in axis:
+                for q in ray:
+                    if cells[q] != color:
+                        break
+                    count += 1
+            if count > longest:
+                longest = count
+        return longest
+
+    def _create_hash_cache(self):
+        if (self.height, self.width) not in GameState.__HASH_CACHE:
+            rng = np.random.RandomState(0)
+            GameState.__HASH_CACHE[(self.height, self.width)] = {
+                WHITE: rng.randint(np.iinfo(np.uint64).max, size=(self.height, self.width), dtype='uint64'),
+                BLACK: rng.randint(np.iinfo(np.uint64).max, size=(self.height, self.width), dtype='uint64')}
+
+    def _update_hash(self, action, color):
+        (x, y) = action
+        self.current_hash = np.bitwise_xor(self.current_hash, self.hash_lookup[color][x][y])
+
     def _on_board(self, position):
         """
 
@@ -53,14 +150,14 @@ class GameState(object):
         Returns:
             AlphaZero.env.mnk.GameState: a copy of this Game state
         """
-        other = GameState()
+        other = GameState.__new__(GameState)
+        other.__dict__.update(self.__dict__)
         other.board = self.board.copy()
-        other.current_player = self.current_player
         other.history = list(self.history)
-        other.board_history = deepcopy(self.board_history)
-        other.turns = self.turns
-        other.is_end_of_game = self.is_end_of_game
-        other.winner = self.winner
+        other.board_history = self.board_history.copy()
+        other._cells = list(self._cells)
+        other._undo_stack = None
+        other.trackers = {name: tracker.copy() for name, tracker in self.trackers.items()}
         return other
 
     def is_legal(self, action):
@@ -75,17 +172,26 @@ class GameState(object):
         (x, y) = action
         if not self._on_board(action):
             return False
-        if self.board[x][y] != EMPTY:
+        if self._cells[x * self.width + y] != EMPTY:
             return False
         return True
 
+    def legal_mask(self):
+        """
+
+        Returns:
+            numpy.ndarray: a flat boolean array of height * width entries, True for the legal moves.
+            Position (x, y) is at index x * width + y.
+        """
+        return (self.board == EMPTY).ravel()
+
     def get_legal_moves(self):
         """
 
         Returns:
             list: a list of legal moves.
         """
-        legal_moves = [(i, j) for i in range(self.height) for j in range(self.width) if self.is_legal((i, j))]
+        legal_moves = [divmod(p, self.width) for p, cell in enumerate(self._cells) if cell == EMPTY]
         return legal_moves
 
     def get_winner(self):
@@ -112,61 +218,23 @@ class GameState(object):
         reset_player = self.current_player
         self.current_player = color
         if self.is_legal(action):
+            if self._undo_stack is not None:
+                self._undo_stack.append((reset_player, self.board_history.next_dropped(self.board), self.current_hash,
+                                         self.is_end_of_game, self.winner))
             # save current board to history before it is modified
-            self.board_history.append(self.board.copy())
-            self.board_history.pop(0)
+            self.board_history.push(self.board)
             self.history.append(action)
 
             # do action
             (x, y) = action
+            p = x * self.width + y
             self.board[x][y] = color
+            self._cells[p] = color
+            self._update_hash(action, color)
             self.turns += 1
 
             # check if the current player wins by the move
-            # check horizontal
-            h_count, v_count, diag1_count, diag2_count = 1, 1, 1, 1
-            xp, yp = x + 1, y
-            while self._on_board((xp, yp)) and self.board[xp][yp] == self.current_player:
-                xp += 1
-                h_count += 1
-            xp, yp = x - 1, y
-            while self._on_board((xp, yp)) and self.board[xp][yp] == self.current_player:
-                xp -= 1
-                h_count += 1
-            # check vertical
-            xp, yp = x, y + 1
-            while self._on_board((xp, yp)) and self.board[xp][yp] == self.current_player:
-                yp += 1
-                v_count += 1
-            xp, yp = x, y - 1
-            while self._on_board((xp, yp)) and self.board[xp][yp] == self.current_player:
-                yp -= 1
-                v_count += 1
-            # check diagonal 1 \
-            xp, yp = x + 1, y + 1
-            while self._on_board((xp, yp)) and self.board[xp][yp] == self.current_player:
-                xp += 1
-                yp += 1
-                diag1_count += 1
-            xp, yp = x - 1, y - 1
-            while self._on_board((xp, yp)) and self.board[xp][yp] == self.current_player:
-                xp -= 1
-                yp -= 1
-                diag1_count += 1
-            # check diagonal 2 /
-            xp, yp = x + 1, y - 1
-            while self._on_board((xp, yp)) and self.board[xp][yp] == self.current_player:
-                xp += 1
-                yp -= 1
-                diag2_count += 1
-            xp, yp = x - 1, y + 1
-            while self._on_board((xp, yp)) and self.board[xp][yp] == self.current_player:
-                xp -= 1
-                yp += 1
-                diag2_count += 1
-
-            # winning condition
-            if h_count >= self.k or v_count >= self.k or diag1_count >= self.k or diag2_count >= self.k:
+            if self._line_length(p, color) >= self.k:
                 self.is_end_of_game = True
                 self.winner = self.current_player
 
@@ -177,6 +245,8 @@ class GameState(object):
 
             # next turn
             self.current_player = -color
+            for tracker in self.trackers.values():
+                tracker.on_move(self, action, color)
 
         else:
             self.current_player = reset_player
@@ -184,9 +254,50 @@ class GameState(object):
 
         return self.is_end_of_game
 
+    def enable_undo(self):
+        """Starts recording the moves played with do_move, so that they can be taken back with undo_move.
+        Copies of this state do not record their moves.
+
+        Returns:
+            None
+        """
+        self._undo_stack = []
+
+    def add_tracker(self, name, tracker):
+        """Registers a tracker of per-point bookkeeping for the features, see AlphaZero.env.go.GameState.add_tracker
+
+        Args:
+            name: the name of the tracker
+            tracker: the tracker, with on_move, on_undo, transform and copy methods
+
+        Returns:
+            None
+        """
+        self.trackers[name] = tracker
+
+    def undo_move(self):
+        """Takes back the last move played since enable_undo was called, restoring the state before it.
+        An IllegalMove exception is raised if there is no such move.
+
+        Returns:
+            None
+        """
+        if not self._undo_stack:
+            raise IllegalMove("No move to undo")
+        (player, oldest_board, self.current_hash, self.is_end_of_game, self.winner) = self._undo_stack.pop()
+        # The last history board is the board before the move
+        self.board = self.board_history.pop(oldest_board)
+        action = self.history.pop()
+        (x, y) = action
+        self._cells[x * self.width + y] = EMPTY
+        self.turns -= 1
+        self.current_player = player
+        for tracker in self.trackers.values():
+            tracker.on_undo(self, action)
+
     def transform(self, transform_id):
         """Transform the current board and the history boards according to D(4).
-            Caution: self.history (action history) is not modified, thus this function
+            Caution: self.history (action history) and the flat board are not modified, thus this function
             should ONLY be used for state evaluation.
 
         Args:
@@ -198,17 +309,13 @@ class GameState(object):
         """
         assert self.height == self.width
 
-        def _transform(b):
-            # Performs reflection
-            if transform_id // 4 == 1:
-                b = np.fliplr(b)
-            # Performs rotation
-            b = np.rot90(b, transform_id % 4)
-            return b
-
         # List of boards to transform
-        self.board = _transform(self.board)
-        self.board_history = [_transform(b) for b in self.board_history]
+        self.board = dihedral.transform(self.board, transform_id)
+        self.board_history.transform(transform_id)
+        for tracker in self.trackers.values():
+            tracker.transform(transform_id)
+        # Transformed states are told apart by the evaluation cache
+        self.transform_id = transform_id
 
 
 class IllegalMove(Exception):
@@ -1,7 +1,8 @@
-from copy import deepcopy
-
 import numpy as np
 
+from AlphaZero.env import dihedral
+from AlphaZero.env.board_history import BoardHistory
+
 WHITE = -1
 BLACK = +1
 PASS_MOVE = None
@@ -13,6 +14,13 @@ class GameState(object):
 
     """
 
+    # Zobrist hash tables are the same for every game of the same size, hence this shared
+    # lookup table {boardsize: {color: table}}
+    __HASH_CACHE = {}
+    # The positions met walking from every position in every direction, see legal_mask.
+    # Shared lookup table {boardsize: index array}
+    __RAY_CACHE = {}
+
     def __init__(self, size=8, history_length=8):
         # the size of reversi should not be changed
         self.board = np.zeros((size, size), dtype=int)
@@ -30,11 +38,35 @@ class GameState(object):
         # Fill zeros for non-existing histories
         # board_history does not include the current board while the feature does,
         self.history_length = history_length
-        self.board_history = [np.zeros((size, size), dtype=int) for _ in range(history_length - 1)]
+        self.board_history = BoardHistory(history_length - 1, size, size)
         self.is_end_of_game = False
         self.stones_played = 4
         self.turns = 0
 
+        # setup Zobrist hash to keep track of board state
+        self._create_hash_cache()
+        self.hash_lookup = GameState.__HASH_CACHE[size]
+        self.current_hash = 0
+        for (x, y) in zip(*np.nonzero(self.board)):
+            self._update_hash((x, y), self.board[x][y])
+        # Records of the moves that can be taken back, None until enable_undo is called
+        self._undo_stack = None
+        # Optional per-point bookkeeping for the features, see add_tracker
+        self.trackers = {}
+
+    def _create_hash_cache(self):
+        if self.size not in GameState.__HASH_CACHE:
+            rng = np.random.RandomState(0)
+            hash_lookup = {
+                WHITE: rng.randint(np.iinfo(np.uint64).max, size=(self.size, self.size), dtype='uint64'),
+                BLACK: rng.randint(np.iinfo(np.uint64).max, size=(self.size, self.size), dtype='uint64')}
+            # Nested lists of Python integers, xor on numpy scalars costs more than the rest of a move
+            GameState.__HASH_CACHE[self.size] = {color: keys.tolist() for color, keys in hash_lookup.items()}
+
+    def _update_hash(self, action, color):
+        (x, y) = action
+        self.current_hash ^= self.hash_lookup[color][x][y]
+
     def _on_board(self, position):
         """
 
@@ -75,7 +107,9 @@ class GameState(object):
             if do_move:
                 # travels back to action point and flip all stones
                 while (x, y) != action:
-                    self.board[x][y] = self.current_player
+                    if self.board[x, y] == -self.current_player:
+                        self.current_hash ^= self.hash_lookup[WHITE][x][y] ^ self.hash_lookup[BLACK][x][y]
+                    self.board[x, y] = self.current_player
                     x, y = x - dx, y - dy
             return True
         # position is empty, cannot flip
@@ -88,14 +122,13 @@ class GameState(object):
         Returns:
             AlphaZero.env.reversi.GameState: a copy of this Game state
         """
-        other = GameState(self.size)
+        other = GameState.__new__(GameState)
+        other.__dict__.update(self.__dict__)
         other.board = self.board.copy()
-        other.current_player = self.current_player
         other.history = list(self.history)
-        other.board_history = deepcopy(self.board_history)
-        other.turns = self.turns
-        other.is_end_of_game = self.is_end_of_game
-        other.stones_played = self.stones_played
+        other.board_history = self.board_history.copy()
+        other._undo_stack = None
+        other.trackers = {name: tracker.copy() for name, tracker in self.trackers.items()}
         return other
 
     def is_legal(self, action):
@@ -109,7 +142,7 @@ class GameState(object):
         """
         # PASS is only legal when there is no legal move
         if action is PASS_MOVE:
-            return self.get_legal_moves() == []
+            return not self.legal_mask()[:-1].any()
 
         (x, y) = action
         if not self._on_board(action):
@@ -124,16 +157,57 @@ class GameState(object):
         else:
             return False
 
+    def legal_mask(self):
+        """ Computes the legal moves of current_player with array operations. In every direction, an empty
+            position is legal if it is followed by a run of opponent stones and then a stone of current_player.
+
+        Returns:
+            numpy.ndarray: a flat boolean array of size * size + 1 entries, True for the legal moves.
+            Position (x, y) is at index x * size + y and the pass move is the last entry.
+        """
+        size = self.size
+        rays = self._create_ray_cache()
+        # +1 for the stones of current_player, -1 for the opponent and 0 for the empty positions,
+        # followed by a 0 for the positions off the board
+        stones = np.zeros(size * size + 1, dtype=np.int8)
+        stones[:-1] = self.board.ravel() * self.current_player
+        # stones met after 1, ..., size - 1 steps from every position in every direction
+        walk = stones[rays]
+        # run is True where the first k stones in the direction are all opponent stones
+        run = np.logical_and.accumulate(walk[:, :-1] == -1, axis=1)
+        legal = (run & (walk[:, 1:] == 1)).any(axis=(0, 1)) & (stones[:-1] == EMPTY)
+        mask = np.empty(size * size + 1, dtype=bool)
+        mask[:-1] = legal
+        mask[-1] = not legal.any()
+        return mask
+
+    def _create_ray_cache(self):
+        """
+        Returns:
+            numpy.ndarray: the flat index of the position k + 1 steps from every position in every direction,
+            of shape (8, size - 1, size * size), with size * size for the positions off the board
+        """
+        size = self.size
+        if size not in GameState.__RAY_CACHE:
+            x, y = np.divmod(np.arange(size * size), size)
+            rays = np.full((8, size - 1, size * size), size * size)
+            directions = [(dx, dy) for dx in [-1, 0, 1] for dy in [-1, 0, 1] if dx != 0 or dy != 0]
+            for d, (dx, dy) in enumerate(directions):
+                for k in range(size - 1):
+                    rx, ry = x + (k + 1) * dx, y + (k + 1) * dy
+                    on_board = (rx >= 0) & (rx < size) & (ry >= 0) & (ry < size)
+                    rays[d, k, on_board] = rx[on_board] * size + ry[on_board]
+            GameState.__RAY_CACHE[size] = rays
+        return GameState.__RAY_CACHE[size]
+
     def get_legal_moves(self):
-        """ This function is infrequently used, therefore not optimized.
-            Checks all non-pass moves
+        """ Checks all non-pass moves
 
         Returns:
             list: a list of legal moves
 
         """
-        legal_moves = [(i, j) for i in range(self.size) for j in range(self.size) if self.is_legal((i, j))]
-        return legal_moves
+        return [divmod(i, self.size) for i in np.flatnonzero(self.legal_mask()[:-1]).tolist()]
 
     def get_winner(self):
         """ Counts the stones on the board, assumes the game is ended
@@ -168,9 +242,11 @@ class GameState(object):
         reset_player = self.current_player
         self.current_player = color
         if self.is_legal(action):
+            if self._undo_stack is not None:
+                self._undo_stack.append((reset_player, self.board_history.next_dropped(self.board), self.current_hash,
+                                         self.is_end_of_game, self.stones_played))
             # save current board to history before it is modified
-            self.board_history.append(self.board.copy())
-            self.board_history.pop(0)
+            self.board_history.push(self.board)
             self.history.append(action)
             self.turns += 1
 
@@ -178,6 +254,7 @@ class GameState(object):
             if action is not PASS_MOVE:
                 (x, y) = action
                 self.board[x][y] = color
+                self._update_hash(action, color)
                 self.stones_played += 1
 
                 # flip stones
@@ -197,6 +274,8 @@ class GameState(object):
 
             # next turn
             self.current_player = -color
+            for tracker in self.trackers.values():
+                tracker.on_move(self, action, color)
 
         else:
             self.current_player = reset_player
@@ -204,6 +283,45 @@ class GameState(object):
 
         return self.is_end_of_game
 
+    def enable_undo(self):
+        """Starts recording the moves played with do_move, so that they can be taken back with undo_move.
+        Copies of this state do not record their moves.
+
+        Returns:
+            None
+        """
+        self._undo_stack = []
+
+    def add_tracker(self, name, tracker):
+        """Registers a tracker of per-point bookkeeping for the features, see AlphaZero.env.go.GameState.add_tracker
+
+        Args:
+            name: the name of the tracker
+            tracker: the tracker, with on_move, on_undo, transform and copy methods
+
+        Returns:
+            None
+        """
+        self.trackers[name] = tracker
+
+    def undo_move(self):
+        """Takes back the last move played since enable_undo was called, restoring the state before it.
+        An IllegalMove exception is raised if there is no such move.
+
+        Returns:
+            None
+        """
+        if not self._undo_stack:
+            raise IllegalMove("No move to undo")
+        (player, oldest_board, self.current_hash, self.is_end_of_game, self.stones_played) = self._undo_stack.pop()
+        # The last history board is the board before the move
+        self.board = self.board_history.pop(oldest_board)
+        action = self.history.pop()
+        self.turns -= 1
+        self.current_player = player
+        for tracker in self.trackers.values():
+            tracker.on_undo(self, action)
+
     def transform(self, transform_id):
         """Transform the current board and the history boards according to D(4).
             Caution: self.history (action history) is not modified, thus this function
@@ -216,16 +334,13 @@ class GameState(object):
             None
 
         """
-        def _transform(b):
-            # Performs reflection
-            if transform_id // 4 == 1:
-                b = np.fliplr(b)
-            # Performs rotation
-            b = np.rot90(b, transform_id % 4)
-            return b
         # List of boards to transform
-        self.board = _transform(self.board)
-        self.board_history = [_transform(b) for b in self.board_history]
+        self.board = dihedral.transform(self.board, transform_id)
+        self.board_history.transform(transform_id)
+        for tracker in self.trackers.values():
+            tracker.transform(transform_id)
+        # Transformed states are told apart by the evaluation cache
+        self.transform_id = transform_id
 
 
 class IllegalMove(Exception):
@@ -0,0 +1,373 @@
+import numpy as np
+
+from AlphaZero.env import dihedral
+from AlphaZero.env.board_history import BoardHistory
+from AlphaZero.env.reversi import BLACK, WHITE, EMPTY, PASS_MOVE, IllegalMove
+
+# The 8 directions as (dx, dy)
+_DIRECTIONS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+
+def _popcount(bits):
+    return bin(bits).count('1')
+
+
+class GameState(object):
+    """Game state of Reversi with the same interface as AlphaZero.env.reversi.GameState, where the stones of
+    each color are stored in a bitboard: position (x, y) is bit x * size + y of a Python integer.
+
+    Legal moves and flips are computed with shift-and-mask operations on the whole board, eight directions at
+    a time, instead of walking the board one position at a time. The board array (and its history) is still
+    kept up to date for feature extraction.
+    """
+
+    # Masks and Zobrist keys are the same for every game of the same size, hence this shared
+    # lookup table {boardsize: (shift table, full board mask, positions of the bits, hash keys, flip keys)}
+    __TABLE_CACHE = {}
+
+    def __init__(self, size=8, history_length=8):
+        self.board = np.zeros((size, size), dtype=int)
+        self.size = size
+        self.height = size
+        self.width = size
+        self.current_player = BLACK
+        self.history = []
+        # Keeps 8 history board for fast feature extraction
+        # Fill zeros for non-existing histories
+        # board_history does not include the current board while the feature does,
+        self.history_length = history_length
+        self.board_history = BoardHistory(history_length - 1, size, size)
+        self.is_end_of_game = False
+        self.stones_played = 4
+        self.turns = 0
+
+        self._create_tables()
+        self._shifts, self._full, self._positions, self._hash_keys, self._flip_keys = GameState.__TABLE_CACHE[size]
+        self._stones = {BLACK: 0, WHITE: 0}
+        # Bitboard of the legal moves of current_player, None until computed
+        self._legal_cache = None
+        self.current_hash = 0
+        for (x, y), color in [((size // 2 - 1, size // 2 - 1), WHITE), ((size // 2, size // 2), WHITE),
+                              ((size // 2, size // 2 - 1), BLACK), ((size // 2 - 1, size // 2), BLACK)]:
+            p = x * size + y
+            self._stones[color] |= 1 << p
+            self.board[x][y] = color
+            self.current_hash ^= self._hash_keys[color][p]
+        # Records of the moves that can be taken back, None until enable_undo is called
+        self._undo_stack = None
+        # Optional per-point bookkeeping for the features, see add_tracker
+        self.trackers = {}
+
+    def _create_tables(self):
+        size = self.size
+        if size in GameState.__TABLE_CACHE:
+            return
+        full = (1 << (size * size)) - 1
+        first_column = sum(1 << (x * size) for x in range(size))
+        last_column = first_column << (size - 1)
+        # For every direction, the shift of the bit index and the mask of the positions a step can land on:
+        # a step to the right cannot land on the first column, where it wraps around, and the other way round.
+        # The left shifts (to larger bit indices) come first, the right shifts after them.
+        shifts = []
+        for dx, dy in _DIRECTIONS:
+            mask = full
+            if dy == 1:
+                mask &= ~first_column
+            elif dy == -1:
+                mask &= ~last_column
+            shifts.append((dx * size + dy, mask))
+        shifts = ([(shift, mask) for shift, mask in shifts if shift > 0],
+                  [(-shift, mask) for shift, mask in shifts if shift < 0])
+        # The same random keys as AlphaZero.env.reversi, so that both backends have the same hashes
+        rng = np.random.RandomState(0)
+        hash_lookup = {
+            WHITE: rng.randint(np.iinfo(np.uint64).max, size=(size, size), dtype='uint64'),
+            BLACK: rng.randint(np.iinfo(np.uint64).max, size=(size, size), dtype='uint64')}
+        hash_keys = {color: [int(key) for key in keys.reshape(-1)] for color, keys in hash_lookup.items()}
+        # Flipping a stone swaps its key of one color for the key of the other
+        flip_keys = [black ^ white for black, white in zip(hash_keys[BLACK], hash_keys[WHITE])]
+        positions = [divmod(p, size) for p in range(size * size)]
+        GameState.__TABLE_CACHE[size] = (shifts, full, positions, hash_keys, flip_keys)
+
+    def _legal_bits(self):
+        """
+        Returns:
+            int: the bitboard of the legal moves of current_player, pass excluded
+        """
+        if self._legal_cache is None:
+            own = self._stones[self.current_player]
+            opponent = self._stones[-self.current_player]
+            empty = ~(own | opponent) & self._full
+            legal = 0
+            left, right = self._shifts
+            # The runs of opponent stones starting next to an own stone, a step past a run is legal if empty.
+            # Masking the opponent and empty positions with the landing mask drops the steps that wrap around.
+            for shift, mask in left:
+                landing = opponent & mask
+                run = (own << shift) & landing
+                while run:
+                    run <<= shift
+                    legal |= run & empty & mask
+                    run &= landing
+            for shift, mask in right:
+                landing = opponent & mask
+                run = (own >> shift) & landing
+                while run:
+                    run >>= shift
+                    legal |= run & empty & mask
+                    run &= landing
+            self._legal_cache = legal
+        return self._legal_cache
+
+    def _flips(self, p):
+        """
+        Returns:
+            int: the bitboard of the stones flipped by current_player playing at bit p
+        """
+        own = self._stones[self.current_player]
+        opponent = self._stones[-self.current_player]
+        move = 1 << p
+        flips = 0
+        left, right = self._shifts
+        for shift, mask in left:
+            landing = opponent & mask
+            line = 0
+            step = (move << shift) & mask
+            while step & landing:
+                line |= step
+                step = (step << shift) & mask
+            if step & own:
+                flips |= line
+        for shift, mask in right:
+            landing = opponent & mask
+            line = 0
+            step = (move >> shift) & mask
+            while step & landing:
+                line |= step
+                step = (step >> shift) & mask
+            if step & own:
+                flips |= line
+        return flips
+
+    def _on_board(self, position):
+        """
+
+        Args:
+            position: a tuple of (x, y)
+
+        Returns:
+            bool: returns True iff position is within the bounds of [0, self.size)
+        """
+        (x, y) = position
+        return x >= 0 and y >= 0 and x < self.size and y < self.size
+
+    def copy(self):
+        """Gets a copy of this Game state
+
+        Returns:
+            AlphaZero.env.reversi_bitboard.GameState: a copy of this Game state
+        """
+        other = GameState.__new__(GameState)
+        other.__dict__.update(self.__dict__)
+        other.board = self.board.copy()
+        other.history = list(self.history)
+        other.board_history = self.board_history.copy()
+        other._stones = dict(self._stones)
+        other._undo_stack = None
+        other.trackers = {name: tracker.copy() for name, tracker in self.trackers.items()}
+        return other
+
+    def is_legal(self, action):
+        """
+        Determines if the given action (x,y) is a legal move
+        Args:
+            action: a tuple of (x, y)
+
+        Returns:
+            bool: if the move is legal.
+        """
+        # PASS is only legal when there is no legal move
+        if action is PASS_MOVE:
+            return self._legal_bits() == 0
+        if not self._on_board(action):
+            return False
+        (x, y) = action
+        return (self._legal_bits() >> (x * self.size + y)) & 1 == 1
+
+    def legal_mask(self):
+        """
+        Returns:
+            numpy.ndarray: a flat boolean array of size * size + 1 entries, True for the legal moves.
+            Position (x, y) is at index x * size + y and the pass move is the last entry.
+        """
+        num_positions = self.size * self.size
+        legal = self._legal_bits()
+        bits = np.unpackbits(np.frombuffer(legal.to_bytes((num_positions + 7) // 8, 'little'), dtype=np.uint8),
+                             bitorder='little')
+        mask = np.empty(num_positions + 1, dtype=bool)
+        mask[:-1] = bits[:num_positions]
+        mask[-1] = legal == 0
+        return mask
+
+    def get_legal_moves(self):
+        """ Checks all non-pass moves
+
+        Returns:
+            list: a list of legal moves
+
+        """
+        legal = self._legal_bits()
+        positions = self._positions
+        moves = []
+        while legal:
+            # the lowest set bit
+            low = legal & -legal
+            moves.append(positions[low.bit_length() - 1])
+            legal ^= low
+        return moves
+
+    def get_winner(self):
+        """ Counts the stones on the board, assumes the game is ended
+
+        Returns:
+            int: The winner, None if the game is not ended yet
+
+        """
+        black_count = _popcount(self._stones[BLACK])
+        white_count = _popcount(self._stones[WHITE])
+        if black_count > white_count:
+            winner = BLACK
+        elif black_count < white_count:
+            winner = WHITE
+        else:
+            winner = 0
+        return winner
+
+    def do_move(self, action, color=None):
+        """Play stone at action=(x,y). If color is not specified, current_player is used
+        If it is a legal move, current_player switches to the opposite color
+        If not, an IllegalMove exception is raised
+
+        Args:
+            action: a tuple of (x, y)
+            color: the color of the move
+
+        Returns:
+            bool: if it is the end of game.
+        """
+        color = color or self.current_player
+        reset_player = self.current_player
+        if color != self.current_player:
+            self.current_player = color
+            self._legal_cache = None
+        if self.is_legal(action):
+            if self._undo_stack is not None:
+                self._undo_stack.append((reset_player, self.board_history.next_dropped(self.board), self.current_hash,
+                                         self.is_end_of_game, self.stones_played, dict(self._stones)))
+            # save current board to history before it is modified
+            self.board_history.push(self.board)
+            self.history.append(action)
+            self.turns += 1
+
+            # do action
+            if action is not PASS_MOVE:
+                (x, y) = action
+                p = x * self.size + y
+                flips = self._flips(p)
+                self._stones[color] |= flips | (1 << p)
+                self._stones[-color] &= ~flips
+                board = self.board
+                board[x, y] = color
+                current_hash = self.current_hash ^ self._hash_keys[color][p]
+                self.stones_played += 1
+                # flip stones
+                while flips:
+                    low = flips & -flips
+                    q = low.bit_length() - 1
+                    flips ^= low
+                    board[self._positions[q]] = color
+                    current_hash ^= self._flip_keys[q]
+                self.current_hash = current_hash
+
+                # check if stone has filled the board if no one wins yet
+                if self.stones_played == self.size * self.size:
+                    self.is_end_of_game = True
+
+            else:
+                if self.history[-2] == PASS_MOVE:
+                    self.is_end_of_game = True
+
+            # next turn
+            self.current_player = -color
+            self._legal_cache = None
+            for tracker in self.trackers.values():
+                tracker.on_move(self, action, color)
+
+        else:
+            if color != reset_player:
+                self.current_player = reset_player
+                self._legal_cache = None
+            raise IllegalMove(str(action))
+
+        return self.is_end_of_game
+
+    def enable_undo(self):
+        """Starts recording the moves played with do_move, so that they can be taken back with undo_move.
+        Copies of this state do not record their moves.
+
+        Returns:
+            None
+        """
+        self._undo_stack = []
+
+    def add_tracker(self, name, tracker):
+        """Registers a tracker of per-point bookkeeping for the features, see AlphaZero.env.go.GameState.add_tracker
+
+        Args:
+            name: the name of the tracker
+            tracker: the tracker, with on_move, on_undo, transform and copy methods
+
+        Returns:
+            None
+        """
+        self.trackers[name] = tracker
+
+    def undo_move(self):
+        """Takes back the last move played since enable_undo was called, restoring the state before it.
+        An IllegalMove exception is raised if there is no such move.
+
+        Returns:
+            None
+        """
+        if not self._undo_stack:
+            raise IllegalMove("No move to undo")
+        (player, oldest_board, self.current_hash, self.is_end_of_game, self.stones_played,
+         self._stones) = self._undo_stack.pop()
+        # The last history board is the board before the move
+        self.board = self.board_history.pop(oldest_board)
+        action = self.history.pop()
+        self.turns -= 1
+        self.current_player = player
+        self._legal_cache = None
+        for tracker in self.trackers.values():
+            tracker.on_undo(self, action)
+
+    def transform(self, transform_id):
+        """Transform the current board and the history boards according to D(4).
+            Caution: self.history (action history) and the bitboards are not modified, thus this function
+            should ONLY be used for state evaluation.
+
+        Args:
+            transform_id: integer in range [0, 7]
+
+        Returns:
+            None
+
+        """
+        # List of boards to transform
+        self.board = dihedral.transform(self.board, transform_id)
+        self.board_history.transform(transform_id)
+        for tracker in self.trackers.values():
+            tracker.transform(transform_id)
+        # Transformed states are told apart by the evaluation cache
+        self.transform_id = transform_id
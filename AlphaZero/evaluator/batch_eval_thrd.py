@@ -0,0 +1,81 @@
+import threading as thrd
+import traceback as tb
+from queue import Empty as EmptyExc
+
+from AlphaZero.train.parallel.util import ServerClientConnThrd
+
+
+class BatchEvaluatorThrd:
+    """
+    Collects the evaluation requests of the search threads in one process and evaluates them in batches.
+    The requests are sent through ServerClientConnThrd, and a listening thread calls the batch evaluation
+    function with all the requests that are waiting. Context manager (with statement) is preferred because
+    of the automatic start and termination of the listening thread.
+
+    Example:
+
+        with BatchEvaluatorThrd(nn_eval.eval_batch, 8) as eval:
+            pass
+
+    Args:
+        batch_evaluator: A function that takes a list of states and returns a list of (policy, value)
+        max_batch_size: The maximum number of states evaluated in one batch
+    """
+
+    def __init__(self, batch_evaluator, max_batch_size):
+        self.batch_evaluator = batch_evaluator
+        self.max_batch_size = max_batch_size
+        self.server_client_conn = ServerClientConnThrd(max_batch_size * 2)
+        self.listener = thrd.Thread(target=self.listen, name='batch_eval_listener', daemon=True)
+
+    def __enter__(self):
+        """Will be called where the "with" statement begin"""
+        self.listener.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Will be called where the "with" statement end"""
+        # A request without connection stops the listener
+        self.server_client_conn.queue.put((None, None))
+        self.listener.join()
+
+    def eval(self, state):
+        """
+        This function is called by the search threads.
+
+        Args:
+            state: GameState
+
+        Returns:
+            Tuple: (policy, value) pair
+        """
+        result = self.server_client_conn.req(state)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def listen(self):
+        """
+        The listener for collecting the evaluation requests and calling the batch evaluator.
+        """
+        stop = False
+        while not stop:
+            try:
+                reqs = []
+                for i in range(self.max_batch_size):
+                    req = self.server_client_conn.get(i == 0)
+                    if req[1] is None:
+                        stop = True
+                        break
+                    reqs.append(req)
+            except EmptyExc:
+                pass
+            if len(reqs) == 0:
+                continue
+            try:
+                results = self.batch_evaluator([state for state, _ in reqs])
+            except Exception as e:
+                tb.print_exc()
+                results = [e] * len(reqs)
+            for (_, conn), result in zip(reqs, results):
+                conn.put(result)
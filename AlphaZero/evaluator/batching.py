@@ -0,0 +1,133 @@
+import math
+import multiprocessing as mp
+import time
+from queue import Empty as EmptyExc
+
+import numpy as np
+
+# Number of power-of-two buckets of the wait histogram, the last one is about 8 seconds
+num_wait_buckets = 24
+
+
+class BatchingPolicy:
+    """
+    Decides when the listener of NNEvaluator runs a forward pass. Requests are collected until the target batch
+    size is reached or the first request has waited max_wait_us microseconds since it was sent. After the
+    deadline, only the requests already in the queue are added and the batch is run even if it is not full.
+
+    The achieved batch sizes and the queue waits of the first requests are counted in histograms in shared memory,
+    so they can be read by any process while the listener is running.
+
+    Args:
+        target_batch_size: The number of states that triggers the forward pass
+        max_wait_us: The maximum time in microseconds to wait for a full batch
+    """
+
+    def __init__(self, target_batch_size, max_wait_us=0):
+        self.target_batch_size = target_batch_size
+        self.max_wait = max_wait_us / 1e6
+        # Bucket i counts the batches of i states, the last bucket also counts the larger ones
+        self._batch_size_hist = mp.RawArray('q', target_batch_size + 1)
+        # Bucket i counts the waits in [2^(i-1), 2^i) microseconds, bucket 0 the waits below 1 microsecond
+        self._wait_hist = mp.RawArray('q', num_wait_buckets)
+
+    def collect(self, get):
+        """
+        Collects the requests of one batch.
+
+        Args:
+            get: A function taking (block, timeout) and returning a (state tensor, connection, send time)
+                request, it raises queue.Empty on timeout
+
+        Returns:
+            list: a list of requests
+        """
+        reqs = [get(True, None)]
+        # The deadline runs from the time the first request was sent, not from the time it was received
+        deadline = reqs[0][2] + self.max_wait
+        num_states = reqs[0][0].shape[0]
+        while num_states < self.target_batch_size:
+            timeout = deadline - time.time()
+            try:
+                if timeout > 0:
+                    req = get(True, timeout)
+                else:
+                    req = get(False, None)
+            except EmptyExc:
+                # The deadline has passed and the queue is empty, the partial batch is run
+                break
+            reqs.append(req)
+            num_states += req[0].shape[0]
+        self._record(num_states, time.time() - reqs[0][2])
+        return reqs
+
+    def serve(self, get, response):
+        """
+        Collects the requests of one batch, evaluates all their states with one call of response and sends
+        every request its rows of the outputs.
+
+        Args:
+            get: A function taking (block, timeout) and returning a (state tensor, connection, send time) request
+            response: A function taking the concatenated state tensor and returning the (policies, values)
+
+        Returns:
+            None
+        """
+        # A request may contain more than one state (see request_in_chunks)
+        reqs = self.collect(get)
+        states_np = np.concatenate([req[0] for req in reqs], 0)
+        rp, rv = response(states_np)
+        begin = 0
+        for req in reqs:
+            end = begin + req[0].shape[0]
+            req[1].send((rp[begin:end], rv[begin:end]))
+            begin = end
+
+    def _record(self, batch_size, wait):
+        """Counts a batch in the histograms."""
+        self._batch_size_hist[min(batch_size, self.target_batch_size)] += 1
+        wait_us = wait * 1e6
+        bucket = 0 if wait_us < 1 else int(math.log2(wait_us)) + 1
+        self._wait_hist[min(bucket, num_wait_buckets - 1)] += 1
+
+    def batch_size_histogram(self):
+        """
+        Returns:
+            numpy.ndarray: the number of batches of every size, the last bucket includes the larger batches
+        """
+        return np.array(self._batch_size_hist[:], dtype=np.int64)
+
+    def wait_histogram(self):
+        """
+        Returns:
+            numpy.ndarray: the number of batches whose first request waited for [2^(i-1), 2^i) microseconds
+                between the time it was sent and the forward pass, bucket 0 is for the waits below 1 microsecond
+        """
+        return np.array(self._wait_hist[:], dtype=np.int64)
+
+    def mean_batch_size(self):
+        """
+        Returns:
+            float: the average number of states in a batch
+        """
+        hist = self.batch_size_histogram()
+        total = hist.sum()
+        return float(np.dot(hist, np.arange(len(hist))) / total) if total > 0 else 0.0
+
+
+def request_in_chunks(conn, states_np, max_rows):
+    """
+    Sends the states in requests of at most max_rows states, all of them before waiting for any response,
+    so that the listener can evaluate them in the same forward pass.
+
+    Args:
+        conn: A connection with send_req(tensor) and recv_res(ticket), see AlphaZero.train.parallel.util
+        states_np: The state tensor
+        max_rows: The maximum number of states in one request
+
+    Returns:
+        tuple: the (policies, values) of all the states
+    """
+    tickets = [conn.send_req(states_np[begin:begin + max_rows]) for begin in range(0, len(states_np), max_rows)]
+    results = [conn.recv_res(ticket) for ticket in tickets]
+    return tuple(np.concatenate(outputs, 0) for outputs in zip(*results))
@@ -1,4 +1,3 @@
-import importlib
 import os
 
 import numpy as np
@@ -9,9 +8,6 @@ with open(os.path.join(os.path.dirname(__file__), '..', 'config', 'game.yaml'))
 with open(os.path.join(os.path.dirname(__file__), '..', 'config', game_selection + '.yaml')) as c:
     game_config = yaml.load(c)
 
-_preproc = importlib.import_module(game_config['state_converter_path'])
-_tensor_action_converter = _preproc.TensorActionConverter(game_config)
-
 
 class DummyEvaluator:
     def __init__(self):
@@ -25,4 +21,7 @@ class DummyEvaluator:
 
     def eval(self, state):
         dims = game_config['flat_move_output']
-        return _tensor_action_converter.tensor_to_action(np.full((dims,), 1 / dims)), 0
+        return np.full((dims,), 1 / dims), 0
+
+    def eval_batch(self, states):
+        return [self.eval(state) for state in states]
@@ -0,0 +1,100 @@
+import multiprocessing as mp
+import threading as thrd
+from collections import OrderedDict
+
+
+class EvalCache:
+    """
+    Bounded LRU cache of network evaluations. A state is identified by its Zobrist hash, the player to move,
+    the moves leading to the history boards of the network input and the transform applied before the evaluation.
+    The generation counter is shared by the processes forked after the cache is created, so that increasing it
+    (e.g. when new weights are loaded) clears the cache of every process at its next access.
+
+    Args:
+        max_size: The maximum number of cached evaluations in one process
+        history_length: The number of boards in the network input
+    """
+
+    def __init__(self, max_size, history_length=8):
+        self.max_size = max_size
+        self.history_length = history_length
+        self._entries = OrderedDict()
+        self._lock = thrd.Lock()
+        self._generation = mp.Value('i', 0)
+        self._local_generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, state):
+        """
+        Gets the key of a state.
+
+        Args:
+            state: GameState
+
+        Returns:
+            tuple: the key of the state
+        """
+        moves = tuple(state.history[-(self.history_length - 1):]) if self.history_length > 1 else ()
+        return int(state.current_hash), state.current_player, moves, getattr(state, 'transform_id', 0)
+
+    @property
+    def generation(self):
+        """The current generation of the cached evaluations"""
+        return self._generation.value
+
+    def _sync(self):
+        """Clears the entries of an old generation. Must be called with the lock held."""
+        generation = self._generation.value
+        if generation != self._local_generation:
+            self._entries.clear()
+            self._local_generation = generation
+
+    def lookup(self, key):
+        """
+        Finds a cached evaluation and marks it as recently used.
+
+        Args:
+            key: the key returned by key()
+
+        Returns:
+            the cached evaluation, None if not found
+        """
+        with self._lock:
+            self._sync()
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return result
+
+    def store(self, key, result, generation):
+        """
+        Caches an evaluation. It is dropped if the cache has been invalidated since the evaluation was requested.
+
+        Args:
+            key: the key returned by key()
+            result: the evaluation
+            generation: the generation when the evaluation was requested
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._sync()
+            if generation != self._local_generation:
+                return
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                # Evict the least recently used evaluation
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        """
+        Drops the cached evaluations of all the processes sharing the cache.
+        """
+        with self._generation.get_lock():
+            self._generation.value += 1
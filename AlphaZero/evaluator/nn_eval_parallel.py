@@ -2,7 +2,6 @@ import os
 import atexit
 import importlib
 import traceback as tb
-from queue import Empty as EmptyExc
 
 import numpy as np
 import yaml
@@ -10,6 +9,8 @@ import tensorflow as tf
 
 # import AlphaZero.processing.go.state_converter as preproc
 import AlphaZero.network.main as network
+from AlphaZero.evaluator.batching import BatchingPolicy, request_in_chunks
+from AlphaZero.evaluator.eval_cache import EvalCache
 # import AlphaZero.env.go as go
 from AlphaZero.train.parallel.util import *
 
@@ -19,7 +20,6 @@ with open(os.path.join(os.path.dirname(__file__), '..', 'config', game_selection
     game_config = yaml.load(c)
 _preproc = importlib.import_module(game_config['state_converter_path'])
 _state_tensor_converter = _preproc.StateTensorConverter(game_config)
-_tensor_action_converter = _preproc.TensorActionConverter(game_config)
 
 
 def kill_children():
@@ -41,7 +41,10 @@ class NNEvaluator:
     Args:
         cluster: Tensorflow cluster spec
         game_config: A dictionary of game environment configuration
-        ext_config: A dictionary of system configuration
+        ext_config: A dictionary of system configuration. 'eval_cache_size' is the number of evaluations cached
+            by every process, 0 to disable the cache. 'target_batch_size' (max_batch_size by default),
+            'max_wait_us' (0 by default) configure the BatchingPolicy.
+            'shm_transport' passes the tensors through shared memory instead of pickling them.
     """
 
     def __init__(self, cluster, game_config, ext_config):  # TODO: use proper default value
@@ -57,8 +60,19 @@ class NNEvaluator:
 
         self.rwlock = RWLock()
 
-        self.server_client_conn = ServerClientConn(self.max_batch_size * 2)
+        if ext_config.get('shm_transport', False):
+            input_shape = (_state_tensor_converter.output_dim, game_config['board_height'], game_config['board_width'])
+            self.server_client_conn = ServerClientConnShm(self.max_batch_size * 2, self.max_batch_size, input_shape,
+                                                          np.int8, [(game_config['flat_move_output'],), ()])
+        else:
+            self.server_client_conn = ServerClientConn(self.max_batch_size * 2)
         self.save_load_conn = ServerClientConn(5)
+        self.batching = BatchingPolicy(ext_config.get('target_batch_size', self.max_batch_size),
+                                       ext_config.get('max_wait_us', 0))
+
+        # Created before the workers are forked, so that loading new weights invalidates the cache of every worker
+        cache_size = ext_config.get('eval_cache_size', 0)
+        self.eval_cache = EvalCache(cache_size, game_config['history_step']) if cache_size > 0 else None
 
     def __enter__(self):
         """Will be called where the "with" statement begin"""
@@ -80,16 +94,50 @@ class NNEvaluator:
             state: GameState
 
         Returns:
-            Tuple: (policy, value) pair
+            Tuple: (policy, value) pair, the policy is the flat prob array of the network output
         """
+        if self.eval_cache is not None:
+            key = self.eval_cache.key(state)
+            cached = self.eval_cache.lookup(key)
+            if cached is not None:
+                return cached
+            generation = self.eval_cache.generation
         state_np = _state_tensor_converter.state_to_tensor(state)
         result_np = self.server_client_conn.req(state_np)
-        # This game specific conversation is implemented in state converter
-        result = (_tensor_action_converter.tensor_to_action(result_np[0]), result_np[1])
-        # for i in range(361):
-        #     result[0].append(((i // 19, i % 19), result_np[0][i]))
-        # result[0].append((go.PASS_MOVE, result_np[0][361]))
-        return result
+        if self.eval_cache is not None:
+            self.eval_cache.store(key, (result_np[0][0], result_np[1][0]), generation)
+        return result_np[0][0], result_np[1][0]
+
+    def eval_batch(self, states):
+        """
+        This function is called by mcts threads. The states are sent in requests of at most max_batch_size
+        states, all of them before waiting for any response, so they are evaluated in the same forward pass
+        when the target batch size of the listener covers them.
+
+        Args:
+            states: a list of GameState
+
+        Returns:
+            list: a list of (policy, value) pairs, the policies are flat prob arrays
+        """
+        if self.eval_cache is None:
+            results = [None] * len(states)
+        else:
+            keys = [self.eval_cache.key(state) for state in states]
+            results = [self.eval_cache.lookup(key) for key in keys]
+            generation = self.eval_cache.generation
+        # Only the states not in the cache are sent
+        misses = [i for i, result in enumerate(results) if result is None]
+        if not misses:
+            return results
+        # A request has at most max_batch_size states, the requests are all sent before waiting
+        states_np = _state_tensor_converter.states_to_tensor([states[i] for i in misses])
+        rp, rv = request_in_chunks(self.server_client_conn, states_np, self.max_batch_size)
+        for j, i in enumerate(misses):
+            results[i] = (rp[j], rv[j])
+            if self.eval_cache is not None:
+                self.eval_cache.store(keys[i], results[i], generation)
+        return results
 
     def sl_listen(self):
         """
@@ -102,6 +150,8 @@ class NNEvaluator:
                 printlog_thrd('load')
                 self.rwlock.w_acquire()
                 self.net.load(filename)
+                if self.eval_cache is not None:
+                    self.eval_cache.invalidate()
                 self.rwlock.w_release()
                 printlog_thrd('load complete')
                 s_conn.send('done')
@@ -143,16 +193,14 @@ class NNEvaluator:
 
         printlog('loop begin')
         while True:
-            try:
-                reqs = []
-                for i in range(self.max_batch_size):
-                    block = i < self.num_gpu
-                    reqs.append(self.server_client_conn.get(block))
-            except EmptyExc:
-                pass
-            finally:
-                # printlog(len(reqs), 'reqs')
-                states_np = np.concatenate([req[0] for req in reqs], 0)
-                rp, rv = self.net.response((states_np,))
-                for i in range(len(reqs)):
-                    reqs[i][1].send((rp[i], rv[i]))
+            self.batching.serve(self.server_client_conn.get_stamped, lambda states_np: self.net.response((states_np,)))
+
+    def batch_stats(self):
+        """
+        Gets the statistics of the batches evaluated by the listener.
+
+        Returns:
+            dict: histograms of the batch sizes and the waits of the first requests (see BatchingPolicy)
+        """
+        return {'batch_size': self.batching.batch_size_histogram(), 'wait_us_log2': self.batching.wait_histogram(),
+                'mean_batch_size': self.batching.mean_batch_size()}
@@ -11,7 +11,6 @@ with open(os.path.join(os.path.dirname(__file__), '..', 'config', game_selection
 
 _preproc = importlib.import_module(game_config['state_converter_path'])
 _state_tensor_converter = _preproc.StateTensorConverter(game_config)
-_tensor_action_converter = _preproc.TensorActionConverter(game_config)
 
 
 class NNEvaluator:
@@ -27,4 +26,9 @@ class NNEvaluator:
     def eval(self, state):
         state_np = _state_tensor_converter.state_to_tensor(state)
         result_np = self.net.response(np.expand_dims(state_np, 0))
-        return _tensor_action_converter.tensor_to_action(result_np[0][0]), result_np[1][0]
+        return result_np[0][0], result_np[1][0]
+
+    def eval_batch(self, states):
+        states_np = _state_tensor_converter.states_to_tensor(states)
+        rp, rv = self.net.response((states_np,))
+        return [(rp[i], rv[i]) for i in range(len(states))]
@@ -19,7 +19,9 @@ class Game:
         self.player_1 = player.Player(nn_eval_1, game_config, ext_config['player'])
         self.player_2 = player.Player(nn_eval_2, game_config, ext_config['player'])
         self._game_env = importlib.import_module(game_config['env_path'])
-        self.state = self._game_env.GameState()
+        self._preproc = importlib.import_module(game_config['state_converter_path'])
+        self._state_tensor_converter = self._preproc.StateTensorConverter(game_config)
+        self.state = self._new_state()
         self.winner = None
         self.state_history = []
         self.probs_history = []
@@ -28,13 +30,32 @@ class Game:
         self._h = game_config['board_height']
         self._f = game_config['history_step'] * game_config['planes_per_step'] + game_config['additional_planes']
         self._o = game_config['flat_move_output']
-        self._preproc = importlib.import_module(game_config['state_converter_path'])
-        self._state_tensor_converter = self._preproc.StateTensorConverter(game_config)
 
         self.dirichlet_before = ext_config['dirichlet_before']
         self.log_iter = ext_config['log_iter']
         self.max_turn = ext_config['max_turn']
 
+    def reset(self):
+        """
+        Prepare a new game with the same players, the players and the converters are reused.
+        """
+        self.player_1.reset()
+        self.player_2.reset()
+        self.state = self._new_state()
+        self.winner = None
+        self.state_history = []
+        self.probs_history = []
+        self.acts_history = []
+
+    def _new_state(self):
+        """
+        Returns:
+            A new game state with the trackers needed by the features of the converter
+        """
+        state = self._game_env.GameState()
+        self._state_tensor_converter.add_trackers(state)
+        return state
+
     def start(self):
         """
         Make the instance callable. Start playing.
@@ -43,29 +64,58 @@ class Game:
             Game winner. Definition is in go.py.
         """
         current_player = self.player_1
-        while not (self.state.is_end_of_game
-                   or self.state.turns > self.max_turn):
+        while not self._is_over():
+            self._log_turn()
+            move, probs = current_player.think(self.state, self.state.turns <= self.dirichlet_before)
+            current_player = self._play(current_player, move, probs)
 
-            if self.state.turns % self.log_iter == 0:
-                printlog(str(self.state.turns), 'moves')
+        return self._finish()
 
-            move, probs = current_player.think(self.state, (
-                    self.state.turns <= self.dirichlet_before))
-            self.state_history.append(self.state.copy())
-            self.probs_history.append(probs)
-            self.acts_history.append(move)
-            self.state.do_move(move)
-            self.player_1.ack(move)
-            self.player_2.ack(move)
+    def start_gen(self):
+        """
+        Generator version of start. The states to evaluate are yielded and their (policy, value) evaluations
+        are expected to be sent back, so that many games can share the evaluator (see MultiplexedSelfplay).
 
-            # change player
-            if current_player == self.player_1:
-                current_player = self.player_2
-            else:
-                current_player = self.player_1
+        Returns:
+            Game winner. Definition is in go.py.
+        """
+        current_player = self.player_1
+        while not self._is_over():
+            self._log_turn()
+            move, probs = yield from current_player.think_gen(self.state, self.state.turns <= self.dirichlet_before)
+            current_player = self._play(current_player, move, probs)
 
-            # TODO: other end game condition
+        return self._finish()
 
+    def _is_over(self):
+        # TODO: other end game condition
+        return self.state.is_end_of_game or self.state.turns > self.max_turn
+
+    def _log_turn(self):
+        if self.state.turns % self.log_iter == 0:
+            printlog(str(self.state.turns), 'moves')
+
+    def _play(self, current_player, move, probs):
+        """
+        Record and play a move.
+
+        Returns:
+            Player: the player of the next move
+        """
+        self.state_history.append(self.state.copy())
+        self.probs_history.append(probs)
+        self.acts_history.append(move)
+        self.state.do_move(move)
+        self.player_1.ack(move)
+        self.player_2.ack(move)
+
+        # change player
+        if current_player == self.player_1:
+            return self.player_2
+        else:
+            return self.player_1
+
+    def _finish(self):
         self.winner = self.state.get_winner()
         printlog('end', self.winner)
         return self.winner
@@ -78,18 +128,14 @@ class Game:
             tuple of numpy arrays: game states, probability maps and game results
         """
         # TODO: whether to put the whole game history in one batch
-        state_np = np.zeros((len(self.state_history), self._f, self._h, self._w))
+        state_np = np.empty((len(self.state_history), self._f, self._h, self._w), dtype=np.int8)
+        self._state_tensor_converter.states_to_tensor(self.state_history, state_np)
         probs_np = np.zeros((len(self.probs_history), self._o))
         result_np = np.zeros((len(self.probs_history)))
         for i in range(len(self.probs_history)):
-            state_np[i] = self._state_tensor_converter.state_to_tensor(self.state_history[i])[0]
-            for prob in self.probs_history[i]:
-                # flat move will include PASS MOVE if applicable, since PASS will be of index w*h,
-                # there will be no out of bound error
-                if prob[0] == self._game_env.PASS_MOVE:
-                    probs_np[i, self._w * self._h] = prob[1]
-                else:
-                    probs_np[i, prob[0][0] * self._w + prob[0][1]] = prob[1]
+            # The search probabilities are flat, with an entry for PASS MOVE at index w*h
+            # which is dropped for the games without it
+            probs_np[i] = self.probs_history[i][:self._o]
             result_np[i] = 1 if (i % 2 == (self.winner != self._game_env.BLACK)) else -1
         return state_np, probs_np, result_np
 
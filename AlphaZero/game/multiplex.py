@@ -0,0 +1,97 @@
+from AlphaZero.game.gameplay import Game
+
+
+class MultiplexedSelfplay:
+    """
+    Plays many self play games in one process. The games are generators (see Game.start_gen) which are
+    advanced in turn: the pending leaves of all the games are evaluated with one call of the batch evaluator,
+    then every game runs until it needs its next evaluation. The batch size is therefore the number of games,
+    not the number of processes.
+
+    Example:
+
+        for game in MultiplexedSelfplay(nn_eval, game_config, ext_config, 256).play():
+            data_queue.put(game.get_history())
+
+    Args:
+        nn_eval: NNEvaluator instance used by the players of all the games
+        game_config: A dictionary of game environment configuration
+        ext_config: A dictionary of gameplay configuration
+        num_games: The number of games played at the same time
+        batch_evaluator: A function that takes a list of states and returns a list of (policy, value),
+            nn_eval.eval_batch by default
+    """
+
+    def __init__(self, nn_eval, game_config, ext_config, num_games, batch_evaluator=None):
+        self.games = [Game(nn_eval, nn_eval, game_config, ext_config) for _ in range(num_games)]
+        self.batch_evaluator = batch_evaluator or nn_eval.eval_batch
+        self._searches = {}
+        self._num_started = 0
+        # Statistics of the evaluations
+        self.num_batches = 0
+        self.num_states = 0
+
+    def _start(self, i):
+        """Starts a new game in slot i."""
+        self._searches[i] = self.games[i].start_gen()
+        self._num_started += 1
+
+    def _advance(self, i, evaluation):
+        """
+        Runs the game in slot i until it needs an evaluation.
+
+        Returns:
+            the state to evaluate, None if the game is over
+        """
+        try:
+            return self._searches[i].send(evaluation)
+        except StopIteration:
+            return None
+
+    def play(self, max_games=None):
+        """
+        Plays games until max_games games are finished.
+
+        Args:
+            max_games: The number of games to play, None to play forever
+
+        Returns:
+            generator: every finished Game. It is reset for a new game when the next one is requested,
+                so its history should be read before.
+        """
+        self._num_started = 0
+        pending = {}
+        ready = []
+        for i in range(len(self.games)):
+            if max_games is not None and self._num_started >= max_games:
+                break
+            self._start(i)
+            ready.append(i)
+        # Newly started games are advanced like the evaluated ones, without an evaluation
+        evaluations = [None] * len(ready)
+        while ready:
+            for i, evaluation in zip(ready, evaluations):
+                state = self._advance(i, evaluation)
+                while state is None:
+                    yield self.games[i]
+                    if max_games is not None and self._num_started >= max_games:
+                        break
+                    self.games[i].reset()
+                    self._start(i)
+                    state = self._advance(i, None)
+                if state is not None:
+                    pending[i] = state
+            if not pending:
+                break
+            ready = list(pending)
+            states = [pending.pop(i) for i in ready]
+            evaluations = self.batch_evaluator(states)
+            self.num_batches += 1
+            self.num_states += len(states)
+
+    def mean_batch_size(self):
+        """
+        Returns:
+            float: the average number of states in a batch
+        """
+        return self.num_states / self.num_batches if self.num_batches > 0 else 0.0
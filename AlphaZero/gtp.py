@@ -13,6 +13,8 @@ parser = argparse.ArgumentParser(description='GTP player of AlphaZero.')
 parser.add_argument('-m', type=str, help='Dir of model to be load. This will override the dir in config file.', default=None)
 parser.add_argument('-p', type=str, help='Port for distributed tensorflow.', default=None)
 parser.add_argument('-n', type=int, help='Max playout.', default=None)
+parser.add_argument('-b', type=int, help='Number of leaves evaluated in one batch.', default=None)
+parser.add_argument('-t', type=int, help='Number of search threads.', default=None)
 args = parser.parse_args()
 
 with open(os.path.join(os.path.dirname(__file__), 'config', 'go.yaml')) as c:
@@ -20,11 +22,13 @@ with open(os.path.join(os.path.dirname(__file__), 'config', 'go.yaml')) as c:
 with open(os.path.join(os.path.dirname(__file__), 'config', 'gtp.yaml')) as f:
     ext_config = yaml.load(f)
 _state_tensor_converter = _preproc.StateTensorConverter(game_config)
-_tensor_action_converter = _preproc.TensorActionConverter(game_config)
 
 port = ext_config['port'] if args.p is None else args.p
 pretrained = ext_config['pretrained'] if args.m is None else False
 playout = ext_config['max_playout'] if args.n is None else args.n
+batch_size = ext_config.get('batch_size', 1) if args.b is None else args.b
+num_threads = ext_config.get('num_threads', 1) if args.t is None else args.t
+early_stop = ext_config.get('early_stop', False)
 
 cluster = tf.train.ClusterSpec({'main': ['localhost:'+str(port)]})
 net = network.Network(game_config, train_config='AlphaZero/config/gtp.yaml', load_pretrained=pretrained,
@@ -36,12 +40,19 @@ if args.m is not None:
 def nn_eval(state):
     state_np = _state_tensor_converter.state_to_tensor(state)
     result_np = net.response(np.expand_dims(state_np, 0))
-    return _tensor_action_converter.tensor_to_action(result_np[0][0]), result_np[1][0]
+    return result_np[0][0], result_np[1][0]
 
 
-def get_move(state):
-    mcts = MCTS.MCTSearch(nn_eval, game_config, max_playout=playout)
-    move, probs = mcts.calc_move_with_probs(state)
+def nn_eval_batch(states):
+    states_np = _state_tensor_converter.states_to_tensor(states)
+    rp, rv = net.response((states_np,))
+    return [(rp[i], rv[i]) for i in range(len(states))]
+
+
+def get_move(state, time_budget=None):
+    mcts = MCTS.MCTSearch(nn_eval, game_config, max_playout=playout, batch_evaluator=nn_eval_batch,
+                          batch_size=batch_size, num_threads=num_threads, early_stop=early_stop)
+    move, policy = mcts.calc_move_with_policy(state, time_budget=time_budget)
     return move
 
 
@@ -4,6 +4,13 @@ import gtp
 from AlphaZero.env import go
 from AlphaZero.util import save_gamestate_to_sgf
 
+# Share of the remaining main time spent on one move
+main_time_fraction = 1 / 30.0
+# Share of the time per move given to the search, the rest is kept for the communication
+time_margin = 0.9
+# Smallest time budget of a move in seconds, used when the clock is (nearly) spent
+min_time_budget = 0.01
+
 
 def run_gnugo(sgf_file_name, command):
     from distutils import spawn
@@ -43,7 +50,14 @@ class ExtendedGtpEngine(gtp.Engine):
             return ''
 
     def cmd_time_left(self, arguments):
-        pass
+        try:
+            color, seconds, stones = arguments.strip().split()
+            color, seconds, stones = gtp.parse_color(color), float(seconds), int(stones)
+        except Exception:
+            raise ValueError('time_left arguments could not be parsed: {}'.format(arguments))
+        if not color:
+            raise ValueError('Invalid color in time_left: {}'.format(arguments))
+        self._game.set_time_left(color, seconds, stones)
 
     def cmd_place_free_handicap(self, arguments):
         try:
@@ -62,8 +76,12 @@ class ExtendedGtpEngine(gtp.Engine):
         self._game.place_handicaps(moves)
 
     def cmd_final_score(self, arguments):
-        sgf_file_name = self._game.get_current_state_as_sgf()
-        return self.call_gnugo(sgf_file_name, 'final_score\n')
+        winner, margin = self._game.get_score()
+        if winner == go.BLACK:
+            return 'B+{:g}'.format(margin)
+        elif winner == go.WHITE:
+            return 'W+{:g}'.format(-margin)
+        return '0'
 
     def cmd_final_status_list(self, arguments):
         sgf_file_name = self._game.get_current_state_as_sgf()
@@ -87,6 +105,8 @@ class GTPGameConnector(object):
     def __init__(self, get_move):
         self._state = go.GameState(enforce_superko=True)
         self._get_move = get_move
+        # Time budget of the next move of each color in seconds, missing if the color has no clock
+        self._time_budgets = {}
 
     def clear(self):
         self._state = go.GameState(self._state.size, enforce_superko=True)
@@ -109,15 +129,31 @@ class GTPGameConnector(object):
     def set_komi(self, k):
         self._state.komi = k
 
+    def set_time_left(self, color, seconds, stones):
+        """Sets the time budget of the next move of color from the GTP time_left command.
+        stones is the number of moves to play in the current byo-yomi period, 0 in main time.
+        """
+        if stones > 0:
+            time_budget = time_margin * seconds / stones
+        else:
+            time_budget = time_margin * seconds * main_time_fraction
+        self._time_budgets[color] = max(time_budget, min_time_budget)
+
     def get_move(self, color):
         self._state.current_player = color
-        move = self._get_move(self._state)
+        if color not in self._time_budgets:
+            move = self._get_move(self._state)
+        else:
+            move = self._get_move(self._state, time_budget=self._time_budgets[color])
         if move == go.PASS_MOVE:
             return gtp.PASS
         else:
             (x, y) = move
             return (x + 1, y + 1)
 
+    def get_score(self):
+        return self._state.get_score()
+
     def get_current_state_as_sgf(self):
         from tempfile import NamedTemporaryFile
         temp_file = NamedTemporaryFile(delete=False)
@@ -1,4 +1,6 @@
 import AlphaZero.search.mcts as MCTS
+from AlphaZero.search.array_tree import ArrayMCTSearch
+from AlphaZero.search.transposition import TranspositionTable
 
 class Player:
     """
@@ -20,10 +22,30 @@ class Player:
 
         Args:
             eval_fun: NNEvaluator instance.
+            game_config: game config file.
+            ext_config: player config. 'tree' selects the search tree, one of 'node' (default),
+                'vectorized' and 'array'. 'batch_size' is the number of leaves evaluated in one batch.
+                'num_threads' is the number of search threads sharing the tree. 'time_budget' is the
+                search time of a move in seconds, and 'early_stop' stops the search when the result is decided.
+                'transposition_size' is the number of positions kept in the transposition table, 0 to disable it.
+                'undo_moves' takes back the moves of the serial playouts instead of copying the state.
         """
 
         self._game_config = game_config
-        self.mcts = MCTS.MCTSearch(eval_fun.eval, self._game_config, max_playout=ext_config['max_playout'])
+        options = {'batch_size': ext_config.get('batch_size', 1), 'num_threads': ext_config.get('num_threads', 1),
+                   'time_budget': ext_config.get('time_budget'), 'early_stop': ext_config.get('early_stop', False),
+                   'undo_moves': ext_config.get('undo_moves', False)}
+        if options['batch_size'] > 1 or options['num_threads'] > 1:
+            options['batch_evaluator'] = eval_fun.eval_batch
+        if ext_config.get('transposition_size', 0) > 0:
+            options['transposition_table'] = TranspositionTable(ext_config['transposition_size'])
+        tree = ext_config.get('tree', 'node')
+        if tree == 'array':
+            search = ArrayMCTSearch
+        else:
+            search = MCTS.MCTSearch
+            options['vectorized'] = (tree == 'vectorized')
+        self.mcts = search(eval_fun.eval, self._game_config, max_playout=ext_config['max_playout'], **options)
 
     def think(self, state, dirichlet=False):
         """
@@ -34,10 +56,25 @@ class Player:
             dirichlet: whether to apply dirichlet noise to the result prob distribution
 
         Returns:
-            tuple: The generated move and probabilities of moves
+            tuple: The generated move and the search probabilities of the flat action indices
         """
-        move, probs = self.mcts.calc_move_with_probs(state, dirichlet)
-        return move, probs
+        move, policy = self.mcts.calc_move_with_policy(state, dirichlet)
+        return move, policy
+
+    def think_gen(self, state, dirichlet=False):
+        """
+        Generator version of think. The states to evaluate are yielded and their evaluations are sent back,
+        see MCTSearch.calc_move_with_policy_gen.
+
+        Args:
+            state: a game state
+            dirichlet: whether to apply dirichlet noise to the result prob distribution
+
+        Returns:
+            tuple: The generated move and the search probabilities of the flat action indices
+        """
+        move, policy = yield from self.mcts.calc_move_with_policy_gen(state, dirichlet)
+        return move, policy
 
     def ack(self, move):
         """
@@ -47,3 +84,9 @@ class Player:
             move: A new move
         """
         self.mcts.update_with_move(move)
+
+    def reset(self):
+        """
+        Discard the MCT before a new game.
+        """
+        self.mcts.reset()
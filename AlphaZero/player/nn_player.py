@@ -1,3 +1,8 @@
+import importlib
+
+import numpy as np
+
+
 class Player:
     """
     Represents a player playing according to an evaluation function.
@@ -13,6 +18,8 @@ class Player:
 
         self._game_config = game_config
         self.eval_fun = nn_eval.eval
+        self._tensor_action_converter = importlib.import_module(
+            game_config['state_converter_path']).TensorActionConverter(game_config)
 
     def think(self, state):
         """
@@ -23,10 +30,11 @@ class Player:
         Returns:
             tuple: a tuple of the calculated move and None.
         """
-        move_candidates, _ = self.eval_fun(state.copy())
-        moves = [(action, prob) for action, prob in move_candidates if state.is_legal(action)]
-        move, _ = max(moves, key=lambda mv: mv[1])
-        return move, None
+        policy, _ = self.eval_fun(state.copy())
+        mask = state.legal_mask()
+        # The illegal moves are never chosen
+        probs = np.where(mask, policy[:len(mask)], -np.inf)
+        return self._tensor_action_converter.index_to_action(int(np.argmax(probs))), None
 
     def ack(self, move):
         """
@@ -2,6 +2,9 @@ import importlib
 
 import numpy as np
 
+from AlphaZero.env import dihedral
+from AlphaZero.processing.trackers import BoardPlanesTracker
+
 
 ##
 # individual feature functions (state --> tensor) begin here
@@ -27,42 +30,86 @@ class StateTensorConverter(object):
             },
             "color": {
                 "size": 1,
-                "function": lambda state: np.ones((1, state.height, state.width)) *
-                                          (state.current_player == self._game_env.BLACK)
+                "function": self.get_color
             }
         }
+        # The board_history planes can be kept up to date in do_move instead of computed for every evaluation
+        if config.get('incremental_planes', False):
+            self._FEATURES["board_history"]["tracker"] = (
+                "board_planes", lambda state: BoardPlanesTracker(state, config['history_step']))
 
         if feature_list is None:
             feature_list = ["board_history", "color"]
         self.output_dim = 0
         self.feature_list = feature_list
         self.processors = [None] * len(feature_list)
+        # The first plane of each feature in the output, and the end of the last feature
+        self._offsets = [0] * (len(feature_list) + 1)
+        # The trackers needed by the features, {name: constructor taking the state}
+        self._trackers = {}
         for i in range(len(feature_list)):
             feat = feature_list[i].lower()
             if feat in self._FEATURES:
                 self.processors[i] = self._FEATURES[feat]["function"]
                 self.output_dim += self._FEATURES[feat]["size"]
+                self._offsets[i + 1] = self.output_dim
+                if "tracker" in self._FEATURES[feat]:
+                    name, new_tracker = self._FEATURES[feat]["tracker"]
+                    self._trackers[name] = new_tracker
             else:
                 raise ValueError("unknown feature: %s" % feat)
 
-    def get_board_history(self, state):
-        """A feature encoding WHITE and BLACK on separate planes of recent history_length states
+    def add_trackers(self, state):
+        """Registers on a new game state the trackers read by the features, if any.
+        The states without them can only be converted with features that need no tracker.
+
+        Args:
+            state: a game state before its first move
+
+        Returns:
+            None
+        """
+        for name, new_tracker in self._trackers.items():
+            state.add_tracker(name, new_tracker(state))
+
+    def get_board_history(self, state, planes=None):
+        """A feature encoding WHITE and BLACK on separate planes of recent history_length states.
+        The planes are copied from the board_planes tracker of the state if it has one.
 
         Args:
             state: the game state
+            planes: the array to write the planes in, a new int8 array if None
 
         Returns:
-            numpy.ndarray
+            numpy.ndarray: planes
         """
+        if planes is None:
+            planes = np.empty((2 * self._config['history_step'], state.height, state.width), dtype=np.int8)
+        if "board_planes" in state.trackers:
+            return state.trackers["board_planes"].board_planes(state, planes)
+
+        # The history boards in order, the oldest first
+        board_history = state.board_history.ordered()[:self._config['history_step'] - 1]
+        np.equal(board_history, state.current_player, out=planes[0:-2:2])  # own stone
+        np.equal(board_history, -state.current_player, out=planes[1:-2:2])  # opponent stone
+
+        np.equal(state.board, state.current_player, out=planes[-2])  # own stone
+        np.equal(state.board, -state.current_player, out=planes[-1])  # opponent stone
+        return planes
 
-        planes = np.zeros((2 * self._config['history_step'], state.height, state.width))
+    def get_color(self, state, planes=None):
+        """A feature plane of ones if BLACK is to play, zeros otherwise
 
-        for t in range(self._config['history_step'] - 1):
-            planes[2 * t, :, :] = state.board_history[t] == state.current_player  # own stone
-            planes[2 * t + 1, :, :] = state.board_history[t] == -state.current_player  # opponent stone
+        Args:
+            state: the game state
+            planes: the array to write the plane in, a new int8 array if None
 
-        planes[2 * self._config['history_step'] - 2, :, :] = state.board == state.current_player  # own stone
-        planes[2 * self._config['history_step'] - 1, :, :] = state.board == -state.current_player  # opponent stone
+        Returns:
+            numpy.ndarray: planes
+        """
+        if planes is None:
+            planes = np.empty((1, state.height, state.width), dtype=np.int8)
+        planes.fill(state.current_player == self._game_env.BLACK)
         return planes
 
     def state_to_tensor(self, state):
@@ -71,15 +118,31 @@ class StateTensorConverter(object):
             state: the game state
 
         Returns:
-            numpy.ndarray
+            numpy.ndarray: an int8 array of shape (1, output_dim, height, width)
         """
-        feat_tensors = [proc(state) for proc in self.processors]
+        return self.states_to_tensor([state])
+
+    def states_to_tensor(self, states, out=None):
+        """Convert a batch of GameStates to the network input. Every feature writes its planes straight into
+        the output, there is no intermediate array.
 
-        # concatenate along feature dimension then add in a singleton 'batch' dimension
-        tensor = np.concatenate(feat_tensors).reshape((1, self.output_dim, state.height, state.width))
-        tensor = tensor.astype(np.int8)
+        Args:
+            states: a list of game states of the same shape
+            out: an int8 or uint8 array of shape (N, output_dim, height, width) with N >= len(states),
+                a new int8 array if None
 
-        return tensor
+        Returns:
+            numpy.ndarray: the first len(states) rows of out
+        """
+        if out is None:
+            height, width = (states[0].height, states[0].width) if states else (0, 0)
+            out = np.empty((len(states), self.output_dim, height, width), dtype=np.int8)
+        # The features are 0/1 planes, written through a boolean view to skip the casts
+        planes = out.view(np.bool_)
+        for n, state in enumerate(states):
+            for i, proc in enumerate(self.processors):
+                proc(state, planes[n, self._offsets[i]:self._offsets[i + 1]])
+        return out[:len(states)]
 
 
 class TensorActionConverter(object):
@@ -93,9 +156,23 @@ class TensorActionConverter(object):
         # The games allowing pass moves have an extra output position for pass move
         self._allow_pass_move = (config['flat_move_output'] - self._wid * self._hei == 1)
 
-    def tensor_to_action(self, tensor):
+    def index_to_action(self, index):
         """
 
+        Args:
+            index: a flat index of the output tensor
+
+        Returns:
+            tuple: the action (x, y), None for the pass move
+        """
+        if index == self._hei * self._wid:
+            # Pass move is always represented as None, no need for extra import
+            return None
+        return divmod(int(index), self._wid)
+
+    def tensor_to_action(self, tensor):
+        """ Converts the output to the list used before the flat policies, for the callers which still need it.
+
         Args:
             tensor: a 1D prob tensor with length flat_move_output
 
@@ -111,14 +188,59 @@ class TensorActionConverter(object):
 
 
 class ReverseTransformer(object):
-    """
-
+    """ Maps the actions and the policies of transformed states back to the original board, with the flat index
+    permutations of AlphaZero.env.dihedral.
     """
 
     def __init__(self, config):
         self._config = config
         self._wid = config['board_width']
         self._hei = config['board_height']
+        num_positions = self._hei * self._wid
+        self._actions = [(i // self._wid, i % self._wid) for i in range(num_positions)]
+        # For each transform, the original flat index of every flat index of the transformed board,
+        # and the inverse permutation. The pass move index is left in place. On a non-square board,
+        # only the transforms that keep the shape have tables.
+        self._reverse_index = {}
+        self._inverse = {}
+        for transform_id, (permutation, shape) in enumerate(dihedral.permutations(self._hei, self._wid)):
+            if shape == (self._hei, self._wid):
+                reverse_index = np.append(permutation, num_positions)
+                self._reverse_index[transform_id] = reverse_index
+                self._inverse[transform_id] = np.argsort(reverse_index)
+
+    def _check_transform(self, transform_id):
+        """ Raises a ValueError if the transform cannot be reversed on the boards of the config.
+        """
+        if transform_id not in self._reverse_index:
+            raise ValueError('Transform {} does not keep the shape of the {}x{} board and cannot be reversed'
+                             .format(transform_id, self._hei, self._wid))
+
+    def reverse_index(self, index, transform_id):
+        """ Maps flat action indices of a transformed board back to the original board with one gather.
+
+        Args:
+            index: an integer array of flat indices, the pass move is at height * width
+            transform_id: number used to perform the transform, range: [0, 7]
+
+        Returns:
+            numpy.ndarray: the flat indices on the original board
+        """
+        self._check_transform(transform_id)
+        return self._reverse_index[transform_id][index]
+
+    def reverse_policy(self, policy, transform_id):
+        """ Maps a flat policy vector of a transformed board back to the original board with one gather.
+
+        Args:
+            policy: a 1D prob vector with length flat_move_output
+            transform_id: number used to perform the transform, range: [0, 7]
+
+        Returns:
+            numpy.ndarray: the policy on the original board
+        """
+        self._check_transform(transform_id)
+        return policy[self._inverse[transform_id][:len(policy)]]
 
     def lr_reflection(self, action_prob):
         """ Flips the coordinate of action probability vector like np.fliplr
@@ -169,12 +291,15 @@ class ReverseTransformer(object):
             The function make modifications in place
 
         Args:
-            action_prob: list of (action, prob)
+            action_prob: list of (action, prob), the pass move (None) is left unchanged
             transform_id: number used to perform the transform, range: [0, 7]
 
         Returns:
             None
         """
-        self.reverse_nprot90(action_prob, transform_id % 4)
-        if transform_id // 4 == 1:
-            self.lr_reflection(action_prob)
+        self._check_transform(transform_id)
+        reverse_index = self._reverse_index[transform_id]
+        for i, (action, prob) in enumerate(action_prob):
+            if action is not None:
+                x, y = action
+                action_prob[i] = (self._actions[reverse_index[x * self._wid + y]], prob)
@@ -0,0 +1,116 @@
+import numpy as np
+
+from AlphaZero.env import dihedral
+
+
+class StoneAgeTracker(object):
+    """Keeps the turn at which the stone on each point was played, so that the age of every stone (the number
+    of moves played since) is known without updating all the stones at each move.
+    A captured stone needs no update: its point is empty until another stone is played there.
+    """
+
+    def __init__(self, height, width):
+        self._played_at = np.zeros((height, width), dtype=int)
+
+    def on_move(self, state, action, color):
+        if action is not None:
+            (x, y) = action
+            self._played_at[x, y] = state.turns
+
+    def on_undo(self, state, action):
+        # The point of the move is empty again, the age it keeps is not used
+        pass
+
+    def on_reset(self, state):
+        # The turns of the stones on the board are kept
+        pass
+
+    def transform(self, transform_id):
+        self._played_at = dihedral.transform(self._played_at, transform_id)
+
+    def copy(self):
+        other = StoneAgeTracker.__new__(StoneAgeTracker)
+        other._played_at = self._played_at.copy()
+        return other
+
+    def stone_ages(self, state):
+        """
+        Args:
+            state: the game state followed by this tracker
+
+        Returns:
+            numpy.ndarray: the age of the stone on each point, -1 on the empty points
+        """
+        # The empty points are 0 in every game environment
+        return np.where(state.board != 0, state.turns - self._played_at, -1)
+
+
+class BoardPlanesTracker(object):
+    """Keeps the stone planes of the last boards of a game, the current board included, so that the board_history
+    feature is a copy instead of comparing every history board to the player to move.
+
+    The planes are stored per color, BLACK first, in a ring buffer like AlphaZero.env.board_history.BoardHistory:
+    a move writes the planes of the new board only. The order of the colors is swapped when WHITE is to play.
+    """
+
+    def __init__(self, state, steps):
+        """
+        Args:
+            state: the game state to follow, its board and board_history are the first boards
+            steps: the number of boards kept, the current board included
+        """
+        self.steps = steps
+        self._planes = np.zeros((2 * steps, 2, state.height, state.width), dtype=np.bool_)
+        self.on_reset(state)
+
+    def on_reset(self, state):
+        # The planes are written again from the board and board_history of the state
+        self._planes.fill(False)
+        # The slot of the oldest board
+        self._start = 0
+        steps = self.steps
+        boards = list(state.board_history)[max(len(state.board_history) - steps + 1, 0):] + [state.board]
+        for slot, board in enumerate(boards, steps - len(boards)):
+            self._write(slot, board)
+
+    def _write(self, slot, board):
+        # BLACK is 1 and WHITE is -1 in every game environment
+        for i in (slot, slot + self.steps):
+            np.equal(board, 1, out=self._planes[i, 0])
+            np.equal(board, -1, out=self._planes[i, 1])
+
+    def on_move(self, state, action, color):
+        # The oldest board is dropped and the new board takes its slot
+        self._write(self._start, state.board)
+        self._start = (self._start + 1) % self.steps
+
+    def on_undo(self, state, action):
+        self._start = (self._start - 1) % self.steps
+        # The slot of the board taken back gets the oldest board again
+        self._write(self._start, state.board_history[-(self.steps - 1)] if self.steps > 1 else state.board)
+
+    def transform(self, transform_id):
+        self._planes = dihedral.transform(self._planes, transform_id)
+
+    def copy(self):
+        other = BoardPlanesTracker.__new__(BoardPlanesTracker)
+        other.steps = self.steps
+        other._planes = self._planes.copy()
+        other._start = self._start
+        return other
+
+    def board_planes(self, state, planes):
+        """Writes the own and opponent stone planes of the boards, the oldest first, as the board_history feature.
+
+        Args:
+            state: the game state followed by this tracker
+            planes: a boolean or int8 array of shape (2 * steps, height, width)
+
+        Returns:
+            numpy.ndarray: planes
+        """
+        ordered = self._planes[self._start:self._start + self.steps]
+        own = 0 if state.current_player == 1 else 1
+        planes[0::2] = ordered[:, own]
+        planes[1::2] = ordered[:, 1 - own]
+        return planes
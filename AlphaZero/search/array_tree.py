@@ -0,0 +1,443 @@
+import threading as thrd
+
+import numpy as np
+
+from AlphaZero.search.math_helper import puct_select, random_variate_dirichlet
+from AlphaZero.search.mcts import MCTSearch, c_punt, num_node_locks
+from AlphaZero.search.transposition import state_key
+
+
+class ArrayTree(object):
+    """ Search tree whose statistics are stored in preallocated NumPy arrays.
+
+    Every node is an integer index. The children of a node are allocated as one contiguous
+    block, so N(s,a), W(s,a) and P(s,a) of all the children can be read as array slices.
+    The arrays are doubled when the capacity is reached, or made large enough beforehand with reserve
+    when they are shared by threads.
+    """
+
+    def __init__(self, capacity=2 ** 16):
+        """
+        Args:
+            capacity: number of nodes allocated initially
+        """
+        self._capacity = max(capacity, 1)
+        # N(s,a)
+        self.visit_cnt = np.zeros(self._capacity, dtype=np.int32)
+        # W(s,a)
+        self.total_action_val = np.zeros(self._capacity, dtype=np.float64)
+        # P(s,a)
+        self.prior_prob = np.zeros(self._capacity, dtype=np.float64)
+        self.parent = np.full(self._capacity, -1, dtype=np.int32)
+        # The flat index of the action leading to the node
+        self.action = np.full(self._capacity, -1, dtype=np.int32)
+        self.child_start = np.zeros(self._capacity, dtype=np.int32)
+        self.child_cnt = np.zeros(self._capacity, dtype=np.int32)
+        self.size = 0
+        self.root = 0
+        # Threads expanding different nodes allocate their blocks one at a time
+        self._alloc_lock = thrd.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Drops all the nodes and creates a new root.
+
+        Returns:
+            None
+        """
+        self.size = 0
+        self.root = self._alloc(1)
+        self.prior_prob[self.root] = 1.0
+
+    def _alloc(self, num):
+        """ Allocates a contiguous block of fresh nodes.
+
+        Args:
+            num: number of nodes
+
+        Returns:
+            int: index of the first node in the block
+        """
+        with self._alloc_lock:
+            start = self.size
+            if start + num > self._capacity:
+                self._grow(start + num)
+            end = start + num
+            self.size = end
+        self.visit_cnt[start:end] = 0
+        self.total_action_val[start:end] = 0
+        self.prior_prob[start:end] = 0
+        self.parent[start:end] = -1
+        self.action[start:end] = -1
+        self.child_start[start:end] = 0
+        self.child_cnt[start:end] = 0
+        return start
+
+    def _grow(self, min_capacity):
+        """ Enlarges all the arrays to hold at least min_capacity nodes.
+        """
+        capacity = self._capacity
+        while capacity < min_capacity:
+            capacity *= 2
+        for name in ('visit_cnt', 'total_action_val', 'prior_prob', 'parent', 'action', 'child_start', 'child_cnt'):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+        self._capacity = capacity
+
+    def reserve(self, num):
+        """ Makes room for num more nodes, so that the arrays are not reallocated until they are allocated.
+
+        Args:
+            num: number of nodes
+
+        Returns:
+            None
+        """
+        if self.size + num > self._capacity:
+            self._grow(self.size + num)
+
+    def is_leaf(self, node):
+        """Checks if it is a leaf node (i.e. no nodes below this have been expanded).
+
+        Args:
+            node: index of the node
+
+        Returns:
+            bool: if the node is leaf.
+        """
+        return self.child_cnt[node] == 0
+
+    def children(self, node):
+        """ Gets the indices of the children.
+
+        Args:
+            node: index of the node
+
+        Returns:
+            range: indices of all the children of node
+        """
+        start = self.child_start[node]
+        return range(start, start + self.child_cnt[node])
+
+    def expand(self, node, actions, probs, value):
+        """Expand a leaf node according to the network evaluation.
+        NO visit count is updated in this function, make sure it's updated externally.
+
+        Args:
+            node: index of the leaf
+            actions: a list of flat action indices
+            probs: a list of prior probabilities of actions
+            value: the value of this node returned by the network
+
+        Returns:
+            None
+        """
+        if self.child_cnt[node] != 0:
+            return
+        self.total_action_val[node] += value
+        num = len(actions)
+        if num == 0:
+            return
+        start = self._alloc(num)
+        end = start + num
+        self.prior_prob[start:end] = probs
+        self.action[start:end] = actions
+        self.parent[start:end] = node
+        self.child_start[node] = start
+        self.child_cnt[node] = num
+
+    def select(self, node):
+        """ Select the best child of node.
+
+        Args:
+            node: index of the node
+
+        Returns:
+            int: the index of the child with highest Q(s,a)+U(s,a)
+        """
+        start = self.child_start[node]
+        end = start + self.child_cnt[node]
+        return start + puct_select(self.prior_prob[start:end], self.visit_cnt[start:end],
+                                   self.total_action_val[start:end], self.visit_cnt[node], c_punt)
+
+    def find_child(self, node, action):
+        """ Finds the child reached by action.
+
+        Args:
+            node: index of the node
+            action: flat index of the action
+
+        Returns:
+            int: index of the child, -1 if it does not exist
+        """
+        start = self.child_start[node]
+        match = np.flatnonzero(self.action[start:start + self.child_cnt[node]] == action)
+        if len(match) == 0:
+            return -1
+        return start + int(match[0])
+
+    def reroot(self, node):
+        """ Makes node the new root. Its subtree is moved to the front of the arrays in level order,
+        and the rest of the tree is discarded.
+
+        Args:
+            node: index of the new root
+
+        Returns:
+            None
+        """
+        levels = [np.array([node], dtype=np.int64)]
+        while True:
+            level = levels[-1]
+            counts = self.child_cnt[level].astype(np.int64)
+            total = counts.sum()
+            if total == 0:
+                break
+            # Children of one node are contiguous, the blocks are concatenated in the order of level
+            block_offsets = np.cumsum(counts) - counts
+            levels.append(np.repeat(self.child_start[level] - block_offsets, counts) + np.arange(total))
+        order = np.concatenate(levels)
+        new_index = np.full(self.size, -1, dtype=np.int64)
+        new_index[order] = np.arange(len(order))
+        num = len(order)
+
+        self.visit_cnt[:num] = self.visit_cnt[order]
+        self.total_action_val[:num] = self.total_action_val[order]
+        self.prior_prob[:num] = self.prior_prob[order]
+        self.action[:num] = self.action[order]
+        counts = self.child_cnt[order]
+        self.child_start[:num] = np.where(counts > 0, new_index[self.child_start[order]], 0)
+        self.child_cnt[:num] = counts
+        parents = self.parent[order]
+        parents[0] = -1
+        self.parent[:num] = np.where(parents >= 0, new_index[parents], -1)
+        self.size = num
+        self.root = 0
+
+
+class ArrayMCTSearch(MCTSearch):
+    """ Monte Carlo tree search on an ArrayTree.
+        It has the same API as MCTSearch, but it does not create an object for every node.
+        The nodes move when the tree is rerooted, so a transposition table only shares the evaluations.
+    """
+
+    def __init__(self, evaluator, game_config, max_playout=1600, capacity=None, **kwargs):
+        """
+        Arguments:
+            evaluator: A function that takes a state and returns (policies, value),
+                where value is a float in range [-1,1]
+                policies is a flat prob array of the board positions followed by the pass move if any,
+                or a list of (action, prob)
+            game_config: Game configuration file
+            max_playout: number of playouts per move
+            capacity: number of nodes allocated initially, large enough for one search by default
+            kwargs: other options of MCTSearch
+        """
+        super(ArrayMCTSearch, self).__init__(evaluator, game_config, max_playout, **kwargs)
+        # The flat index of every action of the board of the root, set with the actions in _prepare_root
+        self._action_index = {}
+        if capacity is None:
+            capacity = (max_playout + 1) * game_config['flat_move_output']
+        self._tree = ArrayTree(capacity)
+        self._root = self._tree.root
+
+    def _to_flat(self, action):
+        """ Gets the flat action index of an action of the board of the root, -1 if there is none.
+        """
+        return self._action_index.get(action, -1)
+
+    def _expand(self, node, state, children_candidates, value):
+        """ Expands a leaf with the legal children returned by _evaluate, the flat indices are the actions of the tree.
+
+        Args:
+            node: index of the leaf
+            state: the board state of the leaf
+            children_candidates: the (priors, legal_mask) of the legal children, None if there is none
+            value: the value of the leaf
+
+        Returns:
+            None
+        """
+        if children_candidates is None:
+            self._tree.expand(node, [], [], value)
+            return
+        priors, legal_mask = children_candidates
+        index = np.flatnonzero(legal_mask)
+        self._tree.expand(node, index, priors[index], value)
+
+    def _node_lock(self, node):
+        """ Gets the lock protecting the statistics and the children of node, see MCTSearch._node_lock.
+            The arrays are not reallocated while the threads run, see _run_threads.
+
+        Args:
+            node: index of the node
+
+        Returns:
+            the lock of node
+        """
+        if not self._threaded:
+            return self._no_lock
+        return self._node_locks[node % num_node_locks]
+
+    def _run_threads(self, state, budget):
+        """ Runs playouts with num_threads threads sharing the tree, see MCTSearch._run_threads.
+            Every playout expands at most one leaf with at most one child per action, the room for all of them
+            is made before the threads start.
+        """
+        self._tree.reserve(max(budget.max_playout - budget.playouts, 1) * len(self._actions))
+        super(ArrayMCTSearch, self)._run_threads(state, budget)
+
+    def _select_leaf(self, state, node, virtual_loss=0):
+        """ Greedily descends from node to a leaf, visiting every node on the way.
+
+        Args:
+            state: the board state of node, moves are played on it until the leaf is reached
+            node: index of the node to start the descent
+            virtual_loss: subtracted from W(s,a) of every node on the path until _expand_and_backup is called
+
+        Returns:
+            list: a list of (node, current_player) from node to the leaf
+        """
+        tree = self._tree
+        _, actions = self._flat_index(state.height, state.width)
+        path = []
+        while True:
+            with self._node_lock(node):
+                tree.visit_cnt[node] += 1
+                if virtual_loss:
+                    tree.total_action_val[node] -= virtual_loss
+                if tree.child_cnt[node] == 0:
+                    next_node = -1
+                else:
+                    next_node = tree.select(node)
+                    action = actions[tree.action[next_node]]
+            path.append((node, state.current_player))
+            if next_node < 0:
+                return path
+            state.do_move(action)
+            node = next_node
+
+    def _expand_and_backup(self, path, state, children_candidates, value, virtual_loss=0):
+        """ Expands the leaf at the end of path and updates all the nodes on path.
+
+        Args:
+            path: a list of (node, current_player) returned by _select_leaf
+            state: the board state of the leaf
+            children_candidates: the (priors, legal_mask) returned by _evaluate, None if the state is terminal
+            value: the value of the leaf returned by the evaluator
+            virtual_loss: the virtual loss applied in _select_leaf, which is reverted
+
+        Returns:
+            real: the black win value used in the update
+        """
+        tree = self._tree
+        leaf, leaf_player = path[-1]
+        if not children_candidates or state.is_end_of_game:
+            value = state.get_winner()
+            children_candidates = None
+        with self._node_lock(leaf):
+            expanded = children_candidates and tree.is_leaf(leaf)
+            if expanded:
+                self._expand(leaf, state, children_candidates, -leaf_player * value + virtual_loss)
+            else:
+                tree.total_action_val[leaf] += -leaf_player * value + virtual_loss
+        if expanded and self._transposition is not None:
+            self._transposition.store(state_key(state), children_candidates, value)
+        for node, current_player in path[:-1]:
+            with self._node_lock(node):
+                tree.total_action_val[node] += -current_player * value + virtual_loss
+        return value
+
+    def _get_root_visit_counts(self):
+        """ Gets N(s,a) of the children of the root.
+
+        Returns:
+            numpy.ndarray: the visit counts
+        """
+        children = self._tree.children(self._root)
+        return self._tree.visit_cnt[children.start:children.stop]
+
+    def _get_search_policy(self):
+        """ Calculate the search probabilities exponentially to the visit counts.
+            Returns:
+                numpy.ndarray: the probability of every flat action index, the pass move last,
+                zero for the actions without a child
+        """
+        children = self._tree.children(self._root)
+        counts = self._get_root_visit_counts()
+        policy = np.zeros(len(self._actions))
+        policy[self._tree.action[children.start:children.stop]] = counts / counts.sum()
+        return policy
+
+    def _get_search_probs(self):
+        """ Calculate the search probabilities as a list for the callers of calc_move_with_probs.
+            Returns:
+                list: a list of (action, probs)
+        """
+        children = self._tree.children(self._root)
+        counts = self._get_root_visit_counts()
+        probs = counts / counts.sum()
+        return [(self._to_action(flat), prob)
+                for flat, prob in zip(self._tree.action[children.start:children.stop], probs)]
+
+    def _get_most_visited_move(self):
+        """ Finds the child of the root with most visits.
+
+        Returns:
+            tuple: the action of the most visited child
+        """
+        best = self._tree.child_start[self._root] + int(np.argmax(self._get_root_visit_counts()))
+        return self._to_action(self._tree.action[best])
+
+    def _prepare_root(self, state, dirichlet=False, evaluation=None):
+        """ Visits the root, expands it if needed and applies the Dirichlet noise.
+
+        Args:
+            state: current state
+            dirichlet: enable Dirichlet noise described in "Self-play" section
+            evaluation: the result of _evaluate(state) if it is already done
+
+        Returns:
+            None
+        """
+        tree = self._tree
+        tree.visit_cnt[self._root] += 1
+        self._action_index, self._actions = self._flat_index(state.height, state.width)
+        if tree.is_leaf(self._root):
+            children_candidates, value = evaluation or self._evaluate(state)
+            # Relative to the player who moved into the root, as for the leaves
+            self._expand(self._root, state, children_candidates, -state.current_player * value)
+            if self._transposition is not None:
+                self._transposition.store(state_key(state), children_candidates, value)
+
+        if dirichlet:
+            children = tree.children(self._root)
+            dirichlet_rand = np.asarray(random_variate_dirichlet(self.d_alpha, len(children)))
+            priors = tree.prior_prob[children.start:children.stop]
+            tree.prior_prob[children.start:children.stop] = (1 - self.d_epsilon) * priors + self.d_epsilon * dirichlet_rand
+
+    def reset(self):
+        """ Discards the tree before a new game, the arrays are kept for the next one.
+
+        Returns:
+            None
+        """
+        self._tree.reset()
+        self._root = self._tree.root
+        if self._transposition is not None:
+            self._transposition.clear()
+
+    def update_with_move(self, last_move):
+        """Step forward in the tree, keeping everything we already know about the subtree, assuming
+        that calc_move() has been called already. Siblings of the new root are discarded.
+        Returns:
+            None
+        """
+        child = self._tree.find_child(self._root, self._to_flat(last_move))
+        if child >= 0:
+            self._tree.reroot(child)
+        else:
+            self._tree.reset()
+        self._root = self._tree.root
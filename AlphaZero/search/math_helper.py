@@ -1,5 +1,8 @@
+import math
 import random
 
+import numpy as np
+
 
 def random_state_transform(state):
     """ Performs a dihedral reflection or rotation.
@@ -21,3 +24,37 @@ def weighted_random_choice(li):
     # This requires Python 3.6, should be implemented otherwise
     p, w = zip(*li)
     return random.choices(p, weights=w)[0]
+
+
+def weighted_random_index(weights):
+    """ Draws an index with a probability proportional to its weight, with the same draw as weighted_random_choice.
+
+    Args:
+        weights: a 1D array of non-negative weights, which are not necessarily normalized
+
+    Returns:
+        int: the drawn index
+    """
+    cum_weights = np.cumsum(weights)
+    return int(np.searchsorted(cum_weights, random.random() * cum_weights[-1], side='right'))
+
+
+def puct_select(prior_probs, visit_cnts, total_action_vals, parent_visit_cnt, c_puct):
+    """ Finds the child with the highest Q(s,a)+U(s,a) with one vector operation.
+    The formula and the tie breaking (first maximum) are the same as MCTreeNode.select.
+
+    Args:
+        prior_probs: array of P(s,a) of the children
+        visit_cnts: array of N(s,a) of the children
+        total_action_vals: array of W(s,a) of the children
+        parent_visit_cnt: N(s,a) of the parent
+        c_puct: exploration constant
+
+    Returns:
+        int: index of the selected child
+    """
+    # Q(s,a) is zero for the unvisited children, whose W(s,a) is also zero
+    q = total_action_vals / np.maximum(visit_cnts, 1)
+    # U(s,a)=c_punt * P(s,a) * sqrt(Parent's N(s,a)) / (1 + N(s,a))
+    u = c_puct * prior_probs * math.sqrt(parent_visit_cnt) / (1.0 + visit_cnts)
+    return int(np.argmax(q + u))
@@ -1,12 +1,55 @@
 import importlib
 import math
+import threading as thrd
+import time
 
+import numpy as np
 from numpy.random import randint
 
-from AlphaZero.search.math_helper import random_variate_dirichlet, weighted_random_choice
+from AlphaZero.evaluator.batch_eval_thrd import BatchEvaluatorThrd
+from AlphaZero.search.math_helper import puct_select, random_variate_dirichlet, weighted_random_index
+from AlphaZero.search.transposition import state_key
 
 # Parameter for PUCT Algorithm
 c_punt = 5.0
+# Number of locks shared by the nodes in tree-parallel search
+num_node_locks = 256
+# Number of playouts between two checks of early stopping
+early_stop_interval = 8
+
+# The flat index tables are the same for every board of the same shape, hence this shared
+# lookup table {(height, width): (flat index of every action, action of every flat index)}
+_FLAT_INDEX_CACHE = {}
+
+
+def flat_index_table(height, width):
+    """ Gets the table of the index of every action in the legal masks of the boards of a size.
+
+    Args:
+        height: the height of the board
+        width: the width of the board
+
+    Returns:
+        tuple: a dict of the flat index of every (x, y) action and the list of the action of every flat index,
+        the pass move is after the board positions
+    """
+    tables = _FLAT_INDEX_CACHE.get((height, width))
+    if tables is None:
+        actions = [(x, y) for x in range(height) for y in range(width)] + [None]
+        tables = ({action: i for i, action in enumerate(actions)}, actions)
+        _FLAT_INDEX_CACHE[(height, width)] = tables
+    return tables
+
+
+class _NoLock(object):
+    """ Lock used by single-threaded search, does nothing.
+    """
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
 
 
 class MCTreeNode(object):
@@ -26,13 +69,47 @@ class MCTreeNode(object):
         # self.mean_action_val = 0
         # P(s,a)
         self._prior_prob = prior_prob
+        # The flat action index of every child, in the order of the children
+        self._child_index = None
 
-    def expand(self, policy, value):
+    def expand(self, policy, value, height=None, width=None):
         """Expand a leaf node according to the network evaluation.
         NO visit count is updated in this function, make sure it's updated externally.
 
         Args:
-            policy: a list of (action, prob) tuples returned by the network
+            policy: a list of (action, prob) tuples returned by the network, only these actions are children
+            value: the value of this node returned by the network
+            height: the height of the board, by default the smallest one holding the actions of the policy,
+                so it is needed when the policy does not reach the last row
+            width: the width of the board, by default the smallest one holding the actions of the policy,
+                so it is needed when the policy does not reach the last column
+
+        Returns:
+            None
+        """
+        positions = [action for action, _ in policy if action is not None]
+        if height is None:
+            height = max([x for x, _ in positions], default=-1) + 1
+        if width is None:
+            width = max([y for _, y in positions], default=-1) + 1
+        flat_index, actions = flat_index_table(height, width)
+        # Every action of the list goes to its flat action index
+        index = np.fromiter(map(flat_index.__getitem__, (action for action, _ in policy)), dtype=np.intp,
+                            count=len(policy))
+        priors = np.zeros(len(actions))
+        priors[index] = [prob for _, prob in policy]
+        legal_mask = np.zeros(len(actions), dtype=bool)
+        legal_mask[index] = True
+        self.expand_flat(priors, legal_mask, actions, value)
+
+    def expand_flat(self, priors, legal_mask, actions, value):
+        """Expand a leaf node with the legal actions of a flat policy.
+        NO visit count is updated in this function, make sure it's updated externally.
+
+        Args:
+            priors: an array of P(s,a) for every flat action index
+            legal_mask: a boolean array, True for the flat action indices of the children
+            actions: the action of every flat action index
             value: the value of this node returned by the network
 
         Returns:
@@ -45,11 +122,10 @@ class MCTreeNode(object):
         # Update W(s,a) for this parent node by formula W(s,a) = W(s,a) + v
         self.update(value)
         # Create valid children
-        for action, prob in policy:
-            # TODO: Is there an extra condition to check pass and suicide?
-            # 		checking will be moved to MCTSearch
-            if action not in self._children:
-                self._children[action] = MCTreeNode(self, prob)
+        index = np.flatnonzero(legal_mask)
+        self._child_index = index
+        for i, prob in zip(index.tolist(), priors[index].tolist()):
+            self._children[actions[i]] = MCTreeNode(self, prob)
 
     def select(self):
         """ Select the best child of this node.
@@ -119,6 +195,24 @@ class MCTreeNode(object):
 
         return self._children == {}
 
+    def child_visit_counts(self):
+        """Gets N(s,a) of all the children.
+
+        Returns:
+            numpy.ndarray: the visit counts in the order of children
+        """
+        return np.array([child._visit_cnt for child in self._children.values()])
+
+    def child_indices(self):
+        """Gets the flat action indices of all the children.
+
+        Returns:
+            numpy.ndarray: the indices in the order of child_visit_counts
+        """
+        if self._child_index is None:
+            return np.zeros(0, dtype=np.intp)
+        return self._child_index
+
     def is_root(self):
         """Checks if it is a root node.
 
@@ -144,21 +238,266 @@ class MCTreeNode(object):
         self._prior_prob = value
 
 
+class VectorizedMCTreeNode(MCTreeNode):
+    """Tree Node in MCTS which keeps N(s,a), W(s,a) and P(s,a) of all its children in one contiguous
+    array, so that Q(s,a)+U(s,a) of the children is computed with one NumPy operation in select().
+    Child nodes are views into the array of the parent, and they are only created when needed.
+    """
+
+    def __init__(self, parent, prior_prob, stats=None, index=0):
+        """
+        Args:
+            parent: the parent node, None for the root
+            prior_prob: P(s,a) of the root, ignored if stats is given
+            stats: the (3, n) array of N(s,a), W(s,a), P(s,a) of the siblings, None for the root
+            index: the column of this node in stats
+        """
+        self._parent = parent
+        self._children = {}
+        # The action of every flat action index, and the flat action index of every column of the child array
+        self._child_actions = None
+        self._child_index = None
+        self._child_stats = None
+        if stats is None:
+            stats = np.array([[0.0], [0.0], [prior_prob]])
+        self._stats = stats
+        self._index = index
+
+    def _get_child(self, index):
+        action = self._child_actions[self._child_index[index]]
+        node = self._children.get(action)
+        if node is None:
+            node = VectorizedMCTreeNode(self, None, self._child_stats, index)
+            self._children[action] = node
+        return action, node
+
+    def expand_flat(self, priors, legal_mask, actions, value):
+        """Expand a leaf node with the legal actions of a flat policy. The child array is filled
+        with one gather, the child nodes are created when they are selected.
+        NO visit count is updated in this function, make sure it's updated externally.
+
+        Args:
+            priors: an array of P(s,a) for every flat action index
+            legal_mask: a boolean array, True for the flat action indices of the children
+            actions: the action of every flat action index
+            value: the value of this node returned by the network
+
+        Returns:
+            None
+        """
+        if not self.is_leaf():
+            return
+        self.update(value)
+        index = np.flatnonzero(legal_mask)
+        if len(index) == 0:
+            return
+        self._child_actions = actions
+        self._child_index = index
+        stats = np.zeros((3, len(index)))
+        stats[2] = priors[index]
+        self._child_stats = stats
+
+    def select(self):
+        """ Select the best child of this node.
+
+        Returns:
+            tuple: A tuple of (action, next_node) with highest Q(s,a)+U(s,a)
+        """
+        visit_cnts, total_action_vals, prior_probs = self._child_stats
+        return self._get_child(puct_select(prior_probs, visit_cnts, total_action_vals,
+                                           self._stats[0, self._index], c_punt))
+
+    def update(self, v):
+        """ Update W(s,a)
+
+        Args:
+            v: value
+
+        Returns:
+            None
+        """
+        self._stats[1, self._index] += v
+
+    def visit(self):
+        """Increment the visit count.
+
+        Returns:
+            None
+        """
+        self._stats[0, self._index] += 1
+
+    def is_leaf(self):
+        """Checks if it is a leaf node (i.e. no nodes below this have been expanded).
+
+        Returns:
+            bool: if the current node is leaf.
+        """
+        return self._child_stats is None
+
+    def child_visit_counts(self):
+        """Gets N(s,a) of all the children.
+
+        Returns:
+            numpy.ndarray: the visit counts in the order of the child array
+        """
+        if self._child_stats is None:
+            return np.zeros(0)
+        return self._child_stats[0]
+
+    @property
+    def _visit_cnt(self):
+        return int(self._stats[0, self._index])
+
+    @property
+    def _total_action_val(self):
+        return self._stats[1, self._index]
+
+    @property
+    def _prior_prob(self):
+        return self._stats[2, self._index]
+
+    @property
+    def visit_count(self):
+        return self._visit_cnt
+
+    @property
+    def children(self):
+        # Create all the children in the order of the array
+        num_children = len(self.child_indices())
+        if len(self._children) != num_children:
+            self._children = dict(self._get_child(index) for index in range(num_children))
+        return self._children
+
+    @property
+    def prior_prob(self):
+        return self._prior_prob
+
+    @prior_prob.setter
+    def prior_prob(self, value):
+        self._stats[2, self._index] = value
+
+
+class _SearchBudget(object):
+    """ Counts the playouts of one search and decides when it stops. The search stops when the playout
+    budget or the time budget is used up, or, with early stopping, when the most visited child of the root
+    cannot be overtaken by the playouts that remain. It can be shared by the search threads.
+    """
+
+    def __init__(self, search, max_playout, time_budget, early_stop):
+        """
+        Args:
+            search: the MCTSearch
+            max_playout: the maximum number of playouts
+            time_budget: the maximum time of the search in seconds, None for no limit
+            early_stop: whether to stop when the result cannot change
+        """
+        self._search = search
+        self.max_playout = max_playout
+        self._start = time.time()
+        self._deadline = None if time_budget is None else self._start + time_budget
+        self._early_stop = early_stop
+        # The first check is after the first playout, the root may have no visits before
+        self._next_check = 1
+        self._lock = thrd.Lock()
+        self.stopped = False
+        self.playouts = 0
+
+    def _remaining(self):
+        """ Estimates the number of playouts that can still be done.
+        """
+        remaining = self.max_playout - self.playouts
+        if self._deadline is not None:
+            now = time.time()
+            if now >= self._deadline:
+                remaining = 0
+            elif self.playouts > 0:
+                # Estimated from the playout rate so far
+                rate = self.playouts / max(now - self._start, 1e-6)
+                remaining = min(remaining, int(rate * (self._deadline - now)) + 1)
+        if self.playouts == 0:
+            # At least one playout is done so that the root has a visited child to choose
+            remaining = max(remaining, 1)
+        return remaining
+
+    def take(self, num):
+        """ Reserves at most num playouts.
+
+        Args:
+            num: the number of playouts to do next
+
+        Returns:
+            int: the number of playouts that can be done, 0 if the search should stop
+        """
+        with self._lock:
+            if self.stopped:
+                return 0
+            remaining = self._remaining()
+            if self._early_stop and self.playouts >= self._next_check and remaining > 0:
+                self._next_check = self.playouts + early_stop_interval
+                if self._search._is_decided(remaining):
+                    remaining = 0
+            if remaining <= 0:
+                self.stopped = True
+                return 0
+            num = min(num, remaining)
+            self.playouts += num
+            return num
+
+
 class MCTSearch(object):
     """ Create a Monto Carlo search tree.
     """
 
-    def __init__(self, evaluator, game_config, max_playout=1600):
+    def __init__(self, evaluator, game_config, max_playout=1600, vectorized=False, batch_evaluator=None,
+                 batch_size=1, virtual_loss=1.0, num_threads=1, time_budget=None, early_stop=False,
+                 transposition_table=None, undo_moves=False):
         """
         Arguments:
             evaluator: A function that takes a state and returns (policies, value),
                 where value is a float in range [-1,1]
-                policies is a list of (action, prob)
+                policies is a flat prob array of the board positions followed by the pass move if any,
+                or a list of (action, prob)
             game_config: Game configuration file
+            max_playout: number of playouts per move
+            vectorized: use VectorizedMCTreeNode, which selects children with NumPy
+            batch_evaluator: A function that takes a list of states and returns a list of (policies, value).
+                evaluator is called on every state if not given.
+            batch_size: number of leaves collected with virtual loss and evaluated together
+            virtual_loss: the value subtracted from W(s,a) of the nodes on a pending path
+            num_threads: number of threads running playouts on the tree. The evaluation requests of the
+                threads are evaluated in batches with batch_evaluator.
+            time_budget: the maximum time of one search in seconds, None for no limit
+            early_stop: stop the search when the most visited child of the root cannot be overtaken
+                in the playouts that remain
+            transposition_table: a TranspositionTable sharing the evaluations and statistics of
+                the positions reached by different move orders, None to disable it
+            undo_moves: play the serial playouts on one copy of the root state and take their moves back
+                with undo_move, instead of copying the root state in every playout.
+                The game environment must implement enable_undo and undo_move.
         """
-        self._root = MCTreeNode(None, 1.0)
+        self._node_cls = VectorizedMCTreeNode if vectorized else MCTreeNode
+        self._root = self._node_cls(None, 1.0)
         self._evaluator = evaluator
+        if batch_evaluator is None:
+            batch_evaluator = lambda states: [evaluator(state) for state in states]
+        self._batch_evaluator = batch_evaluator
+        self._batch_size = batch_size
+        self._virtual_loss = virtual_loss
+        self._num_threads = num_threads
+        # Nodes are locked only when the tree is shared by threads
+        self._no_lock = _NoLock()
+        self._threaded = False
+        self._node_locks = [thrd.Lock() for _ in range(num_node_locks)] if num_threads > 1 else None
         self._max_playout = max_playout
+        self._time_budget = time_budget
+        self._early_stop = early_stop
+        self._transposition = transposition_table
+        self._undo_moves = undo_moves
+        # Flat action indices of the legal masks {(height, width): ({action: index}, [action for each index])}
+        # The action of every flat action index of the boards of the root
+        self._actions = None
+        # The number of playouts done in the last search
+        self.num_playouts = 0
         self.d_alpha = game_config['d_alpha']
         self.d_epsilon = game_config['d_epsilon']
         self._transform_types = game_config['transform_types']
@@ -168,119 +507,479 @@ class MCTSearch(object):
             self.enable_transform = True
             self._sc = importlib.import_module(game_config['state_converter_path'])
             self._reverse_transformer = self._sc.ReverseTransformer(game_config)
-            self._reverse_transform = self._reverse_transformer.reverse_transform
 
-    def _playout(self, state, node):
+    def _transform_for_eval(self, state):
+        """ Applies a random transform to a copy of state if transforms are enabled.
+
+        Args:
+            state: the state to evaluate, it will not be modified
+
+        Returns:
+            tuple: the state to pass to the evaluator and the transform ID (None if not transformed)
+        """
+        if not self.enable_transform:
+            return state, None
+        # Generate a random transform ID
+        random_transform_id = randint(self._transform_types)
+        state_eval = state.copy()
+        state_eval.transform(random_transform_id)
+        return state_eval, random_transform_id
+
+    def _flat_index(self, height, width):
+        """ Gets the table of the index of every action in the legal masks of the boards of a size.
+
+        Args:
+            height: the height of the board
+            width: the width of the board
+
+        Returns:
+            tuple: a dict of the flat index of every (x, y) action and the list of the action of every flat index,
+            the pass move is after the board positions
+        """
+        return flat_index_table(height, width)
+
+    def _legal_candidates(self, state, policy, transform_id):
+        """ Reverses the transform of the evaluator output, removes the illegal children with the legal mask
+            of the state and renormalizes the probabilities of the legal ones.
+
+        Args:
+            state: the evaluated state
+            policy: the flat prob array or the list of (action, prob) returned by the evaluator
+            transform_id: the transform ID returned by _transform_for_eval
+
+        Returns:
+            tuple: (priors, legal_mask), two flat arrays of height * width + 1 entries with the pass move last.
+            The priors are zero outside of the mask. None if there is no legal child.
+        """
+        num_positions = state.height * state.width
+        priors = np.zeros(num_positions + 1)
+        # An extra False entry for the pass move of the games without it
+        legal_mask = np.zeros(num_positions + 1, dtype=bool)
+        mask = state.legal_mask()
+        legal_mask[:len(mask)] = mask
+        if isinstance(policy, np.ndarray):
+            if transform_id is not None:
+                # The policy of the transformed board is mapped back with one gather
+                policy = self._reverse_transformer.reverse_policy(policy, transform_id)
+            priors[:len(policy)] = policy
+        else:
+            # Compatibility with the evaluators returning a list of (action, prob),
+            # only the actions in the list are children
+            if not policy:
+                return None
+            actions, probs = zip(*policy)
+            flat_index, _ = self._flat_index(state.height, state.width)
+            index = np.fromiter(map(flat_index.__getitem__, actions), dtype=np.intp, count=len(actions))
+            if transform_id is not None:
+                index = self._reverse_transformer.reverse_index(index, transform_id)
+            priors[index] = probs
+            listed = np.zeros_like(legal_mask)
+            listed[index] = True
+            legal_mask &= listed
+        if not legal_mask.any():
+            return None
+        priors *= legal_mask
+        total = priors.sum()
+        if total > 0:
+            priors /= total
+        return priors, legal_mask
+
+    def _expand(self, node, state, children_candidates, value):
+        """ Expands a leaf with the legal children returned by _evaluate.
+
+        Args:
+            node: the leaf
+            state: the board state of the leaf
+            children_candidates: the (priors, legal_mask) of the legal children, None if there is none
+            value: the value of the leaf
+
+        Returns:
+            None
+        """
+        if children_candidates is None:
+            node.update(value)
+            return
+        priors, legal_mask = children_candidates
+        node.expand_flat(priors, legal_mask, self._flat_index(state.height, state.width)[1], value)
+
+    def _evaluate(self, state, evaluator=None):
+        """ Evaluates a state with the evaluator and removes the illegal children.
+            A random transform is applied before the evaluation if enabled.
+
+        Args:
+            state: the state to evaluate, it will not be modified
+            evaluator: the evaluation function to use instead of the default one
+
+        Returns:
+            tuple: the (priors, legal_mask) of the legal children and the value returned by the evaluator
+        """
+        if self._transposition is not None:
+            result = self._lookup_transposition(state)
+            if result is not None:
+                return result
+        state_eval, transform_id = self._transform_for_eval(state)
+        children_candidates, value = (evaluator or self._evaluator)(state_eval)
+        return self._legal_candidates(state, children_candidates, transform_id), value
+
+    def _evaluate_gen(self, state):
+        """ Generator version of _evaluate. The state to pass to the evaluator is yielded, and the
+            (policies, value) returned by the evaluator is expected to be sent back.
+
+        Args:
+            state: the state to evaluate, it will not be modified
+
+        Returns:
+            tuple: the (priors, legal_mask) of the legal children and the value returned by the evaluator
         """
-        Recursively executes playout from the current node.
+        if self._transposition is not None:
+            result = self._lookup_transposition(state)
+            if result is not None:
+                return result
+        state_eval, transform_id = self._transform_for_eval(state)
+        children_candidates, value = yield state_eval
+        return self._legal_candidates(state, children_candidates, transform_id), value
+
+    def _evaluate_batch(self, states):
+        """ Evaluates a list of states with one call of the batch evaluator.
+
+        Args:
+            states: the states to evaluate, they will not be modified
+
+        Returns:
+            list: a list of ((priors, legal_mask), value), one for each state
+        """
+        if self._transposition is None:
+            results = [None] * len(states)
+        else:
+            results = [self._lookup_transposition(state) for state in states]
+        # Only the states not found in the transposition table are evaluated
+        misses = [i for i, result in enumerate(results) if result is None]
+        if misses:
+            states_eval, transform_ids = zip(*[self._transform_for_eval(states[i]) for i in misses])
+            evaluated = self._batch_evaluator(list(states_eval))
+            for i, transform_id, (children_candidates, value) in zip(misses, transform_ids, evaluated):
+                results[i] = (self._legal_candidates(states[i], children_candidates, transform_id), value)
+        return results
+
+    def _lookup_transposition(self, state):
+        """ Finds the evaluation result of state in the transposition table. If the node expanded for
+            the position is still in the tree, its mean action value replaces the value of the evaluator.
+
+        Args:
+            state: the state to evaluate
+
+        Returns:
+            tuple: the (priors, legal_mask) of the legal children and the black win value,
+            None if the position is not found
+        """
+        result = self._transposition.lookup(state_key(state))
+        if result is None:
+            return None
+        children_candidates, value, node = result
+        if node is not None and node.visit_count > 0:
+            # W(s,a) of the node is relative to the player who moved into it
+            value = -state.current_player * node.get_mean_action_value()
+        return children_candidates, value
+
+    def _node_lock(self, node):
+        """ Gets the lock protecting the statistics and the children of node.
+            Nodes share a fixed number of locks, which are only used when the tree is shared by threads.
+
+        Args:
+            node: a node of the tree
+
+        Returns:
+            the lock of node
+        """
+        if not self._threaded:
+            return self._no_lock
+        # Objects are aligned to 16 bytes
+        return self._node_locks[(id(node) >> 4) % num_node_locks]
+
+    def _select_leaf(self, state, node, virtual_loss=0):
+        """ Greedily descends from node to a leaf, visiting every node on the way.
+
+        Args:
+            state: the board state of node, moves are played on it until the leaf is reached
+            node: the node to start the descent
+            virtual_loss: subtracted from W(s,a) of every node on the path until _expand_and_backup is called
+
+        Returns:
+            list: a list of (node, current_player) from node to the leaf
+        """
+        path = []
+        while True:
+            with self._node_lock(node):
+                # The current node is visited
+                node.visit()
+                if virtual_loss:
+                    node.update(-virtual_loss)
+                # TODO: Do we need a max tree depth/size?
+                if node.is_leaf():
+                    next_node = None
+                else:
+                    # Greedily select next move.
+                    action, next_node = node.select()
+            path.append((node, state.current_player))
+            if next_node is None:
+                return path
+            state.do_move(action)
+            node = next_node
+
+    def _expand_and_backup(self, path, state, children_candidates, value, virtual_loss=0):
+        """ Expands the leaf at the end of path and updates all the nodes on path.
+
+        Args:
+            path: a list of (node, current_player) returned by _select_leaf
+            state: the board state of the leaf
+            children_candidates: the (priors, legal_mask) returned by _evaluate, None if the state is terminal
+            value: the value of the leaf returned by the evaluator
+            virtual_loss: the virtual loss applied in _select_leaf, which is reverted
+
+        Returns:
+            real: the black win value used in the update
+        """
+        leaf, leaf_player = path[-1]
+        # If not the end of game, expand node and terminate playout.
+        # Else just terminate playout.
+        if not children_candidates or state.is_end_of_game:
+            # No valid move, game should end. Overwrite the value with the real game result.
+            # Game result is absolute: 1, 0, or -1
+            value = state.get_winner()
+            children_candidates = None
+        with self._node_lock(leaf):
+            # Value stored (total action value) is always relative to itself
+            # i.e. 1 if it wins and -1 if it loses
+            # value returned by NN has -1 when white wins, multiplication will inverse
+            expanded = children_candidates and leaf.is_leaf()
+            if expanded:
+                self._expand(leaf, state, children_candidates, -leaf_player * value + virtual_loss)
+            else:
+                # Terminal, or another pending path has expanded it
+                leaf.update(-leaf_player * value + virtual_loss)
+        if expanded and self._transposition is not None:
+            self._transposition.store(state_key(state), children_candidates, value, leaf)
+        # Visit count is updated when the node is selected in _select_leaf
+        # Therefore there is no visit count update in update()
+        for node, current_player in path[:-1]:
+            with self._node_lock(node):
+                # Update relative value
+                node.update(-current_player * value + virtual_loss)
+        return value
+
+    def _playout(self, state, node, undo=False):
+        """
+        Executes playout from the current node.
         Args:
             state: current board state
             node: the node to start simulation
+            undo: take back the moves of the playout, so that state is the state of node again
 
         Returns:
             real: the action value of the current node
         """
+        path = self._select_leaf(state, node)
+        if state.is_end_of_game:
+            # The real game result will be used, no need to evaluate
+            children_candidates, value = None, 0
+        else:
+            # Evaluate the state and get output from NN
+            children_candidates, value = self._evaluate(state)
+        value = self._expand_and_backup(path, state, children_candidates, value)
+        if undo:
+            self._undo_path(state, path)
+        return value
 
-        # The current node is visited
-        node.visit()
+    def _undo_path(self, state, path):
+        """ Takes back the moves played by _select_leaf on path.
 
-        # TODO: Do we need a max tree depth/size?
-        if not node.is_leaf():
-            # Greedily select next move.
-            action, next_node = node.select()
-            #
-            current_player = state.current_player
-            state.do_move(action)
-            # The result of the simulation is returned after the complete playout
-            # Update this level of node with this value
-            simres_value = self._playout(state, next_node)
-            # Visit count is updated when. this node is first called with _playout
-            # Therefore there is no visit count update in update()
-            # Update relative value
-            node.update(-current_player * simres_value)
-            # Return the same result to the parent
-            return simres_value
-
-        else:  # Node is a leaf
-            # Evaluate the state and get output from NN
-            if self.enable_transform:
-                # Generate a random transform ID
-                random_transform_id = randint(self._transform_types)
-                state_eval = state.copy()
-                state_eval.transform(random_transform_id)
-                transformed_children_candidates, value = self._evaluator(state_eval)
-                self._reverse_transform(transformed_children_candidates, random_transform_id)
-                children_candidates = transformed_children_candidates
-            else:
-                children_candidates, value = self._evaluator(state)
-            # Remove invalid children
-            children_candidates = [(action, prob) for action, prob in children_candidates if state.is_legal(action)]
-            # If not the end of game, expand node and terminate playout.
-            # Else just terminate playout.
-            if len(children_candidates) != 0 and not state.is_end_of_game:
-                # Value stored (total action value) is always relative to itself
-                # i.e. 1 if it wins and -1 if it loses
-                # value returned by NN has -1 when white wins, multiplication will inverse
-                node.expand(children_candidates, -state.current_player * value)
-            # Q(s,a)=W(s,a)
-            # Return the black win value to update (recursively)
+        Args:
+            state: the board state of the leaf of path
+            path: a list of (node, current_player) returned by _select_leaf
+
+        Returns:
+            None
+        """
+        for _ in range(len(path) - 1):
+            state.undo_move()
+
+    def _undo_state(self, state):
+        """ Gets the copy of the root state used by all the playouts when undo_moves is enabled.
+
+        Args:
+            state: current board state
+
+        Returns:
+            a copy of state recording its moves
+        """
+        state = state.copy()
+        state.enable_undo()
+        return state
+
+    def _playout_batch(self, state, batch_size):
+        """
+        Executes batch_size playouts from the root. The leaves are selected one after another with virtual
+        loss, so that the paths tend to differ, and are evaluated with one call of the batch evaluator.
+        Args:
+            state: current board state, it will not be modified
+            batch_size: number of playouts
+
+        Returns:
+            None
+        """
+        pending = []
+        for _ in range(batch_size):
+            leaf_state = state.copy()
+            path = self._select_leaf(leaf_state, self._root, self._virtual_loss)
+            pending.append((path, leaf_state))
+        # The same leaf may be reached more than once, evaluate it only once
+        eval_index = {}
+        eval_states = []
+        for path, leaf_state in pending:
+            leaf = path[-1][0]
+            if not leaf_state.is_end_of_game and leaf not in eval_index:
+                eval_index[leaf] = len(eval_states)
+                eval_states.append(leaf_state)
+        results = self._evaluate_batch(eval_states) if eval_states else []
+        for path, leaf_state in pending:
+            if leaf_state.is_end_of_game:
+                children_candidates, value = None, 0
             else:
-                # No valid move, game should end. Overwrite the value with the real game result.
-                # Game result is absolute: 1, 0, or -1
-                value = state.get_winner()
-                node.update(-state.current_player * value)
-            return value
+                children_candidates, value = results[eval_index[path[-1][0]]]
+            self._expand_and_backup(path, leaf_state, children_candidates, value, self._virtual_loss)
 
-    def _get_search_probs(self):
+    def _playout_thrd(self, state, evaluator, budget, errors):
+        """
+        The loop of a search thread. It executes playouts from the root until the budget shared by
+        the threads is used up.
+        Args:
+            state: current board state, it will not be modified
+            evaluator: the evaluation function shared by the threads
+            budget: the _SearchBudget of the search
+            errors: a list to put the exception raised in the thread
+
+        Returns:
+            None
+        """
+        try:
+            while budget.take(1):
+                leaf_state = state.copy()
+                path = self._select_leaf(leaf_state, self._root, self._virtual_loss)
+                if leaf_state.is_end_of_game:
+                    children_candidates, value = None, 0
+                else:
+                    children_candidates, value = self._evaluate(leaf_state, evaluator)
+                self._expand_and_backup(path, leaf_state, children_candidates, value, self._virtual_loss)
+        except Exception as e:
+            errors.append(e)
+
+    def _run_threads(self, state, budget):
+        """
+        Runs playouts with num_threads threads sharing the tree. The evaluation requests of
+        the threads are collected by a BatchEvaluatorThrd.
+        Args:
+            state: current board state, it will not be modified
+            budget: the _SearchBudget of the search
+
+        Returns:
+            None
+        """
+        errors = []
+        self._threaded = True
+        try:
+            with BatchEvaluatorThrd(self._batch_evaluator, self._num_threads) as evaluator:
+                threads = [thrd.Thread(target=self._playout_thrd, args=(state, evaluator.eval, budget, errors),
+                                       name='mcts_' + str(i)) for i in range(self._num_threads)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+        finally:
+            self._threaded = False
+        if errors:
+            raise errors[0]
+
+    def _get_root_visit_counts(self):
+        """ Gets N(s,a) of the children of the root.
+
+        Returns:
+            numpy.ndarray: the visit counts
+        """
+        return self._root.child_visit_counts()
+
+    def _is_decided(self, remaining):
+        """ Checks if the most visited child of the root can still be overtaken.
+
+        Args:
+            remaining: the number of playouts that remain
+
+        Returns:
+            bool: True if no other child can get more visits than the most visited one
+        """
+        counts = self._get_root_visit_counts()
+        if len(counts) < 2:
+            return True
+        second, first = np.partition(counts, -2)[-2:]
+        return first - second > remaining
+
+    def _to_action(self, flat):
+        """ Gets the action of a flat action index of the board of the root.
+        """
+        return self._actions[flat]
+
+    def _get_search_policy(self):
         """ Calculate the search probabilities exponentially to the visit counts.
+            Returns:
+                numpy.ndarray: the probability of every flat action index, the pass move last,
+                zero for the actions without a child
+        """
+        counts = self._get_root_visit_counts()
+        policy = np.zeros(len(self._actions))
+        policy[self._root.child_indices()] = counts / counts.sum()
+        return policy
+
+    def _get_search_probs(self):
+        """ Calculate the search probabilities as a list for the callers of calc_move_with_probs.
             Returns:
                 list: a list of (action, probs)
         """
-        # A list of (action, selection_weight), weight is not normalized
-        moves = [(action, node.visit_count) for action, node in self._root.children.items()]
-        total = sum([count for _, count in moves])
-        normalized_probs = [(action, count / total) for action, count in moves]
-        return normalized_probs
+        policy = self._get_search_policy().tolist()
+        return [(self._to_action(flat), policy[flat]) for flat in self._root.child_indices().tolist()]
 
-    def _calc_move(self, state, dirichlet=False):
-        """ Performs MCTS.
+    def _get_most_visited_move(self):
+        """ Finds the child of the root with most visits.
 
-            "temperature" parameter of the two random dist is not implemented,
-            because the value is set to either 1 or 0 in the paper, which can
-            be controlled by toggling the option.
+        Returns:
+            tuple: the action of the most visited child
+        """
+        return self._to_action(self._root.child_indices()[int(np.argmax(self._get_root_visit_counts()))])
 
-            Args:
-                state: current state
-                dirichlet: enable Dirichlet noise described in "Self-play" section
+    def _prepare_root(self, state, dirichlet=False, evaluation=None):
+        """ Visits the root, expands it if needed and applies the Dirichlet noise.
 
-            Returns:
-                None
+        Args:
+            state: current state
+            dirichlet: enable Dirichlet noise described in "Self-play" section
+            evaluation: the result of _evaluate(state) if it is already done
 
+        Returns:
+            None
         """
         # The root of the tree is visited.
         self._root.visit()
+        _, self._actions = self._flat_index(state.height, state.width)
 
         # Dirichlet noise is applied to the children of the roots, we will expand the
         # root first
 
         if self._root.is_leaf():
             # Evaluate the state and get output from NN
-            if self.enable_transform:
-                # Generate a random transform ID
-                random_transform_id = randint(self._transform_types)
-                state_eval = state.copy()
-                state_eval.transform(random_transform_id)
-                transformed_children_candidates, value = self._evaluator(state_eval)
-                self._reverse_transform(transformed_children_candidates, random_transform_id)
-                children_candidates = transformed_children_candidates
-            else:
-                children_candidates, value = self._evaluator(state)
-
-            # Remove invalid children
-            children_candidates = [(action, prob) for action, prob in children_candidates if state.is_legal(action)]
-
-            # Only create legal children
-            self._root.expand(children_candidates, value)
+            children_candidates, value = evaluation or self._evaluate(state)
+            # Only create legal children. W(s,a) of the root is relative to the player who moved into it,
+            # as for the leaves expanded in _expand_and_backup, so that its statistics can be shared.
+            self._expand(self._root, state, children_candidates, -state.current_player * value)
+            if self._transposition is not None:
+                self._transposition.store(state_key(state), children_candidates, value, self._root)
 
         if dirichlet:
             # Get a list of random numbers from d=Dirichlet distribution
@@ -290,48 +989,172 @@ class MCTSearch(object):
                 self._root.children[action].prior_prob = (1 - self.d_epsilon) * self._root.children[
                     action].prior_prob + self.d_epsilon * eta
 
+    def _calc_move(self, state, dirichlet=False, max_playout=None, time_budget=None):
+        """ Performs MCTS.
+
+            "temperature" parameter of the two random dist is not implemented,
+            because the value is set to either 1 or 0 in the paper, which can
+            be controlled by toggling the option.
+
+            Args:
+                state: current state
+                dirichlet: enable Dirichlet noise described in "Self-play" section
+                max_playout: the playout budget of this search, overrides the default one
+                time_budget: the time budget of this search in seconds, overrides the default one
+
+            Returns:
+                None
+
+        """
+        self._prepare_root(state, dirichlet)
+
         # Do search loop while playout limit is not reached and time remains
-        # TODO: Implement timing module
-        for _ in range(self._max_playout):
-            self._playout(state.copy(), self._root)
+        budget = _SearchBudget(self, self._max_playout if max_playout is None else max_playout,
+                               self._time_budget if time_budget is None else time_budget, self._early_stop)
+        if self._num_threads > 1:
+            self._run_threads(state, budget)
+        elif self._batch_size > 1:
+            while True:
+                batch_size = budget.take(self._batch_size)
+                if batch_size == 0:
+                    break
+                self._playout_batch(state, batch_size)
+        elif self._undo_moves:
+            root_state = self._undo_state(state)
+            while budget.take(1):
+                self._playout(root_state, self._root, undo=True)
+        else:
+            while budget.take(1):
+                self._playout(state.copy(), self._root)
+        self.num_playouts = budget.playouts
 
-    def calc_move(self, state, dirichlet=False, prop_exp=True):
+    def calc_move(self, state, dirichlet=False, prop_exp=True, max_playout=None, time_budget=None):
         """ Calculates the best move
 
         Args:
             state: current state
             dirichlet: enable Dirichlet noise described in "Self-play" section
             prop_exp: select the final decision proportional to its exponential visit
+            max_playout: the playout budget of this search, overrides the default one
+            time_budget: the time budget of this search in seconds, overrides the default one
 
         Returns:
             tuple: the calculated result (x, y)
 
         """
-        self._calc_move(state, dirichlet)
+        self._calc_move(state, dirichlet, max_playout, time_budget)
         # Select the best move according to the final search tree
         # select node randomly with probability: N(s,a)/ParentN(s,a)
         if prop_exp:
-            # A list of (action, selection_weight), weight is not necessarily normalized
-            return weighted_random_choice(self._get_search_probs())
+            return self._to_action(weighted_random_index(self._get_search_policy()))
         else:
             # Directly select the node with most visits
-            return max(self._root.children.items(), key=lambda act_node: act_node[1].visit_count)[0]
+            return self._get_most_visited_move()
+
+    def calc_move_with_policy(self, state, dirichlet=False, max_playout=None, time_budget=None):
+        """ Calculates the best move, and return the search probabilities as a flat array.
+            This function should only be used for self-play.
+
+        Args:
+            state: current state
+            dirichlet: enable Dirichlet noise described in "Self-play" section
+            max_playout: the playout budget of this search, overrides the default one
+            time_budget: the time budget of this search in seconds, overrides the default one
+
+        Returns:
+            tuple: the result (x, y) and the probability of every flat action index, the pass move last
+        """
+        self._calc_move(state, dirichlet, max_playout, time_budget)
+        policy = self._get_search_policy()
+        return self._to_action(weighted_random_index(policy)), policy
 
-    def calc_move_with_probs(self, state, dirichlet=False):
+    def calc_move_with_probs(self, state, dirichlet=False, max_playout=None, time_budget=None):
         """ Calculates the best move, and return the search probabilities.
             This function should only be used for self-play.
 
         Args:
             state: current state
             dirichlet: enable Dirichlet noise described in "Self-play" section
+            max_playout: the playout budget of this search, overrides the default one
+            time_budget: the time budget of this search in seconds, overrides the default one
 
         Returns:
             tuple: the result (x, y) and a list of (action, probs)
         """
-        self._calc_move(state, dirichlet)
-        probs = self._get_search_probs()
-        result = weighted_random_choice(self._get_search_probs())
-        return result, probs
+        result, _ = self.calc_move_with_policy(state, dirichlet, max_playout, time_budget)
+        return result, self._get_search_probs()
+
+    def calc_move_with_policy_gen(self, state, dirichlet=False, max_playout=None):
+        """ Generator version of calc_move_with_policy, which lets the caller evaluate the states of many
+            searches together. Every state to evaluate is yielded, and the (policies, value) returned by
+            the evaluator is expected to be sent back. The playouts are serial and the time budget is not used.
+            With undo_moves, the yielded state is modified after its evaluation is sent back.
+
+        Example:
+
+            search = mcts.calc_move_with_policy_gen(state)
+            try:
+                state_eval = next(search)
+                while True:
+                    state_eval = search.send(evaluator(state_eval))
+            except StopIteration as stop:
+                move, policy = stop.value
+
+        Args:
+            state: current state
+            dirichlet: enable Dirichlet noise described in "Self-play" section
+            max_playout: the playout budget of this search, overrides the default one
+
+        Returns:
+            tuple: the result (x, y) and the probability of every flat action index, the pass move last
+        """
+        evaluation = None
+        if len(self._get_root_visit_counts()) == 0:
+            evaluation = yield from self._evaluate_gen(state)
+        self._prepare_root(state, dirichlet, evaluation)
+
+        budget = _SearchBudget(self, self._max_playout if max_playout is None else max_playout, None,
+                               self._early_stop)
+        root_state = self._undo_state(state) if self._undo_moves else None
+        while budget.take(1):
+            leaf_state = root_state if self._undo_moves else state.copy()
+            path = self._select_leaf(leaf_state, self._root)
+            if leaf_state.is_end_of_game:
+                children_candidates, value = None, 0
+            else:
+                children_candidates, value = yield from self._evaluate_gen(leaf_state)
+            self._expand_and_backup(path, leaf_state, children_candidates, value)
+            if self._undo_moves:
+                self._undo_path(leaf_state, path)
+        self.num_playouts = budget.playouts
+
+        policy = self._get_search_policy()
+        return self._to_action(weighted_random_index(policy)), policy
+
+    def calc_move_with_probs_gen(self, state, dirichlet=False, max_playout=None):
+        """ Generator version of calc_move_with_probs, see calc_move_with_policy_gen.
+
+        Args:
+            state: current state
+            dirichlet: enable Dirichlet noise described in "Self-play" section
+            max_playout: the playout budget of this search, overrides the default one
+
+        Returns:
+            tuple: the result (x, y) and a list of (action, probs)
+        """
+        result, _ = yield from self.calc_move_with_policy_gen(state, dirichlet, max_playout)
+        return result, self._get_search_probs()
+
+    def reset(self):
+        """ Discards the tree before a new game. The transposition table is cleared as well, because
+            the network may be different in the next game.
+
+        Returns:
+            None
+        """
+        self._root = self._node_cls(None, 1.0)
+        if self._transposition is not None:
+            self._transposition.clear()
 
     def update_with_move(self, last_move):
         """Step forward in the tree, keeping everything we already know about the subtree, assuming
@@ -343,4 +1166,4 @@ class MCTSearch(object):
             self._root = self._root.children[last_move]
             self._root._parent = None
         else:
-            self._root = MCTreeNode(None, 1.0)
+            self._root = self._node_cls(None, 1.0)
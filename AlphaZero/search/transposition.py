@@ -0,0 +1,100 @@
+import threading as thrd
+import weakref
+from collections import OrderedDict
+
+
+def state_key(state):
+    """ Gets the key identifying the position of a state in a TranspositionTable.
+        The key is made of the Zobrist hash of the board, the player to move, the ko point (Go only)
+        and whether the last move is a pass, which decides if the next pass ends the game.
+
+    Args:
+        state: a GameState with current_hash
+
+    Returns:
+        tuple: the key of the position
+    """
+    last_pass = len(state.history) > 0 and state.history[-1] is None
+    return int(state.current_hash), state.current_player, getattr(state, 'ko', None), last_pass
+
+
+class TranspositionTable(object):
+    """ Bounded table of the positions expanded by MCTSearch, shared by the nodes reaching the same
+    position through different move orders. A position keeps the evaluation result (legal policy and value)
+    and a weak reference to the node expanded for it, so that the statistics of the node can be reused
+    while it is alive. The least recently used position is evicted when the table is full.
+
+    The evaluator sees the move history of the state, which is not part of the key. The shared evaluation
+    is the one of the first state reaching the position.
+    """
+
+    def __init__(self, max_size=100000):
+        """
+        Args:
+            max_size: the maximum number of positions in the table
+        """
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = thrd.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, key):
+        """ Finds a position and marks it as recently used.
+
+        Args:
+            key: the key returned by state_key
+
+        Returns:
+            tuple: ((priors, legal_mask), value, node), None if the position is not in the table.
+                node is None if the node expanded for the position has been discarded.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+        children_candidates, value, node_ref = entry
+        return children_candidates, value, None if node_ref is None else node_ref()
+
+    def store(self, key, children_candidates, value, node=None):
+        """ Adds a position. The evaluation result of a position already in the table is kept,
+            only the node is replaced if the previous one has been discarded.
+
+        Args:
+            key: the key returned by state_key
+            children_candidates: the (priors, legal_mask) of the legal children returned by MCTSearch._evaluate
+            value: the value returned by the evaluator
+            node: the node expanded for the position
+
+        Returns:
+            None
+        """
+        node_ref = None if node is None else weakref.ref(node)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if node_ref is not None and (entry[2] is None or entry[2]() is None):
+                    self._entries[key] = (entry[0], entry[1], node_ref)
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = (children_candidates, value, node_ref)
+            while len(self._entries) > self.max_size:
+                # Evict the least recently used position
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """ Removes all the positions and resets the counters.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
@@ -49,7 +49,8 @@ class Evaluator:
         self.num_not_tie = mp.Value('i', 0)
 
         self.num_worker = ext_config['num_worker']
-        self.worker_lim = mp.Semaphore(self.num_worker)
+        self.task_queue = mp.Queue()
+        self.worker_stats = WorkerStats(self.num_worker)
 
         self.join_worker = mp.Semaphore(0)
         self.finished_worker = mp.Value('i', 0)
@@ -67,40 +68,59 @@ class Evaluator:
         self.proc.terminate()
         tb.print_exception(exc_type, exc_val, exc_tb)
 
-    def eval_wrapper(self, color_of_new):
+    def eval_wrapper(self, game, color_of_new):
         """
         Wrapper for a single game.
 
         Args:
+            game: The Game to play, its players are reset after the game
             color_of_new: The color of the new model (challenger)
         """
         self.nn_eval_chal.rwlock.r_acquire()
         self.nn_eval_best.rwlock.r_acquire()
 
         # printlog('begin')
-        if color_of_new == _game_env.BLACK:
-            game = _gameplay.Game(self.nn_eval_chal, self.nn_eval_best, self.game_config, self.ext_config['gameplay'])
-        else:
-            game = _gameplay.Game(self.nn_eval_best, self.nn_eval_chal, self.game_config, self.ext_config['gameplay'])
         winner = game.start()
-        if winner == color_of_new:
-            self.win_counter.value += 1
-        if winner is not None and winner != 0:
-            self.num_not_tie.value += 1
+        with self.win_counter.get_lock():
+            if winner == color_of_new:
+                self.win_counter.value += 1
+            if winner is not None and winner != 0:
+                self.num_not_tie.value += 1
         printlog('winner', winner)
+        game.reset()
 
-        self.worker_lim.release()
-        self.finished_worker.value += 1
-        if self.finished_worker.value == self.num_games:
-            self.join_worker.release()
+        with self.finished_worker.get_lock():
+            self.finished_worker.value += 1
+            if self.finished_worker.value == self.num_games:
+                self.join_worker.release()
 
         self.nn_eval_best.rwlock.r_release()  # increment counter
         self.nn_eval_chal.rwlock.r_release()  # increment counter
 
+    def eval_worker(self, worker_id):
+        """
+        A long-lived evaluation worker. It plays the games put in the task queue back to back,
+        reusing one game for each color of the challenger.
+
+        Args:
+            worker_id: The index of the worker
+        """
+        games = {_game_env.BLACK: _gameplay.Game(self.nn_eval_chal, self.nn_eval_best, self.game_config,
+                                                 self.ext_config['gameplay']),
+                 _game_env.WHITE: _gameplay.Game(self.nn_eval_best, self.nn_eval_chal, self.game_config,
+                                                 self.ext_config['gameplay'])}
+        while True:
+            color_of_new = self.task_queue.get()
+            self.eval_wrapper(games[color_of_new], color_of_new)
+            self.worker_stats.add_game(worker_id)
+
     def run(self):
         """
         The main evaluation process. It will launch games asynchronously and examine the winning rate.
         """
+        self.worker_stats.start_time.value = time.time()
+        for i in range(self.num_worker):
+            mp.Process(target=self.eval_worker, args=(i,), name='eval_worker_' + str(i)).start()
         printlog('loop begin')
         while True:
             new_model_path = self.r_conn.recv()
@@ -113,12 +133,13 @@ class Evaluator:
             # open pool
             color_of_new_list = [_game_env.BLACK, _game_env.WHITE] * (self.num_games // 2) + [
                 _game_env.BLACK] * (self.num_games % 2)
-            for i, c in enumerate(color_of_new_list):
-                self.worker_lim.acquire()
-                mp.Process(target=self.eval_wrapper, args=(c,), name='eval_game_' + str(i)).start()
+            for c in color_of_new_list:
+                self.task_queue.put(c)
             # wait
             self.join_worker.acquire()
             printlog('win rate', self.win_counter.value / (self.num_not_tie.value + 1e-9))
+            rates = self.worker_stats.games_per_hour()
+            printlog('games per hour: total %.1f, per worker %.1f' % (sum(rates), sum(rates) / len(rates)))
             if self.win_counter.value > int(0.55 * self.num_not_tie.value):
                 # save model
                 # self.nn_eval_chal.save('./model/best_name')
@@ -77,7 +77,8 @@ if __name__ == '__main__':
 
     with datapool.DataPool(ext_config['datapool']) as selfplay_opti_q, \
             nn_eval.NNEvaluator(cluster, game_config, ext_config['chal']) as nn_eval_chal, \
-            nn_eval.NNEvaluator(cluster, game_config, ext_config['best']) as nn_eval_best, \
+            nn_eval.NNEvaluator(cluster, game_config,
+                                selfplay.fit_multiplex(ext_config['best'], ext_config['selfplay'])) as nn_eval_best, \
             optimization.Optimizer(cluster, opti_eval_s, selfplay_opti_q, game_config, ext_config['optimizer']) as opti, \
             evaluator.Evaluator(nn_eval_chal, nn_eval_best, opti_eval_r, eval_selfplay_s, game_config, ext_config['evaluator']) as eval_, \
             selfplay.Selfplay(nn_eval_best, eval_selfplay_r, selfplay_opti_q, game_config, ext_config['selfplay']) as selfplay_:
@@ -12,6 +12,7 @@ import tensorflow as tf
 # import AlphaZero.game.go.gameplay as gameplay
 from AlphaZero.train.parallel.util import *
 import AlphaZero.evaluator.nn_eval_parallel as nn_eval
+from AlphaZero.game.multiplex import MultiplexedSelfplay
 
 with open(os.path.join(os.path.dirname(__file__), '..', '..', 'config', 'game.yaml')) as f:
     game_selection = yaml.load(f)['game']
@@ -25,6 +26,23 @@ def kill_children():
         p.terminate()
 
 
+def fit_multiplex(eval_config, selfplay_config):
+    """
+    Makes the NNEvaluator of the self play workers evaluate all the leaves of a multiplexed step in one forward
+    pass, by raising its target batch size to games_per_worker.
+
+    Args:
+        eval_config: The ext_config of the NNEvaluator
+        selfplay_config: The ext_config of Selfplay
+
+    Returns:
+        dict: the ext_config of the NNEvaluator
+    """
+    games_per_worker = selfplay_config.get('games_per_worker', 1)
+    target_batch_size = eval_config.get('target_batch_size', eval_config['max_batch_size'])
+    return dict(eval_config, target_batch_size=max(target_batch_size, games_per_worker))
+
+
 class Selfplay:
     """
     This class generates training data from self play games.
@@ -40,7 +58,9 @@ class Selfplay:
         r_conn: Pipe to receive the model updating message
         data_queue: Queue to put the data
         game_config: A dictionary of game environment configuration
-        ext_config: A dictionary of system configuration
+        ext_config: A dictionary of system configuration. 'num_worker' is the number of self play workers, and
+            'report_interval' is the number of seconds between two reports of their speed. A worker plays
+            'games_per_worker' games at the same time, evaluating their leaves in one batch.
     """
     def __init__(self, nn_eval, r_conn, data_queue, game_config, ext_config):
         printlog('create selfplay')
@@ -54,7 +74,9 @@ class Selfplay:
         self.remote_port = ext_config['remote_port']
         self.remote_update_port = ext_config['remote_update_port']
         self.remote_worker_reg = {}
-        self.worker_lim = mp.Semaphore(self.num_worker)
+        self.worker_stats = WorkerStats(self.num_worker)
+        self.report_interval = ext_config.get('report_interval', 600)
+        self.games_per_worker = ext_config.get('games_per_worker', 1)
         self.game_config = game_config
         self.ext_config = ext_config
 
@@ -68,29 +90,59 @@ class Selfplay:
         self.proc.terminate()
         tb.print_exception(exc_type, exc_val, exc_tb)
 
-    def selfplay_wrapper(self):
+    def selfplay_worker(self, worker_id):
         """
-        Wrapper for a single self play game.
+        A long-lived self play worker. It plays games back to back, reusing the players and the converters.
+
+        Args:
+            worker_id: The index of the worker
         """
-        # process comm
-        self.nn_eval.rwlock.r_acquire()
-        # start game
+        if self.games_per_worker > 1:
+            self.multiplexed_worker(worker_id)
+            return
         game = _gameplay.Game(self.nn_eval, self.nn_eval, self.game_config, self.ext_config['gameplay'])
-        game.start()
-        # get game history
-        # convert
-        data = game.get_history()
-        # TODO: random flip
-        # put in queue
-        self.data_queue.put(data)
-        # process comm
-        self.nn_eval.rwlock.r_release()
-
-        self.worker_lim.release()
+        while True:
+            # process comm
+            self.nn_eval.rwlock.r_acquire()
+            # start game
+            game.start()
+            # get game history
+            # convert
+            data = game.get_history()
+            # TODO: random flip
+            # put in queue
+            self.data_queue.put(data)
+            # process comm
+            self.nn_eval.rwlock.r_release()
+
+            self.worker_stats.add_game(worker_id)
+            game.reset()
+
+    def multiplexed_worker(self, worker_id):
+        """
+        A self play worker playing games_per_worker games at the same time. The model may be updated
+        between two batches, so a game can be played by more than one model.
+
+        Args:
+            worker_id: The index of the worker
+        """
+        def batch_evaluator(states):
+            # process comm
+            self.nn_eval.rwlock.r_acquire()
+            try:
+                return self.nn_eval.eval_batch(states)
+            finally:
+                self.nn_eval.rwlock.r_release()
+
+        selfplay = MultiplexedSelfplay(self.nn_eval, self.game_config, self.ext_config['gameplay'],
+                                       self.games_per_worker, batch_evaluator)
+        for game in selfplay.play():
+            self.data_queue.put(game.get_history())
+            self.worker_stats.add_game(worker_id)
 
     def run(self):
         """
-        The main data generation process. It will keep launching self play games.
+        The main data generation process. It will launch the self play workers and report their speed.
         """
         printlog('start')
 
@@ -100,12 +152,14 @@ class Selfplay:
             thrd.Thread(target=self.rcv_remote_data_handler, name="selfplay_rcv_remote_hndl", daemon=True).start()
             thrd.Thread(target=self.model_update_handler, name='selfplay_model_update_hndl', daemon=True).start()
 
-        cnt = 0
+        self.worker_stats.start_time.value = time.time()
+        for i in range(self.num_worker):
+            mp.Process(target=self.selfplay_worker, args=(i,),
+                       name=self.game_config['name'] + '_selfplay_worker_' + str(i)).start()
         while True:
-            self.worker_lim.acquire()
-            mp.Process(target=self.selfplay_wrapper,
-                       name=self.game_config['name'] + '_selfplay_game_' + str(cnt)).start()
-            cnt += 1
+            time.sleep(self.report_interval)
+            rates = self.worker_stats.games_per_hour()
+            printlog('games per hour: total %.1f, per worker %.1f' % (sum(rates), sum(rates) / len(rates)))
 
     def model_update_handler(self):
         """
@@ -192,7 +246,8 @@ if __name__ == '__main__':
     eval_dgen_r, eval_dgen_s = Block_Pipe()
     dgen_opti_q = Remote_Queue(args.addr, ext_config['selfplay']['remote_port'])
 
-    with nn_eval.NNEvaluator(cluster, game_config, ext_config['best']) as nn_eval_best, \
+    with nn_eval.NNEvaluator(cluster, game_config, fit_multiplex(ext_config['best'], ext_config['selfplay'])) \
+            as nn_eval_best, \
             Selfplay(nn_eval_best, eval_dgen_r, dgen_opti_q, game_config, ext_config['selfplay']) as dgen:
 
         while True:
@@ -5,6 +5,8 @@ import socket
 import pickle
 import time
 
+import numpy as np
+
 
 print_lock = mp.Lock()
 def printlog(*msg):
@@ -57,17 +59,29 @@ class ServerClientConn:
             self.conn_idx_queue.put(i)
 
     def req(self, r):
+        return self.recv_res(self.send_req(r))
+
+    def send_req(self, r):
+        """Sends a request without waiting for the response, recv_res(ticket) gets it."""
         i = self.conn_idx_queue.get()
         r_conn, s_conn = self.conns[i]
-        self.queue.put((r, s_conn))
+        self.queue.put((r, s_conn, time.time()))
+        return i
+
+    def recv_res(self, i):
+        r_conn, _ = self.conns[i]
         res = r_conn.recv()
         self.conn_idx_queue.put(i)
         return res
 
-    def get(self, block=True):
-        r, s_conn = self.queue.get(block)
+    def get(self, block=True, timeout=None):
+        r, s_conn, _ = self.queue.get(block, timeout)
         return r, s_conn
 
+    def get_stamped(self, block=True, timeout=None):
+        """Like get, with the time at which the request was sent as a third element."""
+        return self.queue.get(block, timeout)
+
 
 class ServerClientConnThrd:
     def __init__(self, conn_num):
@@ -91,6 +105,110 @@ class ServerClientConnThrd:
         r, conn = self.queue.get(block)
         return r, conn
 
+class ServerClientConnShm:
+    """
+    Request-response connection for NumPy arrays through shared memory. Every connection owns a slot of the
+    shared input and output arrays. The client writes the input in its slot, only (slot index, number of rows)
+    goes through the queue, and the server writes the outputs in the same slot. The server side gets the
+    requests like ServerClientConn, the input is a view of the slot and the connection has send((outputs)).
+    The arrays are created before the processes are forked.
+
+    Args:
+        conn_num: The number of slots
+        max_rows: The maximum number of rows in one request
+        input_shape: The shape of one input row
+        input_dtype: The dtype of the input
+        output_shapes: A list of the shapes of one row of every output, () for a scalar
+        output_dtype: The dtype of the outputs
+    """
+
+    def __init__(self, conn_num, max_rows, input_shape, input_dtype, output_shapes, output_dtype=np.float32):
+        self.queue = mp.Queue(conn_num)
+        self.conn_num = conn_num
+        self.max_rows = max_rows
+        self.conn_idx_queue = mp.Queue(self.conn_num)
+        self.inputs = self._shared_array((conn_num, max_rows) + tuple(input_shape), input_dtype)
+        self.outputs = [self._shared_array((conn_num, max_rows) + tuple(shape), output_dtype)
+                        for shape in output_shapes]
+        self.ready = [mp.Semaphore(0) for _ in range(conn_num)]
+        for i in range(self.conn_num):
+            self.conn_idx_queue.put(i)
+
+    @staticmethod
+    def _shared_array(shape, dtype):
+        dtype = np.dtype(dtype)
+        buf = mp.RawArray('b', int(np.prod(shape)) * dtype.itemsize)
+        return np.frombuffer(buf, dtype=dtype).reshape(shape)
+
+    def req(self, r):
+        return self.recv_res(self.send_req(r))
+
+    def send_req(self, r):
+        """Writes a request in a free slot without waiting for the response, recv_res(ticket) gets it."""
+        n = r.shape[0]
+        if n > self.max_rows:
+            raise ValueError('Request of %d rows exceeds the slot size %d' % (n, self.max_rows))
+        i = self.conn_idx_queue.get()
+        self.inputs[i, :n] = r
+        self.queue.put((i, n, time.time()))
+        return i, n
+
+    def recv_res(self, ticket):
+        i, n = ticket
+        self.ready[i].acquire()
+        res = tuple(output[i, :n].copy() for output in self.outputs)
+        self.conn_idx_queue.put(i)
+        return res
+
+    def get(self, block=True, timeout=None):
+        return self.get_stamped(block, timeout)[:2]
+
+    def get_stamped(self, block=True, timeout=None):
+        """Like get, with the time at which the request was sent as a third element."""
+        i, n, sent = self.queue.get(block, timeout)
+        return self.inputs[i, :n], _ShmSlotConn(self, i, n), sent
+
+
+class _ShmSlotConn:
+    """The server side of a slot of ServerClientConnShm"""
+
+    def __init__(self, shm_conn, idx, rows):
+        self.shm_conn = shm_conn
+        self.idx = idx
+        self.rows = rows
+
+    def send(self, res):
+        for output, r in zip(self.shm_conn.outputs, res):
+            output[self.idx, :self.rows] = r
+        self.shm_conn.ready[self.idx].release()
+
+
+class WorkerStats:
+    """
+    Counts the games finished by every worker of a pool. The counters are in shared memory, so that the workers
+    update them and any process reads them.
+
+    Args:
+        num_worker: The number of workers
+    """
+
+    def __init__(self, num_worker):
+        self.games = mp.Array('i', num_worker)
+        self.start_time = mp.Value('d', time.time())
+
+    def add_game(self, worker_id):
+        with self.games.get_lock():
+            self.games[worker_id] += 1
+
+    def games_per_hour(self):
+        """
+        Returns:
+            list: the number of games per hour of every worker since the pool started
+        """
+        hours = max(time.time() - self.start_time.value, 1e-6) / 3600
+        return [games / hours for games in self.games[:]]
+
+
 def Block_Pipe():
     bc = Block_Conn()
     return bc, bc
@@ -0,0 +1,43 @@
+"""
+Micro-benchmark of random m,n,k games played with AlphaZero.env.mnk.GameState, for several board shapes
+in one process. The game config of each shape is passed to the state, mnk.yaml is not read.
+
+Example:
+    When at the root directory of this repo, execute the following command.
+
+        $ python -m benchmarks.bench_mnk -g 3,3,3 6,5,4 15,15,5
+"""
+
+import argparse
+import random
+import timeit
+
+from AlphaZero.env import mnk
+
+
+def play_random_game(game_config, rng):
+    """ Plays a random game of the given shape to the end.
+
+    Returns:
+        int: the number of moves played
+    """
+    state = mnk.GameState(game_config=game_config)
+    while not state.is_end_of_game:
+        state.do_move(rng.choice(state.get_legal_moves()))
+    return state.turns
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of random m,n,k games.')
+    parser.add_argument('-g', type=str, nargs='+', help='Games as m,n,k.', default=['3,3,3', '6,5,4', '15,15,5'])
+    parser.add_argument('-n', type=int, help='Number of games to time.', default=500)
+    args = parser.parse_args()
+
+    print('{:>10} {:>10} {:>14}'.format('m,n,k', 'games/s', 'move (us)'))
+    for game in args.g:
+        m, n, k = [int(v) for v in game.split(',')]
+        config = {'board_height': m, 'board_width': n, 'k': k}
+        rng = random.Random(0)
+        moves = []
+        t = timeit.timeit(lambda: moves.append(play_random_game(config, rng)), number=args.n)
+        print('{:>10} {:>10.1f} {:>14.1f}'.format(game, args.n / t, t / sum(moves) * 1e6))
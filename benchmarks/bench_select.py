@@ -0,0 +1,51 @@
+"""
+Micro-benchmark of the child selection in MCTS: MCTreeNode.select, which calls get_selection_value for
+every child, against VectorizedMCTreeNode.select, which computes Q(s,a)+U(s,a) with one NumPy operation.
+
+Example:
+    When at the root directory of this repo, execute the following command.
+
+        $ python -m benchmarks.bench_select
+"""
+
+import argparse
+import random
+import timeit
+
+from AlphaZero.search.mcts import MCTreeNode, VectorizedMCTreeNode
+
+
+def make_node(node_cls, num_children, num_visits, seed=0):
+    """ Creates an expanded node and visits its children randomly.
+    """
+    rng = random.Random(seed)
+    priors = [rng.random() for _ in range(num_children)]
+    total = sum(priors)
+    node = node_cls(None, 1.0)
+    node.expand([(i, p / total) for i, p in enumerate(priors)], 0)
+    actions = list(node.children.keys())
+    for _ in range(num_visits):
+        node.visit()
+        child = node.children[rng.choice(actions)]
+        child.visit()
+        child.update(rng.uniform(-1, 1))
+    return node
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of MCTS child selection.')
+    parser.add_argument('-c', type=int, help='Number of children.', default=362)
+    parser.add_argument('-v', type=int, help='Number of visits to the children.', default=800)
+    parser.add_argument('-n', type=int, help='Number of selections to time.', default=2000)
+    args = parser.parse_args()
+
+    node = make_node(MCTreeNode, args.c, args.v)
+    vec_node = make_node(VectorizedMCTreeNode, args.c, args.v)
+    assert node.select()[0] == vec_node.select()[0], 'The two selections disagree'
+
+    t_node = timeit.timeit(node.select, number=args.n) / args.n
+    t_vec = timeit.timeit(vec_node.select, number=args.n) / args.n
+    print('children: {}, visits: {}'.format(args.c, args.v))
+    print('MCTreeNode.select:           {:8.2f} us'.format(t_node * 1e6))
+    print('VectorizedMCTreeNode.select: {:8.2f} us'.format(t_vec * 1e6))
+    print('speedup: {:.1f}x'.format(t_node / t_vec))
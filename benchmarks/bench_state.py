@@ -0,0 +1,45 @@
+"""
+Micro-benchmark of the construction and the copy of Go game states, for the set based
+AlphaZero.env.go.GameState and the flat array AlphaZero.env.go_array.GameState.
+The states are copied after a number of random moves, since a copy is made in the middle of a game.
+
+Example:
+    When at the root directory of this repo, execute the following command.
+
+        $ python -m benchmarks.bench_state
+"""
+
+import argparse
+import random
+import timeit
+
+from AlphaZero.env import go, go_array
+
+
+def make_state(module, size, num_moves, seed=0):
+    """ Creates a state of the given size and plays random legal moves on it.
+    """
+    rng = random.Random(seed)
+    state = module.GameState(size)
+    for _ in range(num_moves):
+        moves = state.get_legal_moves(include_eyes=False)
+        if not moves:
+            break
+        state.do_move(rng.choice(moves))
+    return state
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of Go state construction and copy.')
+    parser.add_argument('-s', type=int, nargs='+', help='Board sizes.', default=[9, 13, 19])
+    parser.add_argument('-m', type=float, help='Fraction of the board played before the copy.', default=0.3)
+    parser.add_argument('-n', type=int, help='Number of repetitions to time.', default=200)
+    args = parser.parse_args()
+
+    print('{:>5} {:>10} {:>14} {:>14}'.format('size', 'backend', 'construct (us)', 'copy (us)'))
+    for size in args.s:
+        for name, module in [('go', go), ('go_array', go_array)]:
+            state = make_state(module, size, int(args.m * size * size))
+            t_init = timeit.timeit(lambda: module.GameState(size), number=args.n) / args.n
+            t_copy = timeit.timeit(state.copy, number=args.n) / args.n
+            print('{:>5} {:>10} {:>14.1f} {:>14.1f}'.format(size, name, t_init * 1e6, t_copy * 1e6))
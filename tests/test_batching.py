@@ -0,0 +1,78 @@
+import queue
+import threading as thrd
+import time
+import unittest
+
+import numpy as np
+
+from AlphaZero.evaluator.batching import BatchingPolicy, request_in_chunks
+from AlphaZero.train.parallel.util import ServerClientConn
+
+
+class TestBatchingPolicy(unittest.TestCase):
+    def setUp(self):
+        self.queue = queue.Queue()
+
+    def get(self, block, timeout):
+        return self.queue.get(block, timeout)
+
+    def put(self, num_states, sent=None):
+        self.queue.put((np.zeros((num_states, 1)), None, time.time() if sent is None else sent))
+
+    def test_target_batch_size(self):
+        policy = BatchingPolicy(4, max_wait_us=10 ** 6)
+        for _ in range(6):
+            self.put(1)
+        self.assertEqual(4, len(policy.collect(self.get)))
+        self.assertEqual(1, policy.batch_size_histogram()[4])
+
+    def test_deadline(self):
+        policy = BatchingPolicy(8, max_wait_us=20000)
+        self.put(2)
+        start = time.time()
+        reqs = policy.collect(self.get)
+        self.assertGreaterEqual(time.time() - start, 0.02)
+        self.assertEqual(1, len(reqs))
+        self.assertEqual(1, policy.batch_size_histogram()[2])
+        # At least 20000 microseconds
+        self.assertEqual(1, policy.wait_histogram()[15:].sum())
+
+    def test_queue_wait(self):
+        # The request was sent 30 ms before it is received, the deadline has already passed
+        policy = BatchingPolicy(8, max_wait_us=20000)
+        self.put(1, time.time() - 0.03)
+        self.put(2)
+        thrd.Timer(0.05, self.put, (4,)).start()
+        start = time.time()
+        reqs = policy.collect(self.get)
+        self.assertLess(time.time() - start, 0.02)
+        # The partial batch is flushed with the requests already queued
+        self.assertEqual(2, len(reqs))
+        self.assertEqual(3.0, policy.mean_batch_size())
+        # At least 30000 microseconds
+        self.assertEqual(1, policy.wait_histogram()[15:].sum())
+
+
+class TestRequestInChunks(unittest.TestCase):
+    def test_one_forward_pass(self):
+        # The 10 leaves of a multiplexed step are sent in requests of at most 4 states
+        conn = ServerClientConn(8)
+        policy = BatchingPolicy(10, max_wait_us=10 ** 6)
+        calls = []
+
+        def response(states_np):
+            calls.append(states_np.shape[0])
+            return states_np * 2, states_np.sum(axis=1)
+
+        server = thrd.Thread(target=policy.serve, args=(conn.get_stamped, response))
+        server.start()
+        states_np = np.arange(20).reshape((10, 2))
+        rp, rv = request_in_chunks(conn, states_np, 4)
+        server.join()
+        self.assertEqual([10], calls)
+        np.testing.assert_array_equal(states_np * 2, rp)
+        np.testing.assert_array_equal(states_np.sum(axis=1), rv)
+
+
+if __name__ == '__main__':
+    unittest.main()
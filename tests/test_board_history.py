@@ -0,0 +1,57 @@
+import unittest
+
+import numpy as np
+
+from AlphaZero.env.board_history import BoardHistory
+
+
+class TestBoardHistory(unittest.TestCase):
+    def setUp(self):
+        self.boards = [np.full((3, 4), i, dtype=int) for i in range(1, 6)]
+
+    def test_push_order(self):
+        history = BoardHistory(3, 3, 4)
+        for board in self.boards:
+            history.push(board)
+        self.assertEqual((3, 3, 4), history.ordered().shape)
+        self.assertEqual([3, 4, 5], [b[0, 0] for b in history])
+        np.testing.assert_array_equal(self.boards[-1], history[-1])
+
+    def test_pop(self):
+        history = BoardHistory(3, 3, 4)
+        for board in self.boards[:4]:
+            history.push(board)
+        oldest = history[0].copy()
+        history.push(self.boards[4])
+        newest = history.pop(oldest)
+        np.testing.assert_array_equal(self.boards[4], newest)
+        self.assertEqual([2, 3, 4], [b[0, 0] for b in history])
+
+    def test_empty(self):
+        history = BoardHistory(0, 3, 4)
+        self.assertEqual(0, len(history))
+        oldest = history.next_dropped(self.boards[0])
+        history.push(self.boards[0])
+        np.testing.assert_array_equal(self.boards[0], history.pop(oldest))
+        self.assertEqual([], list(history))
+
+    def test_copy(self):
+        history = BoardHistory(3, 3, 4)
+        history.push(self.boards[0])
+        other = history.copy()
+        other.push(self.boards[1])
+        self.assertEqual([0, 0, 1], [b[0, 0] for b in history])
+        self.assertEqual([0, 1, 2], [b[0, 0] for b in other])
+
+    def test_transform(self):
+        history = BoardHistory(2, 3, 3)
+        board = np.arange(9).reshape((3, 3))
+        history.push(board)
+        history.transform(5)
+        np.testing.assert_array_equal(np.rot90(np.fliplr(board), 1), history[-1])
+        history.push(board)
+        np.testing.assert_array_equal(board, history[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import multiprocessing as mp
+import unittest
+
+from AlphaZero.env.go import GameState
+from AlphaZero.evaluator.eval_cache import EvalCache
+
+
+class TestEvalCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = EvalCache(2)
+        self.state = GameState(size=7)
+
+    def test_lru_eviction(self):
+        keys = []
+        for move in [(0, 0), (1, 1), (2, 2)]:
+            self.state.do_move(move)
+            keys.append(self.cache.key(self.state))
+            self.cache.store(keys[-1], move, self.cache.generation)
+        self.assertIsNone(self.cache.lookup(keys[0]))
+        self.assertEqual((1, 1), self.cache.lookup(keys[1]))
+        self.assertEqual((2, 2), self.cache.lookup(keys[2]))
+        self.assertEqual((2, 1), (self.cache.hits, self.cache.misses))
+
+    def test_key(self):
+        other = self.state.copy()
+        self.assertEqual(self.cache.key(self.state), self.cache.key(other))
+        other.transform(1)
+        self.assertNotEqual(self.cache.key(self.state), self.cache.key(other))
+        # Same board reached with different moves in the history
+        self.state.do_move((0, 0))
+        self.state.do_move((1, 1))
+        other = GameState(size=7)
+        other.do_move((0, 0))
+        other.do_move(None)
+        other.do_move((1, 1))
+        other.do_move(None)
+        self.assertNotEqual(self.cache.key(self.state), self.cache.key(other))
+
+    def test_invalidate_from_other_process(self):
+        key = self.cache.key(self.state)
+        self.cache.store(key, 'old', self.cache.generation)
+        generation = self.cache.generation
+        process = mp.Process(target=self.cache.invalidate)
+        process.start()
+        process.join()
+        self.assertIsNone(self.cache.lookup(key))
+        # An evaluation requested before the invalidation is dropped
+        self.cache.store(key, 'old', generation)
+        self.assertIsNone(self.cache.lookup(key))
+
+
+if __name__ == '__main__':
+    unittest.main()
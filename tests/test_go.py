@@ -0,0 +1,111 @@
+import random
+import unittest
+
+import numpy as np
+
+from AlphaZero.env import go, go_array
+from AlphaZero.env.go_scoring import area_score, territory
+
+
+def flood_fill(state, position):
+    """Finds the group and liberties of the stone at position without the cached sets"""
+    color = state.board[position]
+    group, liberties, stack = {position}, set(), [position]
+    while stack:
+        (x, y) = stack.pop()
+        for (nx, ny) in [(x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)]:
+            if not state._on_board((nx, ny)):
+                continue
+            if state.board[nx][ny] == go.EMPTY:
+                liberties.add((nx, ny))
+            elif state.board[nx][ny] == color and (nx, ny) not in group:
+                group.add((nx, ny))
+                stack.append((nx, ny))
+    return group, liberties
+
+
+class TestGoStateCopy(unittest.TestCase):
+    def setUp(self):
+        self.state = go.GameState(9)
+        for move in [(0, 0), (8, 8), (0, 1), (8, 7), None]:
+            self.state.do_move(move)
+
+    def test_tables_are_shared(self):
+        other = go.GameState(9)
+        self.assertIs(self.state.hash_lookup, other.hash_lookup)
+        self.assertIs(self.state.hash_lookup, self.state.copy().hash_lookup)
+        self.assertFalse(self.state.hash_lookup[go.BLACK].flags.writeable)
+
+    def test_groups_are_copied(self):
+        other = self.state.copy()
+        # The sets are shared within a group of the copy, but not with the original
+        self.assertIs(other.group_sets[0][0], other.group_sets[0][1])
+        self.assertIs(other.liberty_sets[0][0], other.liberty_sets[0][1])
+        self.assertIsNot(self.state.group_sets[0][0], other.group_sets[0][0])
+        other.do_move((1, 0))
+        self.assertEqual(3, self.state.liberty_counts[0][0])
+        self.assertEqual(2, other.liberty_counts[0][0])
+        self.assertEqual({(1, 0), (1, 1), (0, 2)}, self.state.liberty_sets[0][0])
+        self.assertEqual(self.state.passes_white, other.passes_white)
+
+    def test_copies_of_copies(self):
+        # Set copies must not be mixed up between successive copies
+        states = [self.state]
+        for move in [(4, 4), (4, 5), (3, 4), (3, 5)]:
+            states.append(states[-1].copy())
+            states[-1].do_move(move)
+        for state in states:
+            for x in range(state.size):
+                for y in range(state.size):
+                    if state.board[x][y] != go.EMPTY:
+                        group, liberties = flood_fill(state, (x, y))
+                        self.assertEqual(group, state.group_sets[x][y])
+                        self.assertEqual(liberties, state.liberty_sets[x][y])
+
+
+class TestSuperko(unittest.TestCase):
+    def test_hash_after_move(self):
+        rng = random.Random(0)
+        for module in (go, go_array):
+            for _ in range(5):
+                state = module.GameState(5, enforce_superko=True)
+                while not state.is_end_of_game and state.turns < 100:
+                    for action in state.get_legal_moves():
+                        after = state.copy()
+                        after.do_move(action)
+                        if module is go:
+                            new_hash = state._hash_after_move(action)
+                        else:
+                            new_hash = state._hash_after_move(state._to_point(action), state.current_player)
+                        self.assertEqual(int(after.current_hash), int(new_hash))
+                    state.do_move(rng.choice(state.get_legal_moves() + [None]))
+
+
+class TestScoring(unittest.TestCase):
+    def test_territory(self):
+        B, W, _ = go.BLACK, go.WHITE, go.EMPTY
+        board = np.array([[_, B, W, _, _],
+                          [B, B, W, _, _],
+                          [_, B, W, W, W],
+                          [_, B, W, _, W],
+                          [B, _, W, W, _]])
+        black_territory, white_territory = territory(board)
+        # The regions of more than one point count, the region touching both colors is neutral
+        self.assertEqual({(0, 0), (2, 0), (3, 0)}, set(zip(*np.nonzero(black_territory))))
+        self.assertEqual({(0, 3), (0, 4), (1, 3), (1, 4), (3, 3), (4, 4)}, set(zip(*np.nonzero(white_territory))))
+        self.assertEqual((go.WHITE, (7 + 3) - (10 + 6) - 0.5), area_score(board, 0.5))
+        self.assertEqual((go.BLACK, 0.5), area_score(np.array([[B, _], [_, _]]), 3.5))
+        self.assertEqual((0, 0), area_score(np.zeros((3, 3), dtype=int)))
+
+    def test_passes(self):
+        for module in (go, go_array):
+            state = module.GameState(5, komi=0.5)
+            for move in [(2, 2), None]:
+                state.do_move(move)
+            # BLACK owns the whole board, WHITE gets komi and its pass does not count
+            self.assertEqual((go.BLACK, 25 - 0.5), state.get_score())
+            self.assertEqual(go.BLACK, state.get_winner())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import random
+import unittest
+
+import numpy as np
+
+from AlphaZero.env import go, go_array
+
+
+class TestGoArrayState(unittest.TestCase):
+    def test_same_as_go(self):
+        rng = random.Random(0)
+        for _ in range(10):
+            size = rng.choice([5, 7, 9])
+            expected, state = go.GameState(size), go_array.GameState(size)
+            while not expected.is_end_of_game and expected.turns < 200:
+                legal_moves = sorted(expected.get_legal_moves())
+                self.assertEqual(legal_moves, sorted(state.get_legal_moves()))
+                self.assertEqual(expected.ko, state.ko)
+                self.assertEqual(int(expected.current_hash), state.current_hash)
+                np.testing.assert_array_equal(expected.liberty_counts, state.liberty_counts)
+                move = rng.choice(legal_moves + [None])
+                self.assertEqual(expected.do_move(move), state.do_move(move))
+                # Later moves must not change the copied states
+                state = state.copy()
+            np.testing.assert_array_equal(expected.board, state.board)
+            self.assertEqual(expected.get_winner(), state.get_winner())
+
+    def test_capture_and_ko(self):
+        state = go_array.GameState(5)
+        for move in [(1, 0), (2, 0), (0, 1), (3, 1), (1, 2), (2, 2), (4, 4), (1, 1)]:
+            state.do_move(move)
+        # Black captures (1, 1)
+        state.do_move((2, 1))
+        self.assertEqual(go.EMPTY, state.board[1, 1])
+        self.assertEqual(1, state.num_white_prisoners)
+        self.assertEqual((1, 1), state.ko)
+        self.assertFalse(state.is_legal((1, 1)))
+        self.assertEqual({(2, 1)}, state.get_group((2, 1)))
+
+    def test_copy_is_independent(self):
+        state = go_array.GameState(5)
+        state.do_move((2, 2))
+        other = state.copy()
+        other.do_move((2, 3))
+        self.assertEqual(go.EMPTY, state.board[2, 3])
+        self.assertEqual(1, len(state.history))
+        self.assertEqual(4, state.liberty_counts[2, 2])
+        self.assertEqual(3, other.liberty_counts[2, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
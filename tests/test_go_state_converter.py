@@ -1,8 +1,10 @@
+import random
 import unittest
 import numpy as np
 import yaml
 from AlphaZero.env.go import GameState
 from AlphaZero.processing.state_converter import StateTensorConverter
+from AlphaZero.processing.trackers import StoneAgeTracker
 
 with open('AlphaZero/config/go.yaml') as f:
     config = yaml.load(f)
@@ -235,5 +237,74 @@ class TestPreprocessingFeatures(unittest.TestCase):
         self.assertTrue(np.array_equal(feature[-1:, :, :], bd_c))
 
 
+class TestStatesToTensor(unittest.TestCase):
+    def test_batch(self):
+        pp = StateTensorConverter(config, ["board_history", "color"])
+        states = [empty_board(), start_board(), simple_board()]
+        single = np.concatenate([pp.state_to_tensor(gs) for gs in states])
+        self.assertEqual(np.int8, single.dtype)
+        np.testing.assert_array_equal(single, pp.states_to_tensor(states))
+        # A bigger caller buffer is filled from the first row, the rows after are left alone
+        out = np.full((4, pp.output_dim, 7, 7), 7, dtype=np.uint8)
+        batch = pp.states_to_tensor(states, out)
+        self.assertEqual((3, pp.output_dim, 7, 7), batch.shape)
+        np.testing.assert_array_equal(single, out[:3])
+        self.assertTrue(np.all(out[3] == 7))
+
+
+class TestStoneAgeTracker(unittest.TestCase):
+    def test_stone_ages(self):
+        gs = GameState(size=7)
+        gs.add_tracker("stone_age", StoneAgeTracker(7, 7))
+        gs.enable_undo()
+        # White captures the black stone at (0, 0) with its last move, played after a pass
+        for move in [(0, 0), (0, 1), (3, 3), None, (4, 4), (1, 0)]:
+            gs.do_move(move)
+        ages = gs.trackers["stone_age"].stone_ages(gs)
+        self.assertEqual(-1, ages[0, 0])
+        self.assertEqual([4, 3, 1, 0], [ages[0, 1], ages[3, 3], ages[4, 4], ages[1, 0]])
+        # The copies follow their own moves, undo brings the captured stone back with its age
+        other = gs.copy()
+        other.do_move((6, 6))
+        gs.undo_move()
+        self.assertEqual(2, other.trackers["stone_age"].stone_ages(other)[4, 4])
+        self.assertEqual(4, gs.trackers["stone_age"].stone_ages(gs)[0, 0])
+
+
+class TestIncrementalPlanes(unittest.TestCase):
+    def test_same_as_board_history(self):
+        config7 = dict(config, board_height=7, board_width=7)
+        pp = StateTensorConverter(config7)
+        pp_incremental = StateTensorConverter(dict(config7, incremental_planes=True))
+        gs = GameState(size=7)
+        pp_incremental.add_trackers(gs)
+        gs.enable_undo()
+        rng = random.Random(0)
+        for turn in range(60):
+            gs.do_move(rng.choice(gs.get_legal_moves() + [None]))
+            if turn % 5 == 4:
+                gs.undo_move()
+            transformed = gs.copy()
+            transformed.transform(turn % 8)
+            for state in (gs, transformed):
+                reference = state.copy()
+                reference.trackers = {}
+                np.testing.assert_array_equal(pp.state_to_tensor(reference), pp_incremental.state_to_tensor(state))
+
+    def test_handicaps(self):
+        config7 = dict(config, board_height=7, board_width=7)
+        pp = StateTensorConverter(config7)
+        pp_incremental = StateTensorConverter(dict(config7, incremental_planes=True))
+        gs = GameState(size=7)
+        pp_incremental.add_trackers(gs)
+        gs.place_handicaps([(2, 2), (4, 4), (2, 4)])
+        # Right after the handicaps, then after the first moves
+        for move in [(3, 3), (1, 1), None]:
+            reference = gs.copy()
+            reference.trackers = {}
+            np.testing.assert_array_equal(pp.state_to_tensor(reference), pp_incremental.state_to_tensor(gs))
+            gs.do_move(move)
+
+
 if __name__ == '__main__':
     unittest.main()
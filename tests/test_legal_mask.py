@@ -0,0 +1,50 @@
+import random
+import unittest
+
+from AlphaZero.env import go, go_array, mnk, reversi, reversi_bitboard
+
+
+class TestLegalMask(unittest.TestCase):
+    def _check_mask(self, new_state, num_games, max_turns, has_pass):
+        rng = random.Random(0)
+        for _ in range(num_games):
+            state = new_state()
+            while not state.is_end_of_game and state.turns < max_turns:
+                mask = state.legal_mask()
+                expected = [state.is_legal(divmod(i, state.width)) for i in range(state.height * state.width)]
+                if has_pass:
+                    expected.append(state.is_legal(None))
+                self.assertEqual(expected, mask.tolist())
+                state.do_move(rng.choice(state.get_legal_moves() or [None]))
+
+    def test_go(self):
+        self._check_mask(lambda: go.GameState(7, enforce_superko=True), 5, 100, True)
+
+    def test_go_array(self):
+        self._check_mask(lambda: go_array.GameState(7, enforce_superko=True), 5, 100, True)
+
+    def test_reversi(self):
+        self._check_mask(reversi.GameState, 5, 100, True)
+
+    def test_reversi_bitboard(self):
+        self._check_mask(reversi_bitboard.GameState, 5, 100, True)
+
+    def test_mnk(self):
+        self._check_mask(mnk.GameState, 5, 100, False)
+
+    def test_go_suicide_and_ko(self):
+        state = go.GameState(5)
+        for move in [(1, 0), (2, 0), (0, 1), (3, 1), (1, 2), (2, 2), (4, 4), (1, 1)]:
+            state.do_move(move)
+        # Black captures (1, 1)
+        state.do_move((2, 1))
+        mask = state.legal_mask()
+        # (1, 1) is the ko and (0, 0) is suicide for white
+        self.assertFalse(mask[1 * 5 + 1])
+        self.assertFalse(mask[0])
+        self.assertTrue(mask[0 * 5 + 2])
+        self.assertTrue(mask[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
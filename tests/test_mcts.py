@@ -1,9 +1,14 @@
+import time
 import unittest
 import numpy as np
 import yaml
 from operator import itemgetter
 from AlphaZero.env.go import GameState
-from AlphaZero.search.mcts import MCTreeNode, MCTSearch
+from AlphaZero.search.mcts import MCTreeNode, MCTSearch, VectorizedMCTreeNode
+from AlphaZero.search.array_tree import ArrayMCTSearch
+from AlphaZero.search.transposition import TranspositionTable, state_key
+from AlphaZero.env import mnk
+from AlphaZero.game.multiplex import MultiplexedSelfplay
 
 with open('tests/go_test.yaml') as f:
     config = yaml.load(f)
@@ -28,6 +33,53 @@ class TestTreeNode(unittest.TestCase):
         for a, p in random_policy(self.gs):
             self.assertEqual(p, self.node._children[a].prior_prob)
 
+    def test_expand_legal_list(self):
+        # Only some of the moves are listed, the children get their flat action indices
+        legal = [(0, 3), (5, 7), (18, 2), None]
+        flat = [3, 5 * 19 + 7, 18 * 19 + 2, 19 * 19]
+        for vectorized in (False, True):
+            mcts = MCTSearch(policy_value_generator(random_policy, zero_value), config, max_playout=20,
+                             vectorized=vectorized)
+            mcts._root.expand([(action, 0.25) for action in legal], 0.0, 19, 19)
+            np.testing.assert_array_equal(flat, mcts._root.child_indices())
+            move, policy = mcts.calc_move_with_policy(self.gs)
+            self.assertIn(move, legal)
+            self.assertEqual(19 * 19 + 1, len(policy))
+            self.assertEqual(set(flat), set(np.flatnonzero(policy).tolist()))
+            self.assertAlmostEqual(1.0, policy[flat].sum())
+            probs = mcts._get_search_probs()
+            self.assertEqual(legal, [action for action, _ in probs])
+            self.assertEqual(policy[flat].tolist(), [prob for _, prob in probs])
+
+
+class TestVectorizedTreeNode(unittest.TestCase):
+    def setUp(self):
+        self.gs = GameState()
+        self.node = VectorizedMCTreeNode(None, 1.0)
+        self.node.expand(random_policy(self.gs), zero_value(self.gs))
+        self.node.visit()
+
+    def test_selection(self):
+        action, next_node = self.node.select()
+        self.assertEqual(action, (18, 18))
+        self.assertIs(next_node, self.node.children[(18, 18)])
+        self.assertEqual(19 * 19 + 1, len(self.node.children))
+
+    def test_same_as_tree_node(self):
+        node = MCTreeNode(None, 1.0)
+        node.expand(random_policy(self.gs), zero_value(self.gs))
+        node.visit()
+        rng = np.random.RandomState(0)
+        actions = list(node.children.keys())
+        for _ in range(500):
+            action = actions[rng.randint(len(actions))]
+            value = rng.uniform(-1, 1)
+            for n in (node, self.node):
+                n.visit()
+                n.children[action].visit()
+                n.children[action].update(value)
+            self.assertEqual(node.select()[0], self.node.select()[0])
+
 
 class TestMCTS(unittest.TestCase):
     def setUp(self):
@@ -99,6 +151,426 @@ class TestMCTS(unittest.TestCase):
         self.assertEqual((18, 17), self.mcts._root.select()[0])
 
 
+class TestVectorizedMCTS(unittest.TestCase):
+    def test_same_as_node_tree(self):
+        gs = GameState()
+        node_mcts = MCTSearch(policy_value_generator(random_policy, constant_value), config, max_playout=30)
+        vec_mcts = MCTSearch(policy_value_generator(random_policy, constant_value), config, max_playout=30,
+                             vectorized=True)
+        self.assertEqual(node_mcts.calc_move_with_probs(gs)[1], vec_mcts.calc_move_with_probs(gs)[1])
+        move = vec_mcts.calc_move(gs, prop_exp=False)
+        vec_mcts.update_with_move(move)
+        self.assertIsNone(vec_mcts._root._parent)
+        self.assertTrue(vec_mcts._root.visit_count > 0)
+
+
+class TestBatchedMCTS(unittest.TestCase):
+    def setUp(self):
+        self.gs = GameState()
+        self.batch_sizes = []
+
+        def batch_evaluator(states):
+            self.batch_sizes.append(len(states))
+            return [(random_policy(state), zero_value(state)) for state in states]
+
+        self.batch_evaluator = batch_evaluator
+
+    def _check_search(self, mcts, total_val):
+        mcts.calc_move(self.gs)
+        # 20 playouts in batches of at most 8 leaves
+        self.assertEqual([8, 8, 4], self.batch_sizes)
+        # The virtual losses are all reverted, and the evaluator always returns 0
+        self.assertEqual(0, total_val())
+
+    def test_batched_playout(self):
+        mcts = MCTSearch(policy_value_generator(random_policy, zero_value), config, max_playout=20,
+                         batch_evaluator=self.batch_evaluator, batch_size=8)
+        self._check_search(mcts, lambda: sum(abs(n._total_action_val) for n in mcts._root.children.values()))
+        self.assertEqual(21, mcts._root.visit_count)
+        # The virtual loss spreads the pending paths over different children
+        self.assertEqual(20, len([n for n in mcts._root.children.values() if n.visit_count > 0]))
+
+    def test_batched_array_playout(self):
+        mcts = ArrayMCTSearch(policy_value_generator(random_policy, zero_value), config, max_playout=20,
+                              batch_evaluator=self.batch_evaluator, batch_size=8)
+        tree = mcts._tree
+        self._check_search(mcts, lambda: np.abs(tree.total_action_val[:tree.size]).sum())
+        self.assertEqual(21, tree.visit_cnt[mcts._root])
+
+
+class TestThreadedMCTS(unittest.TestCase):
+    def setUp(self):
+        self.gs = GameState()
+        self.batch_sizes = []
+
+        def batch_evaluator(states):
+            self.batch_sizes.append(len(states))
+            return [(random_policy(state), constant_value(state)) for state in states]
+
+        self.batch_evaluator = batch_evaluator
+
+    def test_threaded_playout(self):
+        mcts = MCTSearch(policy_value_generator(random_policy, constant_value), config, max_playout=50,
+                         batch_evaluator=self.batch_evaluator, num_threads=4)
+        mcts.calc_move(self.gs)
+        self.assertEqual(51, mcts._root.visit_count)
+        self.assertEqual(50, sum(self.batch_sizes))
+        self.assertTrue(max(self.batch_sizes) <= 4)
+        # Every playout has been backed up and the virtual losses are reverted.
+        # W(s,a) of the children is relative to black, who moves into them.
+        self.assertEqual(50, sum(n.visit_count for n in mcts._root.children.values()))
+        total_val = sum(n._total_action_val for n in mcts._root.children.values())
+        self.assertAlmostEqual(0.5 * 50, total_val)
+        self.assertFalse(mcts._threaded)
+
+    def test_threaded_array_playout(self):
+        mcts = ArrayMCTSearch(policy_value_generator(random_policy, constant_value), config, max_playout=50,
+                              batch_evaluator=self.batch_evaluator, num_threads=4)
+        mcts.calc_move(self.gs)
+        tree = mcts._tree
+        children = tree.children(mcts._root)
+        self.assertEqual(51, tree.visit_cnt[mcts._root])
+        self.assertEqual(50, tree.visit_cnt[children.start:children.stop].sum())
+        self.assertAlmostEqual(0.5 * 50, tree.total_action_val[children.start:children.stop].sum())
+
+    def test_threaded_array_reserve(self):
+        # The arrays are made large enough before the threads start and are not reallocated while they run
+        arrays = []
+
+        def batch_evaluator(states):
+            arrays.append(mcts._tree.visit_cnt)
+            return self.batch_evaluator(states)
+
+        mcts = ArrayMCTSearch(policy_value_generator(random_policy, constant_value), config, max_playout=50,
+                              capacity=1, batch_evaluator=batch_evaluator, num_threads=4)
+        mcts.calc_move(self.gs)
+        self.assertTrue(all(visit_cnt is arrays[-1] for visit_cnt in arrays[1:]))
+        self.assertEqual(51, mcts._tree.visit_cnt[mcts._root])
+
+    def test_error_in_evaluator(self):
+        def failing_evaluator(states):
+            raise ValueError('evaluation failed')
+
+        mcts = MCTSearch(policy_value_generator(random_policy, constant_value), config, max_playout=10,
+                         batch_evaluator=failing_evaluator, num_threads=2)
+        self.assertRaises(ValueError, mcts.calc_move, self.gs)
+
+
+class TestSearchBudget(unittest.TestCase):
+    def setUp(self):
+        self.gs = GameState()
+
+    def test_time_budget(self):
+        def slow_policy(state):
+            time.sleep(0.01)
+            return random_policy(state)
+
+        mcts = MCTSearch(policy_value_generator(slow_policy, zero_value), config, max_playout=1000)
+        start = time.time()
+        mcts.calc_move(self.gs, time_budget=0.1)
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertTrue(0 < mcts.num_playouts < 20)
+
+    def test_spent_time_budget(self):
+        for search, search_config, kwargs in [(MCTSearch, config, {}), (MCTSearch, config, dict(batch_size=4)),
+                                              (MCTSearch, config, dict(num_threads=2)),
+                                              (ArrayMCTSearch, config, dict(early_stop=True))]:
+            mcts = search(policy_value_generator(random_policy, zero_value), search_config, max_playout=100,
+                          **kwargs)
+            move, policy = mcts.calc_move_with_policy(self.gs, time_budget=0)
+            self.assertTrue(self.gs.is_legal(move))
+            self.assertTrue(mcts.num_playouts >= 1)
+            self.assertAlmostEqual(1.0, policy.sum())
+
+    def test_playout_budget(self):
+        mcts = MCTSearch(policy_value_generator(random_policy, zero_value), config, max_playout=1000)
+        mcts.calc_move(self.gs, max_playout=5)
+        self.assertEqual(5, mcts.num_playouts)
+        self.assertEqual(6, mcts._root.visit_count)
+
+    def test_early_stop(self):
+        # Nearly all the visits go to (18, 18)
+        mcts = MCTSearch(policy_value_generator(greedy_policy, zero_value), config, max_playout=100,
+                         early_stop=True)
+        self.assertEqual((18, 18), mcts.calc_move(self.gs, prop_exp=False))
+        self.assertTrue(mcts.num_playouts < 100)
+        counts = sorted(mcts._root.child_visit_counts())
+        self.assertTrue(counts[-1] - counts[-2] > 100 - mcts.num_playouts)
+
+    def test_early_stop_array(self):
+        mcts = ArrayMCTSearch(policy_value_generator(greedy_policy, zero_value), config, max_playout=100,
+                              early_stop=True, batch_size=4)
+        self.assertEqual((18, 18), mcts.calc_move(self.gs, prop_exp=False))
+        self.assertTrue(mcts.num_playouts < 100)
+
+
+class TestArrayMCTS(unittest.TestCase):
+    def setUp(self):
+        self.gs = GameState()
+        self.mcts = ArrayMCTSearch(policy_value_generator(random_policy, zero_value), config, max_playout=1,
+                                   capacity=16)
+        self.tree = self.mcts._tree
+
+    def _visit_count(self, node, action):
+        return self.tree.visit_cnt[self.tree.find_child(node, action[0] * 19 + action[1])]
+
+    def test_playout(self):
+        for _ in range(9):
+            self.mcts._playout(self.gs.copy(), self.mcts._root)
+        self.assertEqual(1, self._visit_count(self.mcts._root, (18, 18)))
+        # The root and 8 nodes below it are expanded, the arrays have grown on the way.
+        self.assertEqual(9, np.count_nonzero(self.tree.child_cnt[:self.tree.size]))
+        self.assertTrue(self.tree._capacity >= self.tree.size > 9 * 19 * 19)
+
+    def test_same_as_node_tree(self):
+        node_mcts = MCTSearch(policy_value_generator(random_policy, constant_value), config, max_playout=30)
+        array_mcts = ArrayMCTSearch(policy_value_generator(random_policy, constant_value), config,
+                                    max_playout=30)
+        node_probs = dict(node_mcts.calc_move_with_probs(self.gs)[1])
+        array_probs = dict(array_mcts.calc_move_with_probs(self.gs)[1])
+        self.assertEqual(node_probs.keys(), array_probs.keys())
+        for action, prob in node_probs.items():
+            self.assertAlmostEqual(prob, array_probs[action])
+
+    def test_update_with_move(self):
+        move = self.mcts.calc_move(self.gs)
+        self.gs.do_move(move)
+        root_visits = self._visit_count(self.mcts._root, move)
+        self.mcts.update_with_move(move)
+        # The subtree is moved to the front of the arrays
+        self.assertEqual(0, self.mcts._root)
+        self.assertEqual(-1, self.tree.parent[0])
+        self.assertEqual(root_visits, self.tree.visit_cnt[0])
+        self.assertTrue(self.tree.child_cnt[0] > 0)
+        for child in self.tree.children(0):
+            self.assertEqual(0, self.tree.parent[child])
+        self.assertEqual((18, 18), move)
+        self.assertEqual((18, 17), self.mcts._to_action(self.tree.action[self.tree.select(0)]))
+
+
+class TestLegalCandidates(unittest.TestCase):
+    def test_mask_and_renormalize(self):
+        mcts = MCTSearch(policy_value_generator(random_policy, zero_value), config)
+        gs = GameState(5)
+        gs.do_move((2, 2))
+        candidates = [((x, y), 0.02) for x in range(5) for y in range(5)] + [(None, 0.5)]
+        priors, legal_mask = mcts._legal_candidates(gs, candidates, None)
+        self.assertEqual(25, np.count_nonzero(legal_mask))
+        self.assertFalse(legal_mask[2 * 5 + 2])
+        self.assertEqual(0, priors[2 * 5 + 2])
+        self.assertAlmostEqual(0.5 / 0.98, priors[-1])
+        self.assertAlmostEqual(1.0, priors.sum())
+
+    def test_flat_policy(self):
+        mcts = MCTSearch(policy_value_generator(random_policy, zero_value), config)
+        gs = GameState(5)
+        gs.do_move((2, 2))
+        candidates = [((x, y), 0.02) for x in range(5) for y in range(5)] + [(None, 0.5)]
+        policy = np.array([prob for _, prob in candidates])
+        for expected, result in zip(mcts._legal_candidates(gs, candidates, None),
+                                    mcts._legal_candidates(gs, policy, None)):
+            self.assertTrue(np.array_equal(expected, result))
+
+    def test_flat_policy_transformed(self):
+        # The reverse transforms are built for the board size of the config
+        transform_config = dict(config, board_width=19, board_height=19, flat_move_output=19 * 19 + 1,
+                                transform_types=8)
+        mcts = MCTSearch(policy_value_generator(random_policy, zero_value), transform_config)
+        gs = GameState(19)
+        gs.do_move((3, 4))
+        policy = np.append(dummy_distribution, 0.1)
+        candidates = [(action, prob) for (action, _), prob in zip(random_policy(gs), policy)]
+        for transform_id in range(8):
+            expected = mcts._legal_candidates(gs, candidates, transform_id)
+            result = mcts._legal_candidates(gs, policy, transform_id)
+            self.assertTrue(np.allclose(expected[0], result[0]))
+            self.assertTrue(np.array_equal(expected[1], result[1]))
+
+
+class TestFlatPolicyMCTS(unittest.TestCase):
+    def test_same_as_tuple_policy(self):
+        def flat_policy(state):
+            return np.array([prob for _, prob in random_policy(state)])
+
+        gs = GameState()
+        for search, search_config, options in [(MCTSearch, config, {}), (MCTSearch, config, {'vectorized': True}),
+                                               (ArrayMCTSearch, config, {})]:
+            tuple_mcts = search(policy_value_generator(random_policy, constant_value), search_config,
+                                max_playout=30, **options)
+            flat_mcts = search(policy_value_generator(flat_policy, constant_value), search_config,
+                               max_playout=30, **options)
+            probs = tuple_mcts.calc_move_with_probs(gs)[1]
+            _, policy = flat_mcts.calc_move_with_policy(gs)
+            self.assertEqual((19 * 19 + 1,), policy.shape)
+            self.assertAlmostEqual(1.0, policy.sum())
+            for (x, y), prob in probs[:-1]:
+                self.assertAlmostEqual(prob, policy[x * 19 + y])
+
+
+class TestUndoMCTS(unittest.TestCase):
+    def test_same_as_copy(self):
+        gs = GameState()
+        for search, search_config in [(MCTSearch, config), (ArrayMCTSearch, config)]:
+            copy_mcts = search(policy_value_generator(random_policy, constant_value), search_config,
+                               max_playout=30)
+            undo_mcts = search(policy_value_generator(random_policy, constant_value), search_config,
+                               max_playout=30, undo_moves=True)
+            self.assertEqual(copy_mcts.calc_move_with_probs(gs)[1], undo_mcts.calc_move_with_probs(gs)[1])
+        self.assertEqual(0, len(gs.history))
+
+    def test_generator_search(self):
+        with open('AlphaZero/config/mnk.yaml') as f:
+            mnk_config = yaml.load(f)
+        evaluator = UniformMNKEvaluator()
+        state = mnk.GameState()
+        copy_mcts = MCTSearch(evaluator.eval, mnk_config, max_playout=50)
+        undo_mcts = MCTSearch(evaluator.eval, mnk_config, max_playout=50, undo_moves=True)
+        search = undo_mcts.calc_move_with_probs_gen(state)
+        try:
+            leaf_state = next(search)
+            while True:
+                leaf_state = search.send(evaluator.eval(leaf_state))
+        except StopIteration as stop:
+            _, probs = stop.value
+        self.assertEqual(copy_mcts.calc_move_with_probs(state)[1], probs)
+        self.assertEqual(0, state.turns)
+
+
+class TestTransposition(unittest.TestCase):
+    def setUp(self):
+        with open('AlphaZero/config/mnk.yaml') as f:
+            self.mnk_config = yaml.load(f)
+        self.num_evals = 0
+
+    def counted_policy_value(self, state):
+        self.num_evals += 1
+        moves = [(x, y) for x in range(state.height) for y in range(state.width)]
+        # Most of the prior is on four moves, which are played in different orders
+        policy = [(move, 0.2 / len(moves)) for move in moves]
+        policy[:4] = [(move, 0.2) for move, _ in policy[:4]]
+        return policy, 0.0
+
+    def test_lru_eviction(self):
+        table = TranspositionTable(2)
+        table.store('a', [], 0.1)
+        table.store('b', [], 0.2)
+        self.assertIsNotNone(table.lookup('a'))
+        table.store('c', [], 0.3)
+        # 'b' is the least recently used
+        self.assertIsNone(table.lookup('b'))
+        self.assertEqual(0.1, table.lookup('a')[1])
+        self.assertEqual(2, len(table))
+        self.assertEqual((2, 1), (table.hits, table.misses))
+
+    def test_transposed_key(self):
+        s1, s2 = mnk.GameState(), mnk.GameState()
+        for move in [(0, 0), (1, 1), (2, 2)]:
+            s1.do_move(move)
+        for move in [(2, 2), (1, 1), (0, 0)]:
+            s2.do_move(move)
+        self.assertEqual(state_key(s1), state_key(s2))
+        s2.do_move((3, 3))
+        self.assertNotEqual(state_key(s1), state_key(s2))
+
+    def test_fewer_evaluations(self):
+        num_evals = []
+        for table in (None, TranspositionTable(1000)):
+            self.num_evals = 0
+            mcts = MCTSearch(self.counted_policy_value, self.mnk_config, max_playout=300,
+                             transposition_table=table)
+            mcts.calc_move(mnk.GameState())
+            num_evals.append(self.num_evals)
+        self.assertLess(num_evals[1], num_evals[0])
+        self.assertGreater(table.hits, 0)
+
+    def test_shared_statistics(self):
+        table = TranspositionTable(1000)
+        mcts = MCTSearch(policy_value_generator(greedy_policy, constant_value), config, max_playout=20,
+                         transposition_table=table)
+        mcts.calc_move(GameState(size=19))
+        # The value of an expanded position is its mean action value
+        state = GameState(size=19)
+        state.do_move((18, 18))
+        node = mcts._root.children[(18, 18)]
+        _, value = mcts._lookup_transposition(state)
+        self.assertAlmostEqual(-state.current_player * node.get_mean_action_value(), value)
+
+    def test_root_and_leaf_values(self):
+        def policy_value(state):
+            # All the prior is on the first legal move
+            moves = state.get_legal_moves()
+            return [(move, 1.0 if move == moves[0] else 0.0) for move in moves], 0.5
+
+        # The position after (0, 0) and (0, 1), black to move, is expanded once as a leaf and once as a root
+        state = mnk.GameState()
+        leaf_mcts = MCTSearch(policy_value, self.mnk_config, max_playout=2,
+                              transposition_table=TranspositionTable(100))
+        leaf_mcts.calc_move(state)
+        leaf = leaf_mcts._root.children[(0, 0)].children[(0, 1)]
+        state.do_move((0, 0))
+        state.do_move((0, 1))
+        root_mcts = MCTSearch(policy_value, self.mnk_config, transposition_table=TranspositionTable(100))
+        root_mcts._prepare_root(state)
+        self.assertEqual(leaf.visit_count, root_mcts._root.visit_count)
+        self.assertAlmostEqual(leaf.get_mean_action_value(), root_mcts._root.get_mean_action_value())
+        self.assertAlmostEqual(leaf_mcts._lookup_transposition(state)[1], root_mcts._lookup_transposition(state)[1])
+
+        array_mcts = ArrayMCTSearch(policy_value, self.mnk_config)
+        array_mcts._prepare_root(state)
+        tree = array_mcts._tree
+        self.assertAlmostEqual(leaf.get_mean_action_value(),
+                               tree.total_action_val[array_mcts._root] / tree.visit_cnt[array_mcts._root])
+
+
+class UniformMNKEvaluator(object):
+    def __init__(self):
+        self.num_evals = 0
+
+    def eval(self, state):
+        self.num_evals += 1
+        moves = [(x, y) for x in range(state.height) for y in range(state.width)]
+        return [(move, 1.0 / len(moves)) for move in moves], 0.0
+
+    def eval_batch(self, states):
+        return [self.eval(state) for state in states]
+
+
+class TestMultiplexedSelfplay(unittest.TestCase):
+    def setUp(self):
+        with open('AlphaZero/config/mnk.yaml') as f:
+            self.mnk_config = yaml.load(f)
+        self.ext_config = {'player': {'max_playout': 10}, 'dirichlet_before': 0, 'log_iter': 1000, 'max_turn': 100}
+
+    def test_generator_search(self):
+        evaluator = UniformMNKEvaluator()
+        mcts = MCTSearch(evaluator.eval, self.mnk_config, max_playout=30)
+        search = mcts.calc_move_with_probs_gen(mnk.GameState())
+        num_yields = 0
+        try:
+            state = next(search)
+            while True:
+                num_yields += 1
+                state = search.send(evaluator.eval(state))
+        except StopIteration as stop:
+            move, probs = stop.value
+        self.assertIn(move, [action for action, _ in probs])
+        self.assertAlmostEqual(1.0, sum(prob for _, prob in probs))
+        self.assertEqual(31, num_yields)
+        self.assertEqual(30, mcts.num_playouts)
+
+    def test_play(self):
+        evaluator = UniformMNKEvaluator()
+        selfplay = MultiplexedSelfplay(evaluator, self.mnk_config, self.ext_config, 4)
+        winners = []
+        for game in selfplay.play(max_games=6):
+            self.assertTrue(game.state.is_end_of_game)
+            self.assertEqual(len(game.state.history), len(game.get_history()[0]))
+            winners.append(game.winner)
+        self.assertEqual(6, len(winners))
+        self.assertEqual(evaluator.num_evals, selfplay.num_states)
+        self.assertGreater(selfplay.mean_batch_size(), 2)
+
+
 # A distribution over positions that is smallest at (0,0) and largest at (18,18)
 dummy_distribution = np.arange(361, dtype=np.float)
 dummy_distribution = dummy_distribution / dummy_distribution.sum()
@@ -112,6 +584,12 @@ def random_policy(state):
     return policy
 
 
+def greedy_policy(state):
+    policy = [(move, 0.001 / 360) for move, _ in random_policy(state)]
+    policy[-2] = ((18, 18), 0.999)
+    return policy
+
+
 def zero_value(state):
     # it's not very confident
     return 0.0
@@ -0,0 +1,61 @@
+import unittest
+
+from AlphaZero.env import mnk
+
+
+class TestMNKWinner(unittest.TestCase):
+    def _play(self, game_config, black_moves, white_moves):
+        state = mnk.GameState(game_config=game_config)
+        for black, white in zip(black_moves, white_moves + [None]):
+            state.do_move(black)
+            if white is not None and not state.is_end_of_game:
+                state.do_move(white)
+        return state
+
+    def test_lines(self):
+        config = {'board_height': 6, 'board_width': 5, 'k': 4}
+        white = [(5, 0), (5, 1), (5, 2)]
+        # vertical, horizontal, diagonal \ and diagonal /, the last move fills the middle of the line
+        for line in [[(0, 0), (1, 0), (3, 0), (2, 0)], [(2, 0), (2, 1), (2, 3), (2, 2)],
+                     [(0, 1), (1, 2), (3, 4), (2, 3)], [(4, 0), (3, 1), (1, 3), (2, 2)]]:
+            state = self._play(config, line, white)
+            self.assertTrue(state.is_end_of_game)
+            self.assertEqual(mnk.BLACK, state.get_winner())
+
+    def test_no_wrap_around(self):
+        # (0, 3), (0, 4), (1, 0), (1, 1) are next to each other in the flat board but not on a line
+        config = {'board_height': 4, 'board_width': 5, 'k': 4}
+        state = self._play(config, [(0, 3), (0, 4), (1, 0), (1, 1)], [(3, 0), (3, 1), (3, 3)])
+        self.assertFalse(state.is_end_of_game)
+        self.assertIsNone(state.get_winner())
+
+    def test_shapes(self):
+        # Different shapes can be played in one process
+        tic_tac_toe = self._play({'board_height': 3, 'board_width': 3, 'k': 3},
+                                 [(0, 0), (1, 1), (2, 2)], [(0, 1), (0, 2)])
+        gomoku = self._play({'board_height': 15, 'board_width': 15, 'k': 5},
+                            [(7, 3), (7, 4), (7, 5), (7, 6)], [(0, 0), (0, 1), (0, 2), (0, 3)])
+        self.assertEqual(mnk.BLACK, tic_tac_toe.get_winner())
+        self.assertFalse(gomoku.is_end_of_game)
+        gomoku.do_move((7, 7))
+        self.assertEqual(mnk.BLACK, gomoku.get_winner())
+        self.assertEqual(225 - 9, len(gomoku.get_legal_moves()))
+
+    def test_draw(self):
+        state = self._play({'board_height': 3, 'board_width': 3, 'k': 3},
+                           [(0, 0), (0, 2), (1, 0), (2, 1), (2, 2)], [(0, 1), (1, 1), (2, 0), (1, 2)])
+        self.assertTrue(state.is_end_of_game)
+        self.assertEqual(0, state.get_winner())
+
+    def test_copy(self):
+        state = mnk.GameState()
+        state.do_move((0, 0))
+        other = state.copy()
+        other.do_move((1, 1))
+        self.assertTrue(state.is_legal((1, 1)))
+        self.assertFalse(other.is_legal((1, 1)))
+        self.assertEqual(state.k, other.k)
+
+
+if __name__ == '__main__':
+    unittest.main()
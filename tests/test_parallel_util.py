@@ -0,0 +1,34 @@
+import multiprocessing as mp
+import unittest
+
+import numpy as np
+
+from AlphaZero.train.parallel.util import ServerClientConnShm
+
+
+def serve(conn, num_reqs):
+    for _ in range(num_reqs):
+        r, s_conn = conn.get()
+        s_conn.send((r.reshape(r.shape[0], -1).astype(np.float32) * 2, r.sum(axis=(1, 2, 3)).astype(np.float32)))
+
+
+class TestServerClientConnShm(unittest.TestCase):
+    def test_request(self):
+        conn = ServerClientConnShm(4, 3, (2, 2, 2), np.int8, [(8,), ()])
+        server = mp.Process(target=serve, args=(conn, 2))
+        server.start()
+        for n in (1, 3):
+            r = np.arange(n * 8, dtype=np.int8).reshape((n, 2, 2, 2))
+            rp, rv = conn.req(r)
+            np.testing.assert_array_equal(r.reshape(n, -1) * 2, rp)
+            np.testing.assert_array_equal(r.sum(axis=(1, 2, 3)), rv)
+        server.join()
+
+    def test_too_many_rows(self):
+        conn = ServerClientConnShm(1, 2, (1,), np.int8, [()])
+        with self.assertRaises(ValueError):
+            conn.req(np.zeros((3, 1), dtype=np.int8))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import random
+import unittest
+
+import numpy as np
+
+from AlphaZero.env import reversi, reversi_bitboard
+
+
+class TestReversiBitboardState(unittest.TestCase):
+    def test_same_as_reversi(self):
+        rng = random.Random(0)
+        for _ in range(10):
+            expected, state = reversi.GameState(), reversi_bitboard.GameState()
+            while not expected.is_end_of_game:
+                legal_moves = sorted(expected.get_legal_moves())
+                self.assertEqual(legal_moves, sorted(state.get_legal_moves()))
+                self.assertEqual(int(expected.current_hash), state.current_hash)
+                np.testing.assert_array_equal(expected.board, state.board)
+                move = rng.choice(legal_moves or [None])
+                self.assertEqual(expected.do_move(move), state.do_move(move))
+                # Later moves must not change the copied states
+                state = state.copy()
+            self.assertEqual(expected.get_winner(), state.get_winner())
+            for expected_board, board in zip(expected.board_history, state.board_history):
+                np.testing.assert_array_equal(expected_board, board)
+
+    def test_flips(self):
+        state = reversi_bitboard.GameState()
+        # Black flips (3, 3) by playing at (2, 3)
+        state.do_move((2, 3))
+        self.assertEqual(reversi.BLACK, state.board[3, 3])
+        self.assertEqual(4, (state.board == reversi.BLACK).sum())
+        self.assertEqual(1, (state.board == reversi.WHITE).sum())
+        self.assertFalse(state.is_legal((2, 3)))
+        self.assertFalse(state.is_legal(None))
+        self.assertRaises(reversi.IllegalMove, state.do_move, (0, 0))
+        self.assertEqual(reversi.WHITE, state.current_player)
+
+    def test_copy_is_independent(self):
+        state = reversi_bitboard.GameState()
+        other = state.copy()
+        other.do_move((2, 3))
+        self.assertEqual(reversi.WHITE, state.board[3, 3])
+        self.assertEqual(0, len(state.history))
+        self.assertEqual(sorted(reversi.GameState().get_legal_moves()), sorted(state.get_legal_moves()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 import yaml
 import numpy as np
+from AlphaZero.env import dihedral
 from AlphaZero.env.go import GameState
 from AlphaZero.processing.state_converter import TensorActionConverter, StateTensorConverter, ReverseTransformer
 
@@ -99,3 +100,52 @@ class TestTransformers(unittest.TestCase):
             for i in range(7 * 7):
                 (x, y), p = fake_action_prob[i]
                 self.assertEqual(p, original_gs.board[x][y])
+
+    def test_reverse_partial_list(self):
+        reverse_transformer = ReverseTransformer(config)
+        original_gs = simple_board()
+        for transform_id in range(8):
+            gs = simple_board()
+            gs.transform(transform_id)
+            # Only some of the positions, in any order, with the pass move first
+            fake_action_prob = [(None, 0)] + [((i, j), gs.board[i][j]) for i in range(6, -1, -2) for j in range(7)]
+            reverse_transformer.reverse_transform(fake_action_prob, transform_id)
+            self.assertEqual((None, 0), fake_action_prob[0])
+            for (x, y), p in fake_action_prob[1:]:
+                self.assertEqual(p, original_gs.board[x][y])
+
+    def test_non_square_board(self):
+        reverse_transformer = ReverseTransformer(dict(config, board_height=3, board_width=4, flat_move_output=12))
+        board = np.arange(12).reshape((3, 4))
+        for transform_id in range(8):
+            if transform_id % 2 == 1:
+                self.assertRaises(ValueError, reverse_transformer.reverse_policy, np.zeros(12), transform_id)
+                self.assertRaises(ValueError, reverse_transformer.reverse_index, np.arange(12), transform_id)
+                continue
+            transformed = dihedral.transform(board, transform_id)
+            np.testing.assert_array_equal(board.ravel(),
+                                          reverse_transformer.reverse_policy(transformed.ravel(), transform_id))
+            action_prob = [((i, j), transformed[i, j]) for i in range(3) for j in range(4)]
+            reverse_transformer.reverse_transform(action_prob, transform_id)
+            for (x, y), p in action_prob:
+                self.assertEqual(p, board[x, y])
+
+    def test_permutations(self):
+        planes = np.arange(2 * 3 * 4).reshape((2, 3, 4))
+        for transform_id in range(8):
+            expected = np.flip(planes, 2) if transform_id // 4 == 1 else planes
+            expected = np.rot90(expected, transform_id % 4, axes=(1, 2))
+            np.testing.assert_array_equal(expected, dihedral.transform(planes, transform_id))
+
+    def test_reverse_index_and_policy(self):
+        reverse_transformer = ReverseTransformer(config)
+        original_gs = simple_board()
+        for transform_id in range(8):
+            gs = simple_board()
+            gs.transform(transform_id)
+            # The pass move stays in place
+            policy = np.append(gs.board.ravel(), 5)
+            np.testing.assert_array_equal(np.append(original_gs.board.ravel(), 5),
+                                          reverse_transformer.reverse_policy(policy, transform_id))
+            index = reverse_transformer.reverse_index(np.arange(7 * 7 + 1), transform_id)
+            np.testing.assert_array_equal(policy, np.append(original_gs.board.ravel(), 5)[index])
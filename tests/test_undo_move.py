@@ -0,0 +1,101 @@
+import random
+import unittest
+
+import numpy as np
+
+from AlphaZero.env import go, go_array, mnk, reversi, reversi_bitboard
+
+
+def snapshot(state):
+    return (state.board.tolist(), state.current_player, int(state.current_hash), state.is_end_of_game,
+            list(state.history), state.turns, [b.tolist() for b in state.board_history],
+            sorted(state.get_legal_moves()), getattr(state, 'ko', None))
+
+
+class TestUndoMove(unittest.TestCase):
+    def _check_undo(self, new_state, num_games, max_turns):
+        rng = random.Random(0)
+        for _ in range(num_games):
+            state = new_state()
+            state.enable_undo()
+            snapshots = []
+            while not state.is_end_of_game and state.turns < max_turns:
+                snapshots.append(snapshot(state))
+                state.do_move(rng.choice(state.get_legal_moves() or [None]))
+                # Take back one or two moves now and then
+                if rng.random() < 0.3:
+                    for _ in range(min(rng.randint(1, 2), len(snapshots))):
+                        state.undo_move()
+                        self.assertEqual(snapshots.pop(), snapshot(state))
+            while snapshots:
+                state.undo_move()
+                self.assertEqual(snapshots.pop(), snapshot(state))
+            self.assertRaises(Exception, state.undo_move)
+
+    def test_go(self):
+        self._check_undo(lambda: go.GameState(7), 5, 100)
+
+    def test_go_array(self):
+        self._check_undo(lambda: go_array.GameState(7), 5, 100)
+
+    def test_reversi(self):
+        self._check_undo(reversi.GameState, 3, 100)
+
+    def test_reversi_bitboard(self):
+        self._check_undo(reversi_bitboard.GameState, 3, 100)
+
+    def test_mnk(self):
+        self._check_undo(mnk.GameState, 3, 100)
+
+    def test_history_length_1(self):
+        # No history board is kept
+        self._check_undo(lambda: go.GameState(7, history_length=1), 2, 60)
+        self._check_undo(lambda: go_array.GameState(7, history_length=1), 2, 60)
+        self._check_undo(lambda: reversi.GameState(history_length=1), 2, 60)
+        self._check_undo(lambda: reversi_bitboard.GameState(history_length=1), 2, 60)
+        self._check_undo(lambda: mnk.GameState(history_length=1), 2, 60)
+
+    def test_go_groups_after_capture(self):
+        state = go.GameState(5)
+        state.enable_undo()
+        for move in [(1, 0), (2, 0), (0, 1), (3, 1), (1, 2), (2, 2), (4, 4), (1, 1)]:
+            state.do_move(move)
+        liberty_counts = state.liberty_counts.copy()
+        # Black captures (1, 1), then it is taken back
+        state.do_move((2, 1))
+        state.undo_move()
+        np.testing.assert_array_equal(liberty_counts, state.liberty_counts)
+        self.assertEqual({(1, 1)}, state.group_sets[1][1])
+        self.assertEqual({(2, 1)}, state.liberty_sets[1][1])
+        self.assertEqual(0, state.num_white_prisoners)
+
+    def test_go_merge(self):
+        state = go.GameState(5)
+        state.enable_undo()
+        for move in [(0, 0), (4, 4), (0, 2), (4, 3)]:
+            state.do_move(move)
+        # Black connects the two stones, then it is taken back
+        state.do_move((0, 1))
+        state.undo_move()
+        self.assertEqual({(0, 0)}, state.group_sets[0][0])
+        self.assertEqual({(0, 1), (1, 0)}, state.liberty_sets[0][0])
+        self.assertIsNot(state.liberty_sets[0][0], state.liberty_sets[0][2])
+        # The sets of a group are still shared by its stones
+        state.do_move((0, 1))
+        self.assertIs(state.group_sets[0][0], state.group_sets[0][2])
+        self.assertEqual(4, state.liberty_counts[0][0])
+
+    def test_copy_does_not_record(self):
+        state = go_array.GameState(5)
+        state.enable_undo()
+        state.do_move((2, 2))
+        other = state.copy()
+        other.do_move((1, 1))
+        self.assertRaises(go.IllegalMove, other.undo_move)
+        state.undo_move()
+        self.assertEqual(go.EMPTY, state.board[2, 2])
+        self.assertEqual(go.WHITE, other.board[1, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()